@@ -0,0 +1,190 @@
+"""
+Throughput/latency benchmarks against the local LEAP stand-in
+
+    python bench.py --requests 500 --latency 0.005 --workers 32
+    python bench.py --transport --requests 200
+
+Each run reports requests/sec and p50/p95/p99 latency for the sequential
+(new connection per request), pooled and concurrent call paths, and appends
+the results to a JSON file so that regressions show up against the previous
+run.  With --transport it instead compares the GET and POST transports
+against a stand-in compressing its responses, for a small request
+(get_server_details), a large request (update_rdns) and a large response
+(list_servers), adding the bytes sent and received per request.  Response
+sizes reflect the stand-in's compression, which applies to both transports.
+
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import requests
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+from singlehop.common import ConnectionPool
+from singlehop.leap import ServerModule
+from singlehop.standin import StandInServer
+
+class OneShotPool(object):
+    """
+    Pool stand-in that opens a new connection for every request, as
+    do_request did before connections were pooled
+
+    """
+    pool_size = 1
+
+    def get(self, url, **kwargs):
+        return requests.get(url, **kwargs)
+
+    def close(self):
+        pass
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values
+
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+def summarize(name, latencies, elapsed):
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+def run_calls(call, count):
+    start = time.time()
+    latencies = [timed(call) for i in range(count)]
+    return latencies, time.time() - start
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def run_sequential(sm, ids):
+    start = time.time()
+    latencies = [timed(sm.get_server_bandwidth, i) for i in ids]
+    return latencies, time.time() - start
+
+def run_concurrent(sm, ids, workers):
+    executor = ThreadPoolExecutor(workers)
+    start = time.time()
+    latencies = list(executor.map(lambda i: timed(sm.get_server_bandwidth, i), ids))
+    elapsed = time.time() - start
+    executor.shutdown()
+    return latencies, elapsed
+
+def module(endpoint_url, **kwargs):
+    return ServerModule(api_key='bench', client_id='1', password='bench',
+        endpoint_url=endpoint_url, **kwargs)
+
+def benchmark(count, latency, workers, fleet_size):
+    """
+    Runs every call path against a fresh stand-in server
+
+    :rtype: List of result dicts
+
+    """
+    results = []
+    with StandInServer(latency=latency, fleet_size=fleet_size) as srv:
+        url = srv.endpoint_url
+        ids = [s['server_id'] for s in module(url).list_servers()['servers']]
+        ids = (ids * (count // len(ids) + 1))[:count]
+        results.append(summarize('sequential',
+            *run_sequential(module(url, pool=OneShotPool()), ids)))
+        with module(url) as sm:
+            results.append(summarize('pooled', *run_sequential(sm, ids)))
+        with module(url, pool=ConnectionPool(pool_size=workers)) as sm:
+            results.append(summarize('concurrent', *run_concurrent(sm, ids, workers)))
+    return results
+
+def benchmark_transport(count, latency, fleet_size):
+    """
+    Runs small requests, large requests and large responses over each
+    transport against a fresh compressing stand-in server
+
+    :rtype: List of result dicts
+
+    """
+    results = []
+    with StandInServer(latency=latency, fleet_size=fleet_size, compress=True) as srv:
+        url = srv.endpoint_url
+        sm = module(url)
+        servers = sm.list_servers()['servers']
+        entries = {}
+        for server in servers[:20]:
+            for ip in sm.get_rdns_list(server['server_id'])['data']:
+                entries[ip] = 'reverse-%s.customer.example.com' % ip.replace('.', '-')
+        server_id = servers[0]['server_id']
+        for transport in ('get', 'post'):
+            with module(url, transport=transport) as sm:
+                calls = [
+                    ('small', lambda: sm.get_server_details(server_id)),
+                    ('large-req', lambda: sm.update_rdns(entries)),
+                    ('large-resp', lambda: sm.list_servers()),
+                ]
+                for name, call in calls:
+                    srv.reset_counters()
+                    result = summarize('%s-%s' % (transport, name), *run_calls(call, count))
+                    result['bytes_in'] = srv.bytes_in / float(count)
+                    result['bytes_out'] = srv.bytes_out / float(count)
+                    results.append(result)
+    return results
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def report(results, previous=None):
+    previous = dict((r['name'], r) for r in previous or [])
+    wire = any('bytes_in' in r for r in results)
+    print('%-15s %8s %10s %9s %9s %9s %8s' % ('path', 'requests', 'req/s',
+        'p50 ms', 'p95 ms', 'p99 ms', 'change') +
+        (' %9s %9s' % ('in B/req', 'out B/req') if wire else ''))
+    for r in results:
+        change = ''
+        prev = previous.get(r['name'])
+        if prev and prev['rps']:
+            change = '%+.1f%%' % ((r['rps'] - prev['rps']) / prev['rps'] * 100)
+        print('%-15s %8d %10.1f %9.2f %9.2f %9.2f %8s' % (r['name'], r['requests'],
+            r['rps'], r['p50'], r['p95'], r['p99'], change) +
+            (' %9d %9d' % (r.get('bytes_in', 0), r.get('bytes_out', 0)) if wire else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.002,
+        help='simulated server latency in seconds')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--fleet-size', type=int, default=200)
+    parser.add_argument('--transport', action='store_true',
+        help='compare the GET and POST transports instead')
+    parser.add_argument('--output', default='bench_results.json',
+        help='file the run is appended to')
+    args = parser.parse_args()
+    history = load_history(args.output)
+    if args.transport:
+        results = benchmark_transport(args.requests, args.latency, args.fleet_size)
+    else:
+        results = benchmark(args.requests, args.latency, args.workers, args.fleet_size)
+    previous = [h for h in history if h['args'].get('transport', False) == args.transport]
+    report(results, previous[-1]['results'] if previous else None)
+    history.append({'time': time.time(), 'args': vars(args), 'results': results})
+    with open(args.output, 'w') as f:
+        json.dump(history, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+import sys
+from singlehop.cli import main
+
+sys.exit(main())
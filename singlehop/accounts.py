@@ -0,0 +1,292 @@
+"""
+Client pool for many SingleHop accounts
+
+AccountPool holds the credentials of several client IDs.  Every account
+gets its own connection pool and rate budget, and bulk commands spread
+across accounts are scheduled fairly: workers are handed out round-robin
+and no account holds more than its share while others have work queued,
+so one large (or throttled) account cannot starve the rest of a sweep.
+
+    >>> pool = AccountPool({
+    ...     'acme': dict(api_key='key1', client_id='1001', password='pw1'),
+    ...     'globex': dict(api_key='key2', client_id='1002', password='pw2'),
+    ... }, rates={'*': (5, 10)}, max_workers=16)
+    >>> pool.server('acme').list_servers()
+    >>> ids = dict((name, [...]) for name in pool.names)
+    >>> for r in pool.bulk('get_server_bandwidth', ids):
+    ...     print(r.account, r.item, r.error or r.result)
+
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+from common import SingleHopError, ConnectionPool
+from leap import AccountModule, ServerModule
+from ratelimit import RateLimiter
+import settings
+
+CREDENTIALS = ('api_key', 'client_id', 'password')
+MODULES = {
+    'account': AccountModule,
+    'server': ServerModule,
+}
+
+AccountResult = namedtuple('AccountResult', 'account item result error')
+
+class AccountPool(object):
+    """
+    Modules for many accounts with per-account connections and rate budgets
+
+    :keyword accounts: Dict of account name to a dict of api_key, client_id
+        and password (settings.py is never consulted for these)
+    :keyword pool_size: Connections kept open per account (defaults to
+        settings.POOL_SIZE) ; also the most requests an account has in
+        flight during bulk
+    :keyword rates: (optional) RateLimiter rates ; each account draws from
+        its own buckets
+    :keyword max_workers: Concurrent requests across all accounts during
+        bulk (defaults to pool_size)
+    :keyword cache: (optional) Callable taking an account name and returning
+        its cache (i.e. a SqliteCache per account)
+    :keyword kwargs: Other module keywords (endpoint_url, timeout,
+        transport, records, metrics, hedge) shared by every account
+
+    """
+    def __init__(self, accounts=None, pool_size=None, rates=None, \
+        max_workers=None, cache=None, **kwargs):
+        for key in CREDENTIALS + ('module', 'pool', 'rate_limiter'):
+            if key in kwargs:
+                raise SingleHopError('%s is set per account' % key)
+        if cache is not None and not callable(cache):
+            raise SingleHopError('cache must be a callable taking an account name')
+        self._pool_size = pool_size or settings.POOL_SIZE
+        self._rates = rates
+        self._max_workers = max_workers or self._pool_size
+        self._cache = cache
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._accounts = {}
+        for name, credentials in (accounts or {}).items():
+            self.add(name, **credentials)
+
+    @property # getter for _pool_size
+    def pool_size(self):
+        return self._pool_size
+    @property # getter for _max_workers
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def names(self):
+        with self._lock:
+            return sorted(self._accounts)
+
+    def add(self, name, api_key=None, client_id=None, password=None):
+        """
+        Adds an account
+
+        :keyword name: Name used to refer to the account
+        :keyword api_key: API key
+        :keyword client_id: Client ID
+        :keyword password: Password
+
+        """
+        if not api_key or not client_id or not password:
+            raise SingleHopError('Account %s needs api_key, client_id and password' % name)
+        with self._lock:
+            if name in self._accounts:
+                raise SingleHopError('Account %s already added' % name)
+            self._accounts[name] = _Account(api_key, client_id, password,
+                ConnectionPool(pool_size=self._pool_size),
+                RateLimiter(self._rates) if self._rates else None,
+                self._cache(name) if self._cache is not None else None)
+
+    def remove(self, name):
+        """
+        Removes an account and closes its connections
+
+        """
+        with self._lock:
+            account = self._accounts.pop(name, None)
+        if account is None:
+            raise SingleHopError('Unknown account: %s' % name)
+        account.pool.close()
+
+    def account(self, name):
+        """
+        Returns the AccountModule of an account
+
+        """
+        return self.module(name, 'account')
+
+    def server(self, name):
+        """
+        Returns the ServerModule of an account
+
+        """
+        return self.module(name, 'server')
+
+    def module(self, name, module='server'):
+        """
+        Returns the module of an account, created on first use
+
+        :keyword name: Account name
+        :keyword module: 'account' or 'server'
+
+        """
+        if module not in MODULES:
+            raise SingleHopError('Unknown module: %s' % module)
+        with self._lock:
+            account = self._accounts.get(name)
+            if account is None:
+                raise SingleHopError('Unknown account: %s' % name)
+            if module not in account.modules:
+                account.modules[module] = MODULES[module](api_key=account.api_key,
+                    client_id=account.client_id, password=account.password,
+                    pool=account.pool, rate_limiter=account.rate_limiter,
+                    cache=account.cache, **self._kwargs)
+            return account.modules[module]
+
+    def bulk(self, command=None, items=None, max_workers=None, module='server'):
+        """
+        Runs a command once per item across accounts, scheduled fairly
+
+        Accounts take turns for free workers ; while several accounts have
+        items queued none gets more than an equal share of max_workers (or
+        more than pool_size), and once an account is done its share goes
+        to the others.  Errors are collected in the results.
+
+        :keyword command: Name of the module method to call, or a callable
+            taking (module, item)
+        :keyword items: Dict of account name to items, or an iterable of
+            (account name, item) pairs
+        :keyword max_workers: Concurrent calls across all accounts
+            (defaults to the pool max_workers)
+        :keyword module: 'account' or 'server'
+        :rtype: Iterator of AccountResult(account, item, result, error) in
+            completion order
+
+        """
+        if items is None:
+            raise SingleHopError('You must specify items')
+        queues = {}
+        if isinstance(items, dict):
+            for name, values in items.items():
+                queues.setdefault(name, deque()).extend(values)
+        else:
+            for name, item in items:
+                queues.setdefault(name, deque()).append(item)
+        calls = {}
+        for name in queues:
+            mod = self.module(name, module)
+            if callable(command):
+                calls[name] = lambda item, mod=mod: command(mod, item)
+            else:
+                calls[name] = mod._command(command)
+                if calls[name] is None:
+                    raise SingleHopError('Unknown command: %s' % command)
+        scheduler = _FairScheduler(queues, calls, max_workers or self._max_workers,
+            self._pool_size)
+        return scheduler.run()
+
+    def close(self):
+        """
+        Closes the connections of every account
+
+        """
+        with self._lock:
+            accounts = list(self._accounts.values())
+        for account in accounts:
+            account.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class _Account(object):
+    def __init__(self, api_key, client_id, password, pool, rate_limiter, cache):
+        self.api_key = api_key
+        self.client_id = client_id
+        self.password = password
+        self.pool = pool
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.modules = {}
+
+class _FairScheduler(object):
+    # hands queued items to workers round-robin across accounts, capping
+    # each account at its share of the workers
+    def __init__(self, queues, calls, max_workers, per_account):
+        self._queues = dict((n, q) for n, q in queues.items() if q)
+        self._calls = calls
+        self._order = deque(sorted(self._queues))
+        self._workers = max(1, min(max_workers, sum(len(q) for q in self._queues.values())))
+        self._per_account = per_account
+        self._active = dict((n, 0) for n in self._queues)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._results = Queue()
+
+    def _cap(self):
+        # accounts with queued items split the workers evenly
+        share = -(-self._workers // max(1, len(self._order)))
+        return min(self._per_account, share)
+
+    def _next(self):
+        # returns (account, item), or None when no work is left
+        with self._cond:
+            while not self._stopped and self._order:
+                cap = self._cap()
+                for i in range(len(self._order)):
+                    name = self._order[0]
+                    self._order.rotate(-1)
+                    if self._active[name] < cap:
+                        queue = self._queues[name]
+                        item = queue.popleft()
+                        if not queue:
+                            self._order.remove(name)
+                        self._active[name] += 1
+                        return name, item
+                self._cond.wait()
+            return None
+
+    def _done(self, name):
+        with self._cond:
+            self._active[name] -= 1
+            self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            name, item = task
+            try:
+                result = AccountResult(name, item, self._calls[name](item), None)
+            except Exception as e:
+                result = AccountResult(name, item, None, e)
+            self._done(name)
+            self._results.put(result)
+
+    def run(self):
+        total = sum(len(q) for q in self._queues.values())
+        if not total:
+            return
+        executor = ThreadPoolExecutor(self._workers)
+        for i in range(self._workers):
+            executor.submit(self._work)
+        try:
+            for i in range(total):
+                yield self._results.get()
+        finally:
+            # stop scheduling remaining items if the caller bails out early
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
+            executor.shutdown(wait=False)
@@ -0,0 +1,115 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, wraps
+from leap import AccountModule, ServerModule
+
+class LeapFuture(Future):
+    """
+    Future for a pending LEAP command
+
+    Call ``result()`` to block for the response, or ``await`` it from an
+    asyncio coroutine.  Errors such as SingleHopError are raised from
+    ``result()`` / ``await`` exactly as the blocking call would raise them.
+
+    """
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self).__await__()
+
+class AsyncModule(object):
+    """
+    Mixin that runs module commands in the background and returns
+    LeapFuture objects instead of blocking
+
+    :keyword max_workers: Maximum number of requests in flight (defaults
+        to the connection pool size)
+    :keyword executor: (optional) Executor to share between modules
+
+    """
+    def __init__(self, *args, **kwargs):
+        max_workers = kwargs.pop('max_workers', None)
+        executor = kwargs.pop('executor', None)
+        super(AsyncModule, self).__init__(*args, **kwargs)
+        self._owns_executor = executor is None
+        if not executor:
+            executor = ThreadPoolExecutor(max_workers or self.pool.pool_size)
+        self._executor = executor
+
+    @property # getter for _executor
+    def executor(self):
+        return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedules func to be called with the given arguments
+
+        Pending calls can be cancelled with ``future.cancel()`` (or by
+        cancelling the awaiting asyncio task); a request that has already
+        been sent runs to completion.
+
+        :keyword func: Callable to run
+        :rtype: LeapFuture
+
+        """
+        future = LeapFuture()
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        self._executor.submit(run)
+        return future
+
+    def _command(self, command):
+        # bulk() runs the blocking implementation on its own workers
+        func = super(AsyncModule, self)._command(command)
+        blocking = getattr(func, '_blocking', None)
+        if blocking is not None:
+            return partial(blocking, self)
+        return func
+
+    def close(self):
+        """
+        Shuts down the executor (if owned) and closes pooled connections
+
+        """
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+        super(AsyncModule, self).close()
+
+def _async_command(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self.submit(func, self, *args, **kwargs)
+    wrapper._blocking = func
+    return wrapper
+
+def _wrap_commands(cls, base):
+    for name in base.commands:
+        setattr(cls, name, _async_command(getattr(base, name)))
+    return cls
+
+class AsyncAccountModule(AsyncModule, AccountModule):
+    """
+    Non-blocking AccountModule; every command returns a LeapFuture
+
+        >>> am = AsyncAccountModule()
+        >>> am.get_account_details().result()
+
+    """
+
+class AsyncServerModule(AsyncModule, ServerModule):
+    """
+    Non-blocking ServerModule; every command returns a LeapFuture
+
+        >>> sm = AsyncServerModule(max_workers=50)
+        >>> futures = [sm.get_server_bandwidth(i) for i in server_ids]
+        >>> results = [f.result() for f in futures]
+
+    """
+
+_wrap_commands(AsyncAccountModule, AccountModule)
+_wrap_commands(AsyncServerModule, ServerModule)
@@ -0,0 +1,207 @@
+"""
+Vectorized fleet usage analytics
+
+Bandwidth and CPU results for the whole fleet are loaded once into
+columnar NumPy arrays (one row per server), so percentiles, rankings and
+per host node totals are single array operations instead of loops over
+result dicts.  Requires NumPy.
+
+    >>> stats = FleetStats.load(ServerModule(), max_workers=32)
+    >>> stats.percentile('bandwidth', [50, 95, 99])
+    >>> stats.top('cpu', 10)
+    >>> stats.by_node('bandwidth')
+    >>> stats.overage(0.5)
+
+"""
+from common import SingleHopError
+import calendar
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# column -> field of the get_server_bandwidth / cascade_get_cpu_usage data
+BANDWIDTH_FIELDS = {
+    'in': 'in',
+    'out': 'out',
+    'bandwidth': 'total',
+    'limit': 'limit',
+}
+CPU_FIELD = 'usage'
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def month_fraction(now=None):
+    """
+    Returns the fraction of the current (UTC) calendar month elapsed
+
+    """
+    if now is None:
+        now = time.time()
+    t = time.gmtime(now)
+    days = calendar.monthrange(t.tm_year, t.tm_mon)[1]
+    start = calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+    return (now - start) / (days * 86400.0)
+
+class FleetStats(object):
+    """
+    Columnar bandwidth and CPU usage for a set of servers
+
+    Missing values (i.e. CPU usage of dedicated servers) are NaN and are
+    ignored by every query.
+
+    :keyword servers: List of list_servers entries
+    :keyword bandwidth: Dict of server id to get_server_bandwidth data
+    :keyword cpu: Dict of server id to cascade_get_cpu_usage data
+
+    """
+    def __init__(self, servers, bandwidth=None, cpu=None):
+        if numpy is None:
+            raise SingleHopError('NumPy is required for fleet analytics')
+        bandwidth = bandwidth or {}
+        cpu = cpu or {}
+        self._ids = [str(s['server_id']) for s in servers]
+        index = dict((server_id, i) for i, server_id in enumerate(self._ids))
+        self._parents = numpy.array([index.get(str(s.get('parent_id')), -1)
+            for s in servers], dtype=numpy.intp)
+        self._columns = {}
+        for column, field in BANDWIDTH_FIELDS.items():
+            self._columns[column] = numpy.array([_number((bandwidth.get(i) or {}).get(field))
+                for i in self._ids])
+        self._columns['cpu'] = numpy.array([_number((cpu.get(i) or {}).get(CPU_FIELD))
+            for i in self._ids])
+
+    @classmethod
+    def load(cls, module, max_workers=None):
+        """
+        Fetches the server list, bandwidth and CPU usage of the fleet
+
+        Bandwidth is requested for every server and CPU usage for Cascade
+        VMs, concurrently with SingleHopModule.bulk.
+
+        :keyword module: ServerModule
+        :keyword max_workers: Concurrent requests (defaults to the
+            connection pool size)
+
+        """
+        resp = module.list_servers()
+        servers = resp.get('servers') if isinstance(resp, dict) else None
+        if servers is None:
+            raise SingleHopError('Unable to list servers')
+        ids = [s['server_id'] for s in servers]
+        vms = [s['server_id'] for s in servers if s.get('type') == 'vm']
+        return cls(servers, _data(module.bulk('get_server_bandwidth', ids, max_workers)),
+            _data(module.bulk('cascade_get_cpu_usage', vms, max_workers)))
+
+    @property
+    def server_ids(self):
+        return list(self._ids)
+
+    def column(self, name):
+        """
+        Returns a column as a NumPy array in server order
+
+        :keyword name: in, out, bandwidth, limit or cpu
+
+        """
+        if name not in self._columns:
+            raise SingleHopError('Unknown column: %s' % name)
+        return self._columns[name]
+
+    def percentile(self, name, q):
+        """
+        Returns the q-th percentile(s) of a column
+
+        :keyword q: Percentile or list of percentiles (0-100)
+
+        """
+        values = self.column(name)
+        values = values[~numpy.isnan(values)]
+        if not len(values):
+            return None
+        result = numpy.percentile(values, q)
+        if numpy.ndim(result):
+            return [float(v) for v in result]
+        return float(result)
+
+    def top(self, name, k=10):
+        """
+        Returns the k servers with the highest values of a column
+
+        :rtype: List of (server_id, value), highest first
+
+        """
+        values = self.column(name)
+        valid = numpy.flatnonzero(~numpy.isnan(values))
+        k = min(k, len(valid))
+        if k <= 0:
+            return []
+        # partial selection is O(n) ; only the k winners are sorted
+        picked = valid[numpy.argpartition(-values[valid], k - 1)[:k]]
+        picked = picked[numpy.argsort(-values[picked], kind='mergesort')]
+        return [(self._ids[i], float(values[i])) for i in picked]
+
+    def by_node(self, name, how='sum'):
+        """
+        Aggregates a column over the VMs of each Cascade host node
+
+        :keyword how: sum, mean or max
+        :rtype: Dict of host node id to value
+
+        """
+        values = self.column(name)
+        mask = (self._parents >= 0) & ~numpy.isnan(values)
+        parents = self._parents[mask]
+        values = values[mask]
+        size = len(self._ids)
+        counts = numpy.bincount(parents, minlength=size)
+        if how == 'sum':
+            result = numpy.bincount(parents, weights=values, minlength=size)
+        elif how == 'mean':
+            result = numpy.bincount(parents, weights=values, minlength=size) / \
+                numpy.maximum(counts, 1)
+        elif how == 'max':
+            result = numpy.full(size, -numpy.inf)
+            numpy.maximum.at(result, parents, values)
+        else:
+            raise SingleHopError('Unknown aggregate: %s' % how)
+        return dict((self._ids[i], float(result[i])) for i in numpy.flatnonzero(counts))
+
+    def overage(self, fraction=None):
+        """
+        Projects month-end bandwidth from usage so far
+
+        Usage is extrapolated linearly over the billing period.
+
+        :keyword fraction: (optional) Fraction of the period elapsed
+            (defaults to the fraction of the current calendar month)
+        :rtype: List of (server_id, projected, limit) for servers projected
+            to exceed their limit, largest overage first
+
+        """
+        if fraction is None:
+            fraction = month_fraction()
+        if not 0 < fraction <= 1:
+            raise SingleHopError('fraction must be between 0 and 1')
+        projected = self._columns['bandwidth'] / fraction
+        limit = self._columns['limit']
+        with numpy.errstate(invalid='ignore'):
+            over = numpy.flatnonzero(projected > limit)
+        over = over[numpy.argsort(-(projected[over] - limit[over]), kind='mergesort')]
+        return [(self._ids[i], float(projected[i]), float(limit[i])) for i in over]
+
+    def __len__(self):
+        return len(self._ids)
+
+def _data(results):
+    data = {}
+    for r in results:
+        if r.error is None and isinstance(r.result, dict) and \
+            isinstance(r.result.get('data'), dict):
+            data[str(r.item)] = r.result['data']
+    return data
@@ -0,0 +1,343 @@
+from collections import OrderedDict
+import os
+import settings
+import sqlite3
+import threading
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# mutating command -> list of (cached command, data field) to invalidate.
+# A field of None drops every cached entry for the command; otherwise only
+# entries whose data has the same value for that field are dropped.
+INVALIDATIONS = {
+    'cascadeCreateVm': [('listServers', None)],
+    'cascadeDeleteVm': [('listServers', None)],
+    'cascadeEditVm': [('listServers', None), ('getServerDetails', None)],
+    'cascadeMoveVm': [('listServers', None)],
+    'reinstallServer': [('getServerDetails', 'serverid')],
+}
+
+def cache_key(module, command, data, account=None):
+    """
+    Builds the cache key for a request
+
+    :keyword module: Module name
+    :keyword command: Module command
+    :keyword data: Request data dict (or None)
+    :keyword account: Client ID the response belongs to
+
+    """
+    return (account or '', module, command, json.dumps(data or {}, sort_keys=True))
+
+def cacheable_response(resp):
+    """
+    Returns True if a response holds a result worth caching
+
+    LEAP reports errors with HTTP 200 and {'success': false}, so the body
+    has to be decoded to tell them apart.
+
+    """
+    if not resp.ok:
+        return False
+    try:
+        result = json.loads(resp.content)
+    except ValueError:
+        return False
+    return not (isinstance(result, dict) and result.get('success') is False)
+
+class ResponseCache(object):
+    """
+    Thread-safe TTL + LRU cache for read-only LEAP commands
+
+    Only commands listed in ttls are cached.  The cache can be shared
+    between module instances, even of different accounts, as keys include
+    the module name and the client ID.
+
+    :keyword ttls: Dict of command name to time-to-live in seconds
+    :keyword max_size: Maximum number of cached responses
+    :keyword invalidations: Dict of mutating command to the cached
+        entries it invalidates (see INVALIDATIONS)
+
+    """
+    def __init__(self, ttls=None, max_size=None, invalidations=None):
+        self._ttls = ttls
+        self._max_size = max_size
+        self._invalidations = invalidations
+        if self._ttls is None:
+            self._ttls = settings.CACHE_TTLS
+        if not self._max_size:
+            self._max_size = settings.CACHE_SIZE
+        if self._invalidations is None:
+            self._invalidations = INVALIDATIONS
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property # getter for _ttls
+    def ttls(self):
+        return self._ttls
+    @property # getter for _max_size
+    def max_size(self):
+        return self._max_size
+
+    def cacheable(self, command):
+        return command in self._ttls
+
+    def get(self, module, command, data=None, account=None):
+        """
+        Returns the cached response or None
+
+        """
+        if not self.cacheable(command):
+            return None
+        key = cache_key(module, command, data, account)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[2]
+
+    def set(self, module, command, data, value, account=None):
+        """
+        Stores a response if the command is cacheable
+
+        """
+        if not self.cacheable(command):
+            return
+        key = cache_key(module, command, data, account)
+        expires = time.time() + self._ttls[command]
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, data or {}, value)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, module, command=None, field=None, value=None, account=None):
+        """
+        Drops cached entries for a module
+
+        :keyword module: Module name
+        :keyword command: (optional) Only drop entries for this command
+        :keyword field: (optional) Only drop entries whose data[field] == value
+        :keyword account: (optional) Only drop entries of this client ID
+
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[1] != module or (command and key[2] != command):
+                    continue
+                if account and key[0] != account:
+                    continue
+                if field and self._entries[key][1].get(field) != value:
+                    continue
+                del self._entries[key]
+
+    def invalidate_for(self, module, command, data=None, account=None):
+        """
+        Applies the invalidation rules for a mutating command
+
+        """
+        data = data or {}
+        for cached, field in self._invalidations.get(command, ()):
+            if field:
+                self.invalidate(module, cached, field, data.get(field), account)
+            else:
+                self.invalidate(module, cached, account=account)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and current size
+
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+class CachedResponse(object):
+    """
+    Response body restored from a persistent cache
+
+    Provides the parts of a requests Response used by the modules.
+
+    """
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    def close(self):
+        pass
+
+class SqliteCache(ResponseCache):
+    """
+    Persistent response cache in an SQLite database
+
+    The database uses WAL journaling so any number of processes on a host
+    can share it; short-lived scripts start from warm data and concurrent
+    workers reuse each other's responses.  Entries are kept per client ID,
+    so scripts for different accounts can use the same database.
+
+        >>> cache = SqliteCache('/var/tmp/singlehop.db')
+        >>> sm = ServerModule(cache=cache)
+
+    :keyword path: Path of the database file
+    :keyword namespace: (optional) Separates sets of entries further, i.e.
+        by environment ; max_size applies per namespace
+    :keyword ttls: Dict of command name to time-to-live in seconds
+    :keyword max_size: Maximum number of cached responses
+    :keyword invalidations: Dict of mutating command to the cached
+        entries it invalidates (see INVALIDATIONS)
+
+    """
+    prune_interval = 64
+    # seconds between updates of an entry's last use ; hits within the
+    # interval stay read-only so readers do not contend for the write lock
+    touch_interval = 60
+
+    def __init__(self, path, namespace='', ttls=None, max_size=None, \
+        invalidations=None):
+        super(SqliteCache, self).__init__(ttls, max_size, invalidations)
+        self._path = path
+        self._namespace = namespace
+        self._local = threading.local()
+        self._sets = 0
+        db = self._db()
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                'namespace TEXT, account TEXT, module TEXT, command TEXT, data TEXT, '
+                'expires REAL, used REAL, status INTEGER, content BLOB, '
+                'PRIMARY KEY (namespace, account, module, command, data))')
+
+    @property # getter for _path
+    def path(self):
+        return self._path
+    @property # getter for _namespace
+    def namespace(self):
+        return self._namespace
+
+    def _db(self):
+        # sqlite connections cannot be shared between threads, nor with a
+        # forked child ; the parent's connection is left untouched there
+        pid = os.getpid()
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != pid:
+            db = sqlite3.connect(self._path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = pid
+        return db
+
+    def _key(self, module, command, data, account):
+        return (self._namespace,) + cache_key(module, command, data, account)
+
+    def get(self, module, command, data=None, account=None):
+        if not self.cacheable(command):
+            return None
+        key = self._key(module, command, data, account)
+        db = self._db()
+        now = time.time()
+        row = db.execute('SELECT status, content, used FROM responses WHERE namespace = ? '
+            'AND account = ? AND module = ? AND command = ? AND data = ? AND expires >= ?',
+            key + (now,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if now - row[2] >= self.touch_interval:
+            with db:
+                db.execute('UPDATE responses SET used = ? WHERE namespace = ? AND account = ? '
+                    'AND module = ? AND command = ? AND data = ?', (now,) + key)
+        return CachedResponse(bytes(row[1]), row[0])
+
+    def set(self, module, command, data, value, account=None):
+        if not self.cacheable(command):
+            return
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._key(module, command, data, account) + (now + self._ttls[command], now,
+                value.status_code, sqlite3.Binary(value.content)))
+        with self._lock:
+            self._sets += 1
+            prune = self._sets % self.prune_interval == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Deletes expired responses and the least recently used ones beyond
+        max_size
+
+        """
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            cursor = db.execute('DELETE FROM responses WHERE rowid IN (SELECT rowid '
+                'FROM responses WHERE namespace = ? ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self._namespace, self._max_size))
+        with self._lock:
+            self.evictions += max(cursor.rowcount, 0)
+
+    def invalidate(self, module, command=None, field=None, value=None, account=None):
+        db = self._db()
+        query = 'SELECT account, command, data FROM responses WHERE namespace = ? ' \
+            'AND module = ?'
+        args = (self._namespace, module)
+        if command:
+            query += ' AND command = ?'
+            args += (command,)
+        if account:
+            query += ' AND account = ?'
+            args += (account,)
+        rows = db.execute(query, args).fetchall()
+        if field:
+            rows = [r for r in rows if json.loads(r[2]).get(field) == value]
+        with db:
+            db.executemany('DELETE FROM responses WHERE namespace = ? AND account = ? '
+                'AND module = ? AND command = ? AND data = ?',
+                [(self._namespace, r[0], module, r[1], r[2]) for r in rows])
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM responses WHERE namespace = ?', (self._namespace,))
+
+    def stats(self):
+        stats = super(SqliteCache, self).stats()
+        stats['size'] = len(self)
+        return stats
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM responses WHERE namespace = ?',
+            (self._namespace,)).fetchone()[0]
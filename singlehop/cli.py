@@ -0,0 +1,205 @@
+"""
+Command-line interface
+
+    $ python -m singlehop server list-servers
+    $ python -m singlehop server get-server-ips 000001
+    $ python -m singlehop server reinstall-server 000001 --os-id 7
+    $ cat ids | python -m singlehop --format ndjson server get-server-bandwidth -
+
+Every AccountModule and ServerModule command is a subcommand, with
+underscores replaced by dashes.  The first required parameter is
+positional; giving several values, or ``-`` to read them from stdin one
+per line, runs the command once per value on a thread pool.  Other
+parameters are options (i.e. ``--os-id``); lists and dicts are given as
+JSON.  Credentials default to settings.py.
+
+Only argparse and the command table are imported at startup.  requests
+and the modules are loaded once a request has to be sent, so ``--help``
+and lookups answered from a ``--cache`` database start quickly.
+
+"""
+import argparse
+import sys
+from commands import ACCOUNT_COMMANDS, SERVER_COMMANDS
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+MODULES = {
+    'account': ACCOUNT_COMMANDS,
+    'server': SERVER_COMMANDS,
+}
+
+def _value(text):
+    # lists and dicts (i.e. --servers, update-rdns entries) are given as JSON
+    if text.startswith(('[', '{')):
+        return json.loads(text)
+    return text
+
+def _bool(text):
+    if text.lower() in ('1', 'true', 'yes'):
+        return True
+    if text.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(text)
+
+def _help(text):
+    return text.replace('%', '%%')
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='singlehop',
+        description='SingleHop LEAP API client')
+    parser.add_argument('--format', choices=('json', 'ndjson'), default='json',
+        help='Output format (default: json)')
+    parser.add_argument('--cache', metavar='PATH',
+        help='SQLite database caching read-only responses between runs')
+    parser.add_argument('--workers', type=int, metavar='N',
+        help='Concurrent requests when several values are given')
+    parser.add_argument('--api-key')
+    parser.add_argument('--client-id')
+    parser.add_argument('--password')
+    parser.add_argument('--endpoint-url')
+    parser.add_argument('--timeout', type=float)
+    modules = parser.add_subparsers(dest='module', metavar='module')
+    for module in sorted(MODULES):
+        commands = modules.add_parser(module, help='%s module commands' % module) \
+            .add_subparsers(dest='command', metavar='command')
+        for command in MODULES[module]:
+            sub = commands.add_parser(command.name.replace('_', '-'),
+                help=_help(command.doc.strip().split('\n')[0]))
+            sub.set_defaults(spec=command)
+            for i, param in enumerate(command.params):
+                convert = _bool if param.allow_false else _value
+                if i == 0 and param.required:
+                    sub.add_argument(param.name, nargs='*', type=convert,
+                        metavar=param.name.upper(),
+                        help=_help(param.doc.split('\n')[0] + " ; several or '-' for stdin"))
+                else:
+                    sub.add_argument('--' + param.name.replace('_', '-'), dest=param.name,
+                        type=convert, help=_help(param.doc.split('\n')[0]))
+    return parser
+
+def main(argv=None, stdin=None, stdout=None):
+    """
+    Runs the command line ; returns the exit status
+
+    :keyword argv: (optional) Arguments (defaults to sys.argv[1:])
+    :keyword stdin: (optional) File to read batch values from
+    :keyword stdout: (optional) File to write results to
+
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    parser = _parser()
+    args = parser.parse_args(argv)
+    command = getattr(args, 'spec', None)
+    if command is None:
+        parser.error('a module and command are required')
+    values = dict((p.name, getattr(args, p.name)) for p in command.params)
+    items = None
+    if command.params and command.params[0].required:
+        name = command.params[0].name
+        given = values.pop(name)
+        if given == ['-']:
+            items = [_value(line.strip()) for line in stdin if line.strip()]
+        elif len(given) > 1:
+            items = given
+        else:
+            values[name] = given[0] if given else None
+    cache = None
+    if args.cache:
+        cache = _cache(args)
+    try:
+        if items is not None:
+            return _batch(args, command, values, items, cache, stdout)
+        return _single(args, command, values, cache, stdout)
+    except Exception as e:
+        sys.stderr.write('singlehop: %s\n' % getattr(e, 'value', e))
+        return 1
+
+def _cache(args):
+    from cache import SqliteCache
+    return SqliteCache(args.cache)
+
+def _module(args, cache):
+    from leap import AccountModule, ServerModule
+    cls = {'account': AccountModule, 'server': ServerModule}[args.module]
+    return cls(api_key=args.api_key, client_id=args.client_id, password=args.password,
+        endpoint_url=args.endpoint_url, timeout=args.timeout, cache=cache)
+
+def _cached(args, command, values, cache):
+    # answers read-only lookups from the cache without loading the modules
+    if cache is None or not command.read_only:
+        return None
+    if not all(values.get(p.name) for p in command.required):
+        return None
+    import settings
+    resp = cache.get(args.module, command.command, command.data(**values),
+        args.client_id or settings.CLIENT_ID)
+    if resp is None:
+        return None
+    try:
+        return json.loads(resp.content)
+    except ValueError:
+        return None
+
+def _single(args, command, values, cache, stdout):
+    result = _cached(args, command, values, cache)
+    if result is None:
+        module = _module(args, cache)
+        try:
+            if args.format == 'ndjson' and command.command == 'listServers' and \
+                cache is None:
+                # write servers as they are downloaded
+                for server in module.iter_servers():
+                    _write_line(server, stdout)
+                return 0
+            result = getattr(module, command.name)(**values)
+        finally:
+            module.close()
+    if args.format == 'ndjson':
+        for row in _rows(command, result):
+            _write_line(row, stdout)
+    else:
+        stdout.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
+    return 1 if _failed(result) else 0
+
+def _batch(args, command, values, items, cache, stdout):
+    module = _module(args, cache)
+    func = getattr(module, command.name)
+    call = lambda item: func(item, **values)
+    failed = False
+    rows = []
+    try:
+        for r in module.bulk(call, items, args.workers):
+            row = {'item': r.item, 'result': r.result, 'error': None}
+            if r.error is not None:
+                row['error'] = str(getattr(r.error, 'value', r.error))
+            failed = failed or row['error'] is not None or _failed(r.result)
+            if args.format == 'ndjson':
+                _write_line(row, stdout)
+            else:
+                rows.append(row)
+    finally:
+        module.close()
+    if args.format == 'json':
+        stdout.write(json.dumps(rows, indent=2, sort_keys=True) + '\n')
+    return 1 if failed else 0
+
+def _rows(command, result):
+    # list results are written one element per line
+    from records import RESULTS
+    if isinstance(result, list):
+        return result
+    key = RESULTS.get(command.command, (None,))[0]
+    if key and isinstance(result, dict) and isinstance(result.get(key), list):
+        return result[key]
+    return [result]
+
+def _write_line(obj, stdout):
+    stdout.write(json.dumps(obj, sort_keys=True) + '\n')
+    stdout.flush()
+
+def _failed(result):
+    return isinstance(result, dict) and result.get('success') is False
@@ -0,0 +1,239 @@
+"""
+Declarative table of LEAP commands
+
+Each command is declared once with its parameters and whether it is
+read-only.  The module classes in leap.py generate their methods from
+these tables, and the caching, coalescing, hedging, bulk and async code
+paths use the same metadata.
+
+"""
+
+class Param(object):
+    """
+    Command parameter
+
+    :keyword name: Python keyword name (i.e. server_id)
+    :keyword field: LEAP data field (i.e. serverid) ; None sends the value
+        itself as the request data
+    :keyword required: Raise SingleHopError when the value is missing
+    :keyword allow_false: Only treat None as missing (for booleans)
+    :keyword doc: Description used in the generated docstring
+    :keyword article: Article put before the name when it leads a missing
+        parameter message ('' for plurals such as entries)
+
+    """
+    def __init__(self, name, field=None, required=False, allow_false=False, doc='',
+        article='a'):
+        self.name = name
+        self.field = field
+        self.required = required
+        self.allow_false = allow_false
+        self.doc = doc
+        self.article = article
+
+class Command(object):
+    """
+    LEAP command definition
+
+    :keyword name: Method name (i.e. get_server_ips)
+    :keyword command: LEAP command (i.e. getServerIps)
+    :keyword params: List of Param
+    :keyword read_only: Command does not change state
+    :keyword doc: Method description
+    :keyword error: (optional) Message raised for missing parameters
+
+    """
+    def __init__(self, name, command, params=(), read_only=False, doc='', error=None):
+        self.name = name
+        self.command = command
+        self.params = tuple(params)
+        self.read_only = read_only
+        self.doc = doc
+        self.error = error
+        if self.error is None:
+            self.error = _missing_message(self.required)
+
+    @property
+    def required(self):
+        return [p for p in self.params if p.required]
+
+    def data(self, **values):
+        """
+        Builds the request data for keyword values, as the generated
+        method does
+
+        """
+        whole = [p for p in self.params if p.field is None]
+        if whole:
+            return values.get(whole[0].name)
+        if not self.params:
+            return None
+        data = dict((p.field, values.get(p.name)) for p in self.required)
+        for p in self.params:
+            if not p.required and values.get(p.name):
+                data[p.field] = values[p.name]
+        return data
+
+    def docstring(self):
+        lines = [''] + self.doc.strip('\n').split('\n') + ['']
+        for p in self.params:
+            doc = p.doc
+            if not p.required:
+                doc = '(optional) ' + doc
+            doc = doc.split('\n')
+            lines.append(':keyword %s: %s' % (p.name, doc[0]))
+            lines.extend('     ' + l for l in doc[1:])
+        if self.params:
+            lines.append('')
+        return '\n'.join(('        ' + l).rstrip() for l in lines) + '\n        '
+
+def _missing_message(params):
+    if not params:
+        return None
+    names = [p.name for p in params]
+    if len(names) == 1:
+        listed = names[0]
+    elif len(names) == 2:
+        listed = '%s and %s' % tuple(names)
+    else:
+        listed = '%s, and %s' % (', '.join(names[:-1]), names[-1])
+    if params[0].article:
+        listed = '%s %s' % (params[0].article, listed)
+    return 'You must specify %s' % listed
+
+def _server_id(doc='ID of server'):
+    return Param('server_id', 'serverid', required=True, doc=doc)
+
+def _vm_id(doc='ID of virtual machine'):
+    return Param('vm_id', 'vmid', required=True, doc=doc)
+
+ACCOUNT_COMMANDS = (
+    Command('get_account_details', 'getAccountDetails', read_only=True,
+        doc='Gets account details'),
+    Command('get_authorized_contacts', 'getAuthorizedContacts', read_only=True,
+        doc='Gets authorized accounts contacts'),
+    Command('tandem_list', 'tandemList', read_only=True,
+        doc='Gets list of Tandem users'),
+    Command('tandem_add_user', 'tandemAddUser', [
+        Param('name', 'name', required=True, doc='First and last name of user'),
+        Param('email', 'email', required=True, doc='Email address of user'),
+        Param('password', 'password', required=True, doc='Password of user'),
+        ], doc='Adds a new Tandem user'),
+    Command('tandem_delete_user', 'tandemDeleteUser', [
+        Param('user_id', 'userid', required=True, doc='ID of user to delete'),
+        ], doc="""
+Deletes a Tandem user
+
+** Currently unsupported by SingleHopAPI
+
+Error: Call to undefined method MDB2_Error::fetchOne() in <b>/home/leap/lib/class/Tandem.class.php</b> on line <b>30</b>
+"""),
+    Command('tandem_add_user_permission', 'tandemAddUserPermission', [
+        Param('user_id', 'userid', required=True, doc='ID of user'),
+        _server_id(),
+        ], doc='Grants user permission to server'),
+    Command('tandem_delete_user_permission', 'tandemDeleteUserPermission', [
+        Param('user_id', 'userid', required=True, doc='ID of user'),
+        _server_id(),
+        ], doc='Removes user permission from server'),
+)
+
+SERVER_COMMANDS = (
+    Command('list_servers', 'listServers', read_only=True,
+        doc='Gets list of servers'),
+    Command('get_server_details', 'getServerDetails', [_server_id()], read_only=True,
+        doc="""
+Gets the details of the specified server
+
+** Currently doesn't work with SingleHop API:
+
+Error: Call to undefined method Cascade::getFreeStorage() in <b>/home/leap/lib/class/Api.class.php</b> on line <b>624</b>
+"""),
+    Command('get_server_ips', 'getServerIps', [_server_id()], read_only=True,
+        doc='Gets list of allocated IPs for specified server'),
+    Command('get_server_bandwidth', 'getServerBandwidth', [_server_id()], read_only=True,
+        doc='Gets bandwidth totals for specified server'),
+    Command('get_rdns_list', 'getRdnsList', [_server_id()], read_only=True,
+        doc='Gets list of Reverse DNS entries for specified server'),
+    Command('update_rdns', 'updateRdns', [
+        Param('entries', required=True, article='', doc='Dict of IP/host pairs'),
+        ], doc='Updates Reverse DNS entries for an assigned IP'),
+    Command('reboot_server', 'rebootServer', [_server_id()],
+        doc='Reboots the specified server'),
+    Command('get_os_list', 'getOsList', [_server_id()], read_only=True,
+        doc='Gets the list of operating systems available for installation'),
+    Command('reinstall_server', 'reinstallServer', [
+        _server_id(),
+        Param('os_id', 'osid', required=True, doc='ID of operating system to install'),
+        ], doc='Reinstalls the specified server with the specified OS id'),
+    Command('list_available_servers', 'listAvailableServers', read_only=True,
+        doc='Lists servers available for purchase'),
+    Command('cancellation_request', 'cancellationRequest', [
+        Param('servers', 'servers', required=True, doc='List of server IDs to cancel'),
+        Param('happy', 'happy', required=True, allow_false=True,
+            doc='Satified with service or not'),
+        Param('reason', 'reason', required=True, doc="""Reason for cancellation.  Avaialable options:
+Going out of buisness, Financial Reasons, Client Cancelled,
+Do not need a server, Service Interruptions,
+Support was not what I expected, Unsatisfied with price"""),
+        ], doc='Submit a cancellation request',
+        error='You must specify a server_id, happy, and reason'),
+    Command('cascade_get_cpu_usage', 'cascadeGetCpuUsage', [_server_id()], read_only=True,
+        doc='Gets CPU usage of specified Cascade VM'),
+    Command('cascade_get_node_properties', 'cascadeGetNodeProperties', [_server_id()],
+        read_only=True, doc="""
+Get information about a Cascade host node
+
+** Currently doesn't work with SingleHop API:
+
+Error: Call to undefined method Cascade::getFreeStorage() in <b>/home/leap/lib/class/Api.class.php</b> on line <b>624</b>
+"""),
+    Command('cascade_list_snapshots', 'cascadeListSnapshots', read_only=True,
+        doc='Lists available operating system snapshots'),
+    Command('cascade_edit_vm', 'cascadeEditVm', [
+        _vm_id('ID of virtual machine to edit'),
+        Param('hostname', 'hostname', doc='Hostname of vm ; must be unique'),
+        Param('ram', 'ram', doc='Ram size in bytes'),
+        Param('storage', 'storage', doc='Storage size in bytes'),
+        Param('cpu', 'cpu', doc='CPU priority, 1-100'),
+        Param('vcpu', 'vcpu', doc='Number of virtual cpus to create, 0-16'),
+        Param('password', 'password', doc='Root password of VM'),
+        ], doc='Edits specified Cascade VM'),
+    Command('cascade_move_vm', 'cascadeMoveVm', [
+        _vm_id(),
+        _server_id(),
+        ], doc="""
+Migrates a Cascade VM to another host
+
+* Only Canopy VMs can be migrated and target server must have
+enough free RAM to accomodate the VM
+"""),
+    Command('cascade_create_vm', 'cascadeCreateVm', [
+        _server_id('ID of host node'),
+        Param('hostname', 'hostname', required=True, doc='Hostname of vm ; must be unique'),
+        Param('os', 'os', required=True,
+            doc='ID of operating system to use (can be obtained from cascade_list_snapshots)'),
+        Param('ram', 'ram', required=True, doc='Ram size in bytes'),
+        Param('storage', 'storage', required=True, doc='Storage size in bytes'),
+        Param('cpu', 'cpu', required=True, doc='CPU priority, 1-100'),
+        Param('vcpu', 'vcpu', required=True, doc='Number of virtual cpus to create, 0-16'),
+        Param('ips', 'ips', required=True, doc='IP block size (30, 29, 28)'),
+        Param('imgstore', 'imgstore', required=True, doc='Storage type (canopy, local)'),
+        ], doc='Creates a new Cascade VM'),
+    Command('cascade_snapshot_vm', 'cascadeSnapshotVm', [
+        _vm_id(),
+        Param('image_id', 'imageid', doc='ID of image to overwrite'),
+        ], doc='Creates a new OS snapshot image'),
+    Command('cascade_delete_vm', 'cascadeDeleteVm', [_vm_id()],
+        doc='Deletes a Cascade virtual machine'),
+    Command('cascade_reboot_vm', 'cascadeRebootVm', [_vm_id()],
+        doc='Reboots a Cascade virtual machine'),
+    Command('cascade_shutdown_vm', 'cascadeShutdownVm', [_vm_id()],
+        doc='Shuts down a Cascade virtual machine'),
+    Command('cascade_start_vm', 'cascadeStartVm', [_vm_id()],
+        doc='Starts a Cascade virtual machine'),
+)
+
+# commands that do not change state and are safe to cache, coalesce or repeat
+READ_ONLY_COMMANDS = frozenset(c.command for c in ACCOUNT_COMMANDS + SERVER_COMMANDS
+    if c.read_only)
@@ -1,6 +1,14 @@
 import requests
+from requests.adapters import HTTPAdapter
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import wraps
+from cache import cacheable_response
+from commands import READ_ONLY_COMMANDS
+import records
 import settings
+import threading
+import time
 import urllib
 try:
     import simplejson as json
@@ -13,19 +21,211 @@ class SingleHopError(Exception):
     def __str__(self):
         return repr(self.value)
 
+BulkResult = namedtuple('BulkResult', 'item result error')
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive connections to the LEAP endpoint
+
+    A single pool can be shared between module instances so that an
+    AccountModule and a ServerModule reuse the same connections.
+
+    :keyword pool_size: Maximum number of connections kept open
+    :keyword idle_timeout: Seconds a pool may sit unused before its
+        connections are dropped and re-opened on the next request
+
+    """
+    def __init__(self, pool_size=None, idle_timeout=None):
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        if not self._pool_size:
+            self._pool_size = settings.POOL_SIZE
+        if self._idle_timeout is None:
+            self._idle_timeout = settings.POOL_IDLE_TIMEOUT
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0.0
+        self._active = 0
+
+    @property # getter for _pool_size
+    def pool_size(self):
+        return self._pool_size
+    @property # getter for _idle_timeout
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    @property
+    def available(self):
+        # connections not carrying a request right now
+        with self._lock:
+            return self._pool_size - self._active
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+            pool_maxsize=self._pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _acquire(self):
+        with self._lock:
+            now = time.time()
+            if self._session is not None and self._active == 0 and \
+                self._idle_timeout and now - self._last_used > self._idle_timeout:
+                # idle connections are likely closed by the server already
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+            self._active += 1
+            self._last_used = now
+            return self._session
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.time()
+
+    def get(self, url, **kwargs):
+        """
+        Issues a GET request over a pooled connection
+
+        :keyword url: URL to request
+        :rtype: requests Response
+
+        """
+        session = self._acquire()
+        try:
+            return session.get(url, **kwargs)
+        finally:
+            self._release()
+
+    def post(self, url, **kwargs):
+        """
+        Issues a POST request over a pooled connection
+
+        :keyword url: URL to request
+        :rtype: requests Response
+
+        """
+        session = self._acquire()
+        try:
+            return session.post(url, **kwargs)
+        finally:
+            self._release()
+
+    def close(self):
+        """
+        Closes all pooled connections
+
+        The pool remains usable; new connections are opened on demand.
+
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent requests
+
+    While a request for a key is in flight, other threads asking for the
+    same key wait for it and receive the same result (or exception)
+    instead of issuing their own request.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Calls func unless a call for key is already in flight
+
+        :keyword key: Hashable request key
+        :keyword func: Callable taking no arguments
+        :rtype: Result of func
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        return len(self._calls)
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
 class SingleHopModule(object):
     """
     Base class for SingleHop modules
 
+    :keyword pool: (optional) ConnectionPool to share between modules
+    :keyword cache: (optional) ResponseCache for read-only commands
+    :keyword single_flight: (optional) SingleFlight to share between
+        modules ; False disables coalescing of identical requests
+    :keyword metrics: (optional) Metrics to record request statistics in
+    :keyword hedge: (optional) HedgePolicy for read-only commands
+    :keyword rate_limiter: (optional) RateLimiter consulted before each request
+    :keyword records: Return compact record objects (see singlehop.records)
+        instead of dicts where available
+    :keyword transport: 'get' sends the request in the URL query string ;
+        'post' sends it form-encoded in the request body, keeping
+        credentials out of URLs and large data clear of URL length limits
+        (the body is not smaller than the query string)
+
     """
     def __init__(self, api_key=None, client_id=None, password=None, \
-        endpoint_url=None, module=None, timeout=None):
+        endpoint_url=None, module=None, timeout=None, pool=None, cache=None, \
+        single_flight=None, metrics=None, hedge=None, rate_limiter=None, \
+        records=False, transport=None):
         self._api_key = api_key
         self._client_id = client_id
         self._password = password
         self._endpoint_url = endpoint_url
         self._module = module
         self._timeout = timeout
+        self._pool = pool
+        self._owns_pool = pool is None
+        self._cache = cache
+        self._single_flight = single_flight
+        self._metrics = metrics
+        self._hedge = hedge
+        self._hedge_released = False
+        self._rate_limiter = rate_limiter
+        self._records = records
+        self._transport = transport
+        self._templates = {}
         # load defaults if needed
         if not self._api_key:
             self._api_key = settings.API_KEY
@@ -37,6 +237,17 @@ class SingleHopModule(object):
             self._endpoint_url = settings.ENDPOINT_URL
         if not self._timeout:
             self._timeout = 300.0
+        if not self._pool:
+            self._pool = ConnectionPool()
+        if self._single_flight is None:
+            self._single_flight = SingleFlight()
+        if not self._transport:
+            self._transport = settings.TRANSPORT
+        if self._transport not in ('get', 'post'):
+            raise SingleHopError('Unknown transport: %s' % self._transport)
+        if self._hedge is not None:
+            # policies may be shared ; the last module to close releases it
+            self._hedge.attach()
     
     def _login_required(func):
         '''Decorator to check that auth credentials exist'''
@@ -65,6 +276,109 @@ class SingleHopModule(object):
     @property # getter for _timeout
     def timeout(self):
         return self._timeout
+    @property # getter for _pool
+    def pool(self):
+        return self._pool
+    @property # getter for _cache
+    def cache(self):
+        return self._cache
+    @property # getter for _single_flight
+    def single_flight(self):
+        return self._single_flight
+    @property # getter for _metrics
+    def metrics(self):
+        return self._metrics
+    @property # getter for _hedge
+    def hedge(self):
+        return self._hedge
+    @property # getter for _rate_limiter
+    def rate_limiter(self):
+        return self._rate_limiter
+    @property # getter for _records
+    def records(self):
+        return self._records
+    @property # getter for _transport
+    def transport(self):
+        return self._transport
+
+    def close(self):
+        """
+        Closes pooled connections owned by this module
+
+        Shared pools passed in with the pool keyword are left open
+        for their owner to close.  A hedge policy is shut down once every
+        module using it is closed.
+
+        """
+        if self._owns_pool:
+            self._pool.close()
+        if self._hedge is not None and not self._hedge_released:
+            self._hedge_released = True
+            self._hedge.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def bulk(self, command=None, items=None, max_workers=None, ordered=True):
+        """
+        Runs a command once per item on a thread pool
+
+        Errors raised for an item are collected in its result rather than
+        aborting the batch.
+
+            >>> for r in sm.bulk('get_server_bandwidth', ids, max_workers=32):
+            ...     print(r.item, r.error or r.result)
+
+        :keyword command: Name of the module method to call (i.e.
+            get_server_ips), or a callable taking one item
+        :keyword items: Iterable of arguments, one call per item
+        :keyword max_workers: Number of concurrent calls (defaults to the
+            connection pool size)
+        :keyword ordered: Yield results in input order (True) or as they
+            complete (False)
+        :rtype: Iterator of BulkResult(item, result, error)
+
+        """
+        func = command if callable(command) else self._command(command)
+        if func is None:
+            raise SingleHopError('Unknown command: %s' % command)
+        if items is None:
+            raise SingleHopError('You must specify items')
+        items = list(items)
+        return self._bulk(func, items, max_workers or self._pool.pool_size, ordered)
+
+    def _command(self, command):
+        # resolves a public command name to a blocking callable
+        if not command or command.startswith('_'):
+            return None
+        func = getattr(self, command, None)
+        if not callable(func):
+            return None
+        return func
+
+    def _bulk(self, func, items, max_workers, ordered):
+        def call(item):
+            try:
+                return BulkResult(item, func(item), None)
+            except Exception as e:
+                return BulkResult(item, None, e)
+        executor = ThreadPoolExecutor(max(1, min(max_workers, len(items))))
+        futures = [executor.submit(call, item) for item in items]
+        try:
+            if ordered:
+                for future in futures:
+                    yield future.result()
+            else:
+                for future in as_completed(futures):
+                    yield future.result()
+        finally:
+            # stop scheduling remaining items if the caller bails out early
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     @_login_required
     def do_request(self, command=None, data=None):
@@ -76,25 +390,127 @@ class SingleHopModule(object):
         :rtype: Response as JSON
     
         """
-        request = {}
-        # build auth dict
-        _auth = {
-            'key': self._api_key,
-            'user': self._client_id,
-            'password': self._password,
-        }
-        request['auth'] = _auth
-        # build module dict
-        _module = {
-            'module': self._module,
-            'command': command,
-        }
-        request['module'] = _module
         if data:
             if not isinstance(data, dict):
                 raise SingleHopError('Data must be specified as a dict')
-            request['data'] = data
-        js = json.dumps(request).replace(' ', '%20')
-        resp = requests.get(self._endpoint_url + js, timeout=self._timeout)
+        if self._cache is not None:
+            resp = self._cache.get(self._module, command, data, self._client_id)
+            if resp is not None:
+                return resp
+        request = self._request(command, data)
+        if self._single_flight and command in READ_ONLY_COMMANDS:
+            # the request carries the credentials so accounts never share results
+            key = request if self._transport == 'get' else self._endpoint_url + request
+            resp = self._single_flight.do(key, lambda: self._send(request, command))
+        else:
+            resp = self._send(request, command)
+        if self._cache is not None:
+            if self._cache.cacheable(command) and cacheable_response(resp):
+                self._cache.set(self._module, command, data, resp, self._client_id)
+            self._cache.invalidate_for(self._module, command, data, self._client_id)
         return resp
 
+    @_login_required
+    def do_stream_request(self, command=None, data=None):
+        """
+        Makes a request to the SingleHop API without reading the body
+
+        The response is not cached, coalesced or hedged; read it with
+        ``resp.iter_content()`` and close it when done.
+
+        :keyword command: Module command to run
+        :keyword data: Data to send
+        :rtype: Streaming response
+
+        """
+        if data:
+            if not isinstance(data, dict):
+                raise SingleHopError('Data must be specified as a dict')
+        return self._fetch(self._request(command, data), command, stream=True)
+
+    def _request(self, command, data):
+        # the full URL for GET, the JSON request for POST
+        js = self._template(command)
+        if data:
+            js += ', "data": ' + json.dumps(data)
+        js += '}'
+        if self._transport == 'post':
+            return js
+        return self._endpoint_url + js.replace(' ', '%20')
+
+    def _post_url(self):
+        # the endpoint without its empty request parameter
+        url = self._endpoint_url
+        for suffix in ('?request=', '&request='):
+            if url.endswith(suffix):
+                return url[:-len(suffix)]
+        return url
+
+    def _template(self, command):
+        # serialized auth/module part of the request, without the closing brace
+        template = self._templates.get(command)
+        if template is None:
+            request = {}
+            # build auth dict
+            _auth = {
+                'key': self._api_key,
+                'user': self._client_id,
+                'password': self._password,
+            }
+            request['auth'] = _auth
+            # build module dict
+            _module = {
+                'module': self._module,
+                'command': command,
+            }
+            request['module'] = _module
+            template = self._templates[command] = json.dumps(request)[:-1]
+        return template
+
+    def _parse(self, resp, command=None):
+        """
+        Decodes a response, wrapping non-JSON bodies as {'data': body}
+
+        """
+        try:
+            result = json.loads(resp.content)
+        except ValueError:
+            if self._metrics is not None:
+                self._metrics.decode_error(self._module, command)
+            return {'data': resp.content}
+        if self._records:
+            result = records.convert(command, result)
+        return result
+
+    def _send(self, request, command):
+        if self._metrics is None:
+            return self._dispatch(request, command)
+        start = time.time()
+        try:
+            resp = self._dispatch(request, command)
+        except requests.exceptions.Timeout:
+            self._metrics.record(self._module, command, time.time() - start,
+                timeout=True)
+            raise
+        except requests.exceptions.RequestException:
+            self._metrics.record(self._module, command, time.time() - start,
+                error=True)
+            raise
+        self._metrics.record(self._module, command, time.time() - start,
+            len(resp.content), error=not resp.ok)
+        return resp
+
+    def _dispatch(self, request, command):
+        if self._hedge is not None and command in READ_ONLY_COMMANDS:
+            return self._hedge.call(command, lambda: self._fetch(request, command),
+                lambda: self._pool.available > 0)
+        return self._fetch(request, command)
+
+    def _fetch(self, request, command, **kwargs):
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(self._module, command)
+        if self._transport == 'post':
+            return self._pool.post(self._post_url(), data={'request': request},
+                timeout=self._timeout, **kwargs)
+        return self._pool.get(request, timeout=self._timeout, **kwargs)
+
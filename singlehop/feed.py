@@ -0,0 +1,164 @@
+"""
+Change feed over list_servers
+
+ChangeFeed polls the server list and keeps only a fingerprint (the hex
+SHA-1 digest of the canonical JSON) per server, so it stays small for large
+fleets and emits events only for the servers that were added, removed
+or modified since the previous poll.
+
+    >>> feed = ChangeFeed(ServerModule())
+    >>> for event in feed.watch(interval=60):
+    ...     print(event.kind, event.server_id, event.server)
+
+"""
+from collections import namedtuple
+import hashlib
+import threading
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+# server is None for removed servers
+ServerEvent = namedtuple('ServerEvent', 'kind server_id server')
+
+def fingerprint(server):
+    """
+    Returns a digest of a list_servers record (dict or Record)
+
+    """
+    data = json.dumps(dict(server.items()), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+class ChangeFeed(object):
+    """
+    Emits added / removed / modified events for the server list
+
+    :keyword module: ServerModule to poll (the list is streamed with
+        iter_servers ; only the records of changed servers are kept)
+    :keyword callback: (optional) Called with each ServerEvent
+    :keyword state: (optional) Dict of server id to fingerprint from a
+        previous run (see the state property) to resume from
+    :keyword initial: Report every server as added on the first poll ;
+        False only records them
+
+    """
+    def __init__(self, module, callback=None, state=None, initial=True):
+        self._module = module
+        self._callback = callback
+        self._state = dict(state) if state is not None else None
+        self._initial = initial
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.errors = 0
+
+    @property
+    def state(self):
+        """
+        Dict of server id to fingerprint as of the last poll
+
+        """
+        with self._lock:
+            return dict(self._state or {})
+
+    def poll(self):
+        """
+        Fetches the server list once and returns the changes
+
+        The previous state is kept if the listing fails, so a failed poll
+        never reports servers as removed.  An event whose callback raises
+        is left out of the new state, so it is reported again on the next
+        poll ; the other events are still delivered and the first callback
+        error is raised afterwards.
+
+        :rtype: List of ServerEvent
+
+        """
+        with self._lock:
+            previous = self._state
+        current = {}
+        events = []
+        for server in self._module.iter_servers():
+            server_id = str(server['server_id'])
+            digest = current[server_id] = fingerprint(server)
+            # only records of changed servers are kept
+            if previous is None:
+                if self._initial:
+                    events.append(ServerEvent(ADDED, server_id, server))
+            elif server_id not in previous:
+                events.append(ServerEvent(ADDED, server_id, server))
+            elif previous[server_id] != digest:
+                events.append(ServerEvent(MODIFIED, server_id, server))
+        if previous is not None:
+            for server_id in sorted(set(previous) - set(current)):
+                events.append(ServerEvent(REMOVED, server_id, None))
+        failure = None
+        if self._callback is None or (previous is None and not self._initial):
+            state = current
+        else:
+            state = dict(previous or {})
+            for event in events:
+                try:
+                    self._callback(event)
+                except Exception as e:
+                    failure = failure or e
+                    continue
+                # commit each event once it is delivered
+                if event.kind == REMOVED:
+                    del state[event.server_id]
+                else:
+                    state[event.server_id] = current[event.server_id]
+        with self._lock:
+            self._state = state
+            self.polls += 1
+        if failure is not None:
+            raise failure
+        return events
+
+    def watch(self, interval=60.0):
+        """
+        Polls every interval seconds, yielding events as they are found
+
+        """
+        while True:
+            started = time.time()
+            for event in self.poll():
+                yield event
+            time.sleep(max(0, interval - (time.time() - started)))
+
+    def start(self, interval=60.0):
+        """
+        Polls every interval seconds in a background thread, passing events
+        to the callback
+
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,),
+                name='singlehop-feed')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.poll()
+            except Exception:
+                # keep the previous state and retry on the next interval
+                self.errors += 1
+            self._stop.wait(max(0, interval - (time.time() - started)))
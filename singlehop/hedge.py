@@ -0,0 +1,163 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+
+class HedgePolicy(object):
+    """
+    Hedged requests for idempotent commands
+
+    If a request has not answered after the hedge delay, a duplicate is
+    sent and whichever answers first wins.  The delay tracks a percentile
+    of recently observed latencies per command so only stragglers are
+    hedged.  Modules only hedge commands in READ_ONLY_COMMANDS, and only
+    while their connection pool has a free connection: with every
+    connection busy the duplicate would wait behind the straggler.
+
+        >>> sm = ServerModule(hedge=HedgePolicy(percentile=95))
+
+    :keyword percentile: Latency percentile used as the hedge delay
+    :keyword initial_delay: Delay (seconds) until enough samples exist
+    :keyword min_delay: Lower bound of the hedge delay
+    :keyword max_delay: (optional) Upper bound of the hedge delay
+    :keyword window: Number of recent latencies kept per command
+    :keyword max_workers: Threads available for hedged requests
+
+    """
+    min_samples = 20
+
+    def __init__(self, percentile=95, initial_delay=1.0, min_delay=0.01, \
+        max_delay=None, window=200, max_workers=32):
+        self._percentile = percentile
+        self._initial_delay = initial_delay
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._window = window
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._executor = None
+        self._users = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+
+    def delay(self, command):
+        """
+        Returns the current hedge delay for a command in seconds
+
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(command, ()))
+        if len(samples) < self.min_samples:
+            delay = self._initial_delay
+        else:
+            index = int(round(self._percentile / 100.0 * (len(samples) - 1)))
+            delay = samples[index]
+        delay = max(delay, self._min_delay)
+        if self._max_delay is not None:
+            delay = min(delay, self._max_delay)
+        return delay
+
+    def observe(self, command, latency):
+        with self._lock:
+            samples = self._latencies.get(command)
+            if samples is None:
+                samples = self._latencies[command] = deque(maxlen=self._window)
+            samples.append(latency)
+
+    def attach(self):
+        """
+        Registers a module using the policy (see release)
+
+        """
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        """
+        Unregisters a module ; the hedging threads are shut down once no
+        module uses the policy
+
+        """
+        with self._lock:
+            self._users -= 1
+            last = self._users <= 0
+        if last:
+            self.shutdown()
+
+    def _get_executor(self):
+        # created on first use, and again after shutdown
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._max_workers)
+            return self._executor
+
+    def call(self, command, func, can_hedge=None):
+        """
+        Calls func, hedging it with a second call if it is slow
+
+        :keyword command: Command name used for latency tracking
+        :keyword func: Callable taking no arguments, returning a response
+        :keyword can_hedge: (optional) Callable returning False when no
+            duplicate should be sent now (i.e. no connection is free)
+        :rtype: Result of the first call to succeed
+
+        """
+        executor = self._get_executor()
+        start = time.time()
+        try:
+            first = executor.submit(func)
+        except RuntimeError:
+            # shut down meanwhile ; send the request unhedged
+            return func()
+        done, _ = wait([first], timeout=self.delay(command))
+        if done:
+            self.observe(command, time.time() - start)
+            return first.result()
+        if can_hedge is not None and not can_hedge():
+            with self._lock:
+                self.skipped += 1
+            result = first.result()
+            self.observe(command, time.time() - start)
+            return result
+        try:
+            second = executor.submit(func)
+        except RuntimeError:
+            # shut down meanwhile ; keep waiting for the first request
+            result = first.result()
+            self.observe(command, time.time() - start)
+            return result
+        with self._lock:
+            self.hedged += 1
+        pending = set([first, second])
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            ok = [f for f in done if f.exception() is None]
+            if ok:
+                future = ok[0]
+                break
+            if not pending:
+                # both attempts failed
+                future = done.pop()
+                break
+        if future is second:
+            with self._lock:
+                self.hedge_wins += 1
+        for loser in pending:
+            # a request already on the wire cannot be aborted ; its result
+            # is simply discarded
+            loser.cancel()
+        self.observe(command, time.time() - start)
+        return future.result()
+
+    def shutdown(self):
+        """
+        Releases the hedging threads ; they are recreated if the policy is
+        used again
+
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,154 @@
+from common import SingleHopError
+import threading
+
+class FleetInventory(object):
+    """
+    Indexed in-memory view of list_servers
+
+    Servers are indexed by server_id, hostname and type, and Cascade VMs
+    by their host node (parent_id), so lookups are constant time.
+    refresh() applies a new listing incrementally, touching only the
+    entries that were added, removed or changed.
+
+        >>> inv = FleetInventory(ServerModule())
+        >>> inv.refresh()
+        >>> inv.by_hostname('vm.domain.com')['server_id']
+        >>> [vm['server'] for vm in inv.children('000001')]
+
+    :keyword module: (optional) ServerModule used by refresh()
+    :keyword servers: (optional) Initial list of server records
+
+    """
+    def __init__(self, module=None, servers=None):
+        self._module = module
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_hostname = {}
+        self._by_type = {}
+        self._children = {}
+        if servers is not None:
+            self.update(servers)
+
+    def refresh(self):
+        """
+        Fetches the server list and applies it
+
+        :rtype: Tuple of (added, removed, changed) server id sets
+
+        """
+        if self._module is None:
+            raise SingleHopError('FleetInventory needs a ServerModule to refresh')
+        return self.update(self._module.iter_servers())
+
+    def update(self, servers):
+        """
+        Replaces the inventory with a full server listing
+
+        :keyword servers: Iterable of server records (dicts or Records)
+        :rtype: Tuple of (added, removed, changed) server id sets
+
+        """
+        # read the whole listing first so queries are not blocked while
+        # it downloads
+        servers = list(servers)
+        seen = set()
+        added = set()
+        changed = set()
+        with self._lock:
+            for server in servers:
+                server_id = server['server_id']
+                seen.add(server_id)
+                old = self._by_id.get(server_id)
+                if old is None:
+                    self._add(server)
+                    added.add(server_id)
+                elif old != server:
+                    self._remove(old)
+                    self._add(server)
+                    changed.add(server_id)
+            removed = set(self._by_id) - seen
+            for server_id in removed:
+                self._remove(self._by_id[server_id])
+        return added, removed, changed
+
+    def _add(self, server):
+        server_id = server['server_id']
+        self._by_id[server_id] = server
+        hostname = server.get('server')
+        if hostname:
+            self._by_hostname[hostname] = server_id
+        self._by_type.setdefault(server.get('type'), set()).add(server_id)
+        parent_id = server.get('parent_id')
+        if parent_id:
+            self._children.setdefault(parent_id, set()).add(server_id)
+
+    def _remove(self, server):
+        server_id = server['server_id']
+        del self._by_id[server_id]
+        hostname = server.get('server')
+        if hostname and self._by_hostname.get(hostname) == server_id:
+            del self._by_hostname[hostname]
+        _discard(self._by_type, server.get('type'), server_id)
+        _discard(self._children, server.get('parent_id'), server_id)
+
+    def get(self, server_id, default=None):
+        """
+        Returns the server with the given id
+
+        """
+        return self._by_id.get(server_id, default)
+
+    def by_hostname(self, hostname, default=None):
+        """
+        Returns the server with the given hostname
+
+        """
+        with self._lock:
+            server_id = self._by_hostname.get(hostname)
+            if server_id is None:
+                return default
+            return self._by_id[server_id]
+
+    def of_type(self, server_type):
+        """
+        Returns the servers of a type (i.e. vmnode, vm)
+
+        """
+        with self._lock:
+            return [self._by_id[i] for i in self._by_type.get(server_type, ())]
+
+    def children(self, parent_id):
+        """
+        Returns the VMs running on a Cascade host node
+
+        """
+        with self._lock:
+            return [self._by_id[i] for i in self._children.get(parent_id, ())]
+
+    def parent(self, server_id):
+        """
+        Returns the host node of a VM (or None)
+
+        """
+        with self._lock:
+            server = self._by_id.get(server_id)
+            if server is None or not server.get('parent_id'):
+                return None
+            return self._by_id.get(server['parent_id'])
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, server_id):
+        return server_id in self._by_id
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_id.values()))
+
+def _discard(index, key, server_id):
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(server_id)
+        if not ids:
+            del index[key]
@@ -1,8 +1,52 @@
 from common import SingleHopError, SingleHopModule
-try:
-    import simplejson as json
-except ImportError:
-    import json
+from commands import ACCOUNT_COMMANDS, SERVER_COMMANDS
+from provision import check_vm_specs
+from records import server_record
+from stream import StreamError, iter_array
+
+def _compile(command):
+    """
+    Compiles the module method for a Command
+
+    The argument checks and request data are generated as straight-line
+    code, so a call costs no more than a hand-written method.
+
+    """
+    args = ''.join(', %s=None' % p.name for p in command.params)
+    lines = ['def %s(self%s):' % (command.name, args)]
+    if command.required:
+        tests = [('%s is None' if p.allow_false else 'not %s') % p.name
+            for p in command.required]
+        lines.append('    if %s:' % ' or '.join(tests))
+        lines.append('        raise SingleHopError(%r)' % command.error)
+    data = 'None'
+    if command.params:
+        data = 'data'
+        whole = [p for p in command.params if p.field is None]
+        if whole:
+            lines.append('    data = %s' % whole[0].name)
+        else:
+            lines.append('    data = {%s}' % ', '.join('%r: %s' % (p.field, p.name)
+                for p in command.required))
+            for p in command.params:
+                if not p.required:
+                    lines.append('    if %s:' % p.name)
+                    lines.append('        data[%r] = %s' % (p.field, p.name))
+    lines.append('    return self._parse(self.do_request(command=%r, data=%s), %r)' % (
+        command.command, data, command.command))
+    namespace = {'SingleHopError': SingleHopError}
+    code = compile('\n'.join(lines) + '\n', '<leap %s>' % command.command, 'exec')
+    exec(code, namespace)
+    func = namespace[command.name]
+    func.__doc__ = command.docstring()
+    func.command = command
+    return func
+
+def _add_commands(cls, commands):
+    cls.commands = dict((c.name, c) for c in commands)
+    for command in commands:
+        setattr(cls, command.name, _compile(command))
+    return cls
 
 class AccountModule(SingleHopModule):
     """
@@ -15,127 +59,6 @@ class AccountModule(SingleHopModule):
     def __init__(self, *args, **kwargs):
         super(AccountModule, self).__init__(module='account', *args, **kwargs)
 
-    def get_account_details(self):
-        """
-        Gets account details
-
-        """
-        resp = self.do_request(command='getAccountDetails')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_authorized_contacts(self):
-        """
-        Gets authorized accounts contacts
-
-        """
-        resp = self.do_request(command='getAuthorizedContacts')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def tandem_list(self):
-        """
-        Gets list of Tandem users
-
-        """
-        resp = self.do_request(command='tandemList')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def tandem_add_user(self, name=None, email=None, password=None):
-        """
-        Adds a new Tandem user
-
-        :keyword name: First and last name of user
-        :keyword email: Email address of user
-        :keyword password: Password of user
-
-        """
-        if not name or not email or not password:
-            raise SingleHopError('You must specify a name, email, and password')
-        data = {}
-        data['name'] = name
-        data['email'] = email
-        data['password'] = password
-        resp = self.do_request(command='tandemAddUser', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def tandem_delete_user(self, user_id=None):
-        """
-        Deletes a Tandem user
-
-        ** Currently unsupported by SingleHopAPI
-
-        Error: Call to undefined method MDB2_Error::fetchOne() in <b>/home/leap/lib/class/Tandem.class.php</b> on line <b>30</b>
-        
-        :keyword user_id: ID of user to delete
-        
-        """
-        if not user_id:
-            raise SingleHopError('You must specify a user_id')
-        data = {}
-        data['userid'] = user_id
-        resp = self.do_request(command='tandemDeleteUser', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            return resp.content
-
-    def tandem_add_user_permission(self, user_id=None, server_id=None):
-        """
-        Grants user permission to server
-
-        :keyword user_id: ID of user
-        :keyword server_id: ID of server
-        
-        """
-        if not user_id or not server_id:
-            raise SingleHopError('You must specify a user_id and server_id')
-        data = {}
-        data['userid'] = user_id
-        data['serverid'] = server_id
-        resp = self.do_request(command='tandemAddUserPermission', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            return resp.content
-
-    def tandem_delete_user_permission(self, user_id=None, server_id=None):
-        """
-        Removes user permission from server
-
-        :keyword user_id: ID of user
-        :keyword server_id: ID of server
-        
-        """
-        if not user_id or not server_id:
-            raise SingleHopError('You must specify a user_id and server_id')
-        data = {}
-        data['userid'] = user_id
-        data['serverid'] = server_id
-        resp = self.do_request(command='tandemDeleteUserPermission', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            return resp.content
-
 class ServerModule(SingleHopModule):
     """
     Server module to handle SingleHop server
@@ -147,464 +70,66 @@ class ServerModule(SingleHopModule):
     def __init__(self, *args, **kwargs):
         super(ServerModule, self).__init__(module='server', *args, **kwargs)
 
-    def list_servers(self):
-        """
-        Gets list of servers
-
-        """
-        resp = self.do_request(command='listServers')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_server_details(self, server_id=None):
-        """
-        Gets the details of the specified server
-
-        ** Currently doesn't work with SingleHop API:
-
-        Error: Call to undefined method Cascade::getFreeStorage() in <b>/home/leap/lib/class/Api.class.php</b> on line <b>624</b>
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='getServerDetails', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_server_ips(self, server_id=None):
-        """
-        Gets list of allocated IPs for specified server
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='getServerIps', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_server_bandwidth(self, server_id=None):
-        """
-        Gets bandwidth totals for specified server
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='getServerBandwidth', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_rdns_list(self, server_id=None):
-        """
-        Gets list of Reverse DNS entries for specified server
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='getRdnsList', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def update_rdns(self, entries=None):
-        """
-        Updates Reverse DNS entries for an assigned IP
-
-        :keyword entries: Dict of IP/host pairs
-
-        """
-        if not server_id or not entries:
-            raise SingleHopError('You must specify a server_id and entries')
-        resp = self.do_request(command='updateRdns', data=entries)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def reboot_server(self, server_id=None):
-        """
-        Reboots the specified server
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='rebootServer', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def get_os_list(self, server_id=None):
-        """
-        Gets the list of operating systems available for installation
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='getOsList', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def reinstall_server(self, server_id=None, os_id=None):
-        """
-        Reinstalls the specified server with the specified OS id
-
-        :keyword server_id: ID of server
-        :keyword os_id: ID of operating system to install
-
-        """
-        if not server_id or not os_id:
-            raise SingleHopError('You must specify a server_id and os_id')
-        data = {}
-        data['serverid'] = server_id
-        data['osid'] = os_id
-        resp = self.do_request(command='reinstallServer', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def list_available_servers(self):
-        """
-        Lists servers available for purchase
-
-        """
-        resp = self.do_request(command='listAvailableServers')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cancellation_request(self, servers=None, happy=None, reason=None):
-        """
-        Submit a cancellation request
-
-        :keyword servers: List of server IDs to cancel
-        :keyword happy: Satified with service or not
-        :keyword reason: Reason for cancellation.  Avaialable options:
-             Going out of buisness, Financial Reasons, Client Cancelled,
-             Do not need a server, Service Interruptions,
-             Support was not what I expected, Unsatisfied with price
-
-        """
-        if not servers or happy == None or not reason:
-            raise SingleHopError('You must specify a server_id, happy, and reason')
-        data = {}
-        data['servers'] = servers
-        data['happy'] = happy
-        data['reason'] = reason
-        resp = self.do_request(command='cancellationRequest', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def cascade_get_cpu_usage(self, server_id=None):
-        """
-        Gets CPU usage of specified Cascade VM
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='cascadeGetCpuUsage', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_get_node_properties(self, server_id=None):
-        """
-        Get information about a Cascade host node
-
-        ** Currently doesn't work with SingleHop API:
-
-        Error: Call to undefined method Cascade::getFreeStorage() in <b>/home/leap/lib/class/Api.class.php</b> on line <b>624</b>
-
-        :keyword server_id: ID of server
-
-        """
-        if not server_id:
-            raise SingleHopError('You must specify a server_id')
-        data = {}
-        data['serverid'] = server_id
-        resp = self.do_request(command='cascadeGetNodeProperties', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_list_snapshots(self):
-        """
-        Lists available operating system snapshots
-
-        """
-        resp = self.do_request(command='cascadeListSnapshots')
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_edit_vm(self, vm_id=None, hostname=None, ram=None, storage=None, \
-        cpu=None, vcpu=None, password=None):
-        """
-        Edits specified Cascade VM
-
-        :keyword vm_id: ID of virtual machine to edit
-        :keyword hostname: (optional) Hostname of vm ; must be unique
-        :keyword ram: (optional) Ram size in bytes
-        :keyword storage: (optional) Storage size in bytes
-        :keyword cpu: (optional) CPU priority, 1-100
-        :keyword vcpu: (optional) Number of virtual cpus to create, 0-16
-        :keyword password: (optional) Root password of VM
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        if hostname:
-            data['hostname'] = hostname
-        if ram:
-            data['ram'] = ram
-        if storage:
-            data['storage'] = storage
-        if cpu:
-            data['cpu'] = cpu
-        if vcpu:
-            data['vcpu'] = vcpu
-        if password:
-            data['password'] = password
-        resp = self.do_request(command='cascadeEditVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def cascade_move_vm(self, vm_id=None, server_id=None):
-        """
-        Migrates a Cascade VM to another host
-
-        * Only Canopy VMs can be migrated and target server must have
-        enough free RAM to accomodate the VM
-
-        :keyword vm_id: ID of virtual machine
-        :keyword server_id: ID of server
-
-        """
-        if not vm_id or not server_id:
-            raise SingleHopError('You must specify a vm_id and server_id')
-        data = {}
-        data['vmid'] = vm_id
-        data['serverid'] = server_id
-        resp = self.do_request(command='cascadeMoveVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_create_vm(self, server_id=None, hostname=None, os=None, ram=None, \
-        storage=None, cpu=None, vcpu=None, ips=None, imgstore=None):
-        """
-        Creates a new Cascade VM
-
-        :keyword server_id: ID of host node
-        :keyword hostname: Hostname of vm ; must be unique
-        :keyword os: ID of operating system to use (can be obtained from cascade_list_snapshots)
-        :keyword ram: Ram size in bytes
-        :keyword storage: Storage size in bytes
-        :keyword cpu: CPU priority, 1-100
-        :keyword vcpu: Number of virtual cpus to create, 0-16
-        :keyword ips: IP block size (30, 29, 28)
-        :keyword imgstore: Storage type (canopy, local)
-
-        """
-        if not server_id or not hostname or not os or not ram or not storage \
-            or not cpu or not vcpu or not ips or not imgstore:
-            raise SingleHopError("""You must specify a server_id, hostname, os, ram, """\
-                """storage, cpu, vcpu, ips, and imgstore""")
-        data = {}
-        data['serverid'] = server_id
-        data['hostname'] = hostname
-        data['os'] = os
-        data['ram'] = ram
-        data['storage'] = storage
-        data['cpu'] = cpu
-        data['vcpu'] = vcpu
-        data['ips'] = ips
-        data['imgstore'] = imgstore
-        resp = self.do_request(command='cascadeCreateVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_snapshot_vm(self, vm_id=None, image_id=None):
-        """
-        Creates a new OS snapshot image
-
-        :keyword vm_id: ID of virtual machine
-        :keyword image_id: (optional) ID of image to overwrite
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        if image_id:
-            data['imageid'] = image_id
-        resp = self.do_request(command='cascadeSnapshotVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_delete_vm(self, vm_id=None):
-        """
-        Deletes a Cascade virtual machine
-
-        :keyword vm_id: ID of virtual machine
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        resp = self.do_request(command='cascadeDeleteVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_reboot_vm(self, vm_id=None):
-        """
-        Reboots a Cascade virtual machine
-
-        :keyword vm_id: ID of virtual machine
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        resp = self.do_request(command='cascadeRebootVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-
-    def cascade_shutdown_vm(self, vm_id=None):
-        """
-        Shuts down a Cascade virtual machine
-
-        :keyword vm_id: ID of virtual machine
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        resp = self.do_request(command='cascadeShutdownVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
-    def cascade_start_vm(self, vm_id=None):
-        """
-        Starts a Cascade virtual machine
-
-        :keyword vm_id: ID of virtual machine
-
-        """
-        if not vm_id:
-            raise SingleHopError('You must specify a vm_id')
-        data = {}
-        data['vmid'] = vm_id
-        resp = self.do_request(command='cascadeStartVm', data=data)
-        try:
-            return json.loads(resp.content)
-        except:
-            data = {}
-            data['data'] = resp.content
-            return json.loads(data)
-    
+    def iter_servers(self, chunk_size=65536):
+        """
+        Iterates over the list of servers without loading the whole
+        response into memory
+
+        Records are yielded as they are downloaded and parsed, one at a
+        time (as Server/Vm records if the module was created with
+        records=True).
+
+        :keyword chunk_size: Bytes to read from the connection at a time
+
+        """
+        resp = self.do_stream_request(command='listServers')
+        extra = {}
+        try:
+            for server in iter_array(resp.iter_content(chunk_size), 'servers', extra):
+                yield server_record(server) if self._records else server
+        except StreamError as e:
+            raise SingleHopError('Unable to parse server list: %s' % e)
+        finally:
+            resp.close()
+        if extra.get('success') is False:
+            raise SingleHopError(extra.get('error', 'Unable to list servers'))
+
+    def cascade_create_vms(self, specs=None, max_workers=None, ordered=False):
+        """
+        Creates many Cascade VMs concurrently
+
+        All specs are validated against cascade_list_snapshots and the
+        cascade_create_vm parameters before any VM is submitted ; a
+        SingleHopError lists every problem found.  Results are yielded
+        per VM as its request completes.
+
+            >>> specs = [dict(server_id='000001', hostname='web%d.domain.com' % i,
+            ...     os=4, ram=1024, storage=10240, cpu=10, vcpu=1, ips=30,
+            ...     imgstore='local') for i in range(200)]
+            >>> for r in sm.cascade_create_vms(specs, max_workers=16):
+            ...     print(r.item['hostname'], r.error or r.result)
+
+        :keyword specs: List of dicts of cascade_create_vm keywords
+        :keyword max_workers: Number of concurrent requests (defaults to the
+            connection pool size)
+        :keyword ordered: Yield results in input order (True) or as they
+            complete (False)
+        :rtype: Iterator of BulkResult(spec, result, error)
+
+        """
+        if not specs:
+            raise SingleHopError('You must specify specs')
+        specs = list(specs)
+        # blocking implementations, also when called on AsyncServerModule
+        snapshots = self._command('cascade_list_snapshots')()
+        if not isinstance(snapshots, list):
+            raise SingleHopError('Unable to list snapshots')
+        errors = check_vm_specs(specs, snapshots)
+        if errors:
+            raise SingleHopError('Invalid VM specs: %s' % '; '.join(errors))
+        create_vm = self._command('cascade_create_vm')
+        create = lambda spec: create_vm(**spec)
+        return self._bulk(create, specs, max_workers or self._pool.pool_size, ordered)
+
+_add_commands(AccountModule, ACCOUNT_COMMANDS)
+_add_commands(ServerModule, SERVER_COMMANDS)
@@ -0,0 +1,190 @@
+import socket
+import threading
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0)
+
+class CommandStats(object):
+    """
+    Counters for a single module command
+
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.calls = 0
+        self.latency_sum = 0.0
+        self.response_bytes = 0
+        self.decode_errors = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def add(self, latency, size, timeout, error):
+        self.calls += 1
+        self.latency_sum += latency
+        self.response_bytes += size
+        if timeout:
+            self.timeouts += 1
+        if error or timeout:
+            self.errors += 1
+        for i, bound in enumerate(self.buckets):
+            if latency <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'latency_sum': self.latency_sum,
+            'latency_buckets': list(zip(self.buckets + (float('inf'),), self.counts)),
+            'response_bytes': self.response_bytes,
+            'decode_errors': self.decode_errors,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+        }
+
+class Metrics(object):
+    """
+    Per module/command request metrics
+
+    Pass an instance to a module with the metrics keyword; modules without
+    one skip instrumentation entirely.
+
+        >>> metrics = Metrics(sinks=[StatsdSink.udp('localhost', 8125)])
+        >>> sm = ServerModule(metrics=metrics)
+        >>> sm.list_servers()
+        >>> metrics.snapshot()[('server', 'listServers')]['calls']
+        1
+
+    :keyword buckets: Latency histogram bucket upper bounds in seconds
+    :keyword sinks: List of objects with record() and decode_error()
+        methods called for every event (see StatsdSink)
+
+    """
+    def __init__(self, buckets=None, sinks=None):
+        self._buckets = tuple(buckets or DEFAULT_BUCKETS)
+        self._sinks = list(sinks or [])
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property # getter for _sinks
+    def sinks(self):
+        return self._sinks
+
+    def record(self, module, command, latency, size=0, timeout=False, error=False):
+        """
+        Records a completed (or failed) request
+
+        :keyword module: Module name
+        :keyword command: Module command
+        :keyword latency: Request time in seconds
+        :keyword size: Response body size in bytes
+        :keyword timeout: Request timed out
+        :keyword error: Request failed (connection error or HTTP error
+            status) ; timeouts are counted as errors too
+
+        """
+        with self._lock:
+            self._command_stats(module, command).add(latency, size, timeout, error)
+        for sink in self._sinks:
+            sink.record(module, command, latency, size, timeout, error)
+
+    def decode_error(self, module, command):
+        """
+        Records a response that could not be decoded as JSON
+
+        """
+        with self._lock:
+            self._command_stats(module, command).decode_errors += 1
+        for sink in self._sinks:
+            sink.decode_error(module, command)
+
+    def _command_stats(self, module, command):
+        key = (module, command)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = CommandStats(self._buckets)
+        return stats
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters keyed by (module, command)
+
+        """
+        with self._lock:
+            return dict((key, stats.to_dict()) for key, stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def prometheus(self, prefix='singlehop'):
+        """
+        Renders the counters in the Prometheus text exposition format
+
+        """
+        lines = []
+        def metric(name, kind, help):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+        snapshot = sorted(self.snapshot().items())
+        metric('request_duration_seconds', 'histogram', 'LEAP request latency')
+        for (module, command), stats in snapshot:
+            labels = 'module="%s",command="%s"' % (module, command)
+            total = 0
+            for bound, count in stats['latency_buckets']:
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_request_duration_seconds_bucket{%s,le="%s"} %d' % (
+                    prefix, labels, le, total))
+            lines.append('%s_request_duration_seconds_sum{%s} %r' % (prefix, labels,
+                stats['latency_sum']))
+            lines.append('%s_request_duration_seconds_count{%s} %d' % (prefix, labels,
+                stats['calls']))
+        for name, field, help in (
+            ('response_bytes_total', 'response_bytes', 'LEAP response body bytes'),
+            ('decode_errors_total', 'decode_errors', 'LEAP responses that were not JSON'),
+            ('timeouts_total', 'timeouts', 'LEAP requests that timed out'),
+            ('errors_total', 'errors', 'LEAP requests that failed or timed out')):
+            metric(name, 'counter', help)
+            for (module, command), stats in snapshot:
+                lines.append('%s_%s{module="%s",command="%s"} %d' % (prefix, name,
+                    module, command, stats[field]))
+        return '\n'.join(lines) + '\n'
+
+class StatsdSink(object):
+    """
+    Emits StatsD lines for every request
+
+    :keyword write: Callable receiving each line (i.e. a socket send)
+    :keyword prefix: Metric name prefix
+
+    """
+    def __init__(self, write, prefix='singlehop'):
+        self._write = write
+        self._prefix = prefix
+
+    @classmethod
+    def udp(cls, host='localhost', port=8125, prefix='singlehop'):
+        """
+        Builds a sink sending lines to a StatsD daemon over UDP
+
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = (host, port)
+        return cls(lambda line: sock.sendto(line.encode('utf-8'), address), prefix)
+
+    def record(self, module, command, latency, size, timeout, error=False):
+        name = '%s.%s.%s' % (self._prefix, module, command)
+        lines = ['%s.calls:1|c' % name, '%s.latency:%.3f|ms' % (name, latency * 1000),
+            '%s.bytes:%d|c' % (name, size)]
+        if timeout:
+            lines.append('%s.timeouts:1|c' % name)
+        if error or timeout:
+            lines.append('%s.errors:1|c' % name)
+        self._write('\n'.join(lines))
+
+    def decode_error(self, module, command):
+        self._write('%s.%s.%s.decode_errors:1|c' % (self._prefix, module, command))
@@ -0,0 +1,182 @@
+"""
+Placement of Cascade VMs on host nodes
+
+PlacementEngine models the free RAM, storage and vcpus of every host
+node (from list_servers and cascade_get_node_properties) and assigns a
+batch of VMs with best-fit decreasing bin packing: the largest VMs are
+placed first, each on the node with the least free RAM that still fits
+all three resources.  Nodes are kept sorted by free RAM: a binary search
+finds the first node with enough RAM, then nodes are scanned upwards
+until one also has the storage and vcpus.  A placement is cheap while
+RAM is the tightest resource, but costs a scan of up to the whole fleet
+(O(nodes) per VM) when storage or vcpus run out first.
+
+    >>> engine = PlacementEngine.load(ServerModule())
+    >>> plan = engine.place([dict(hostname='web%d.domain.com' % i, os=4,
+    ...     ram=2147483648, storage=21474836480, cpu=10, vcpu=2, ips=30,
+    ...     imgstore='local') for i in range(1000)])
+    >>> results = sm.cascade_create_vms(plan.specs())
+
+"""
+from bisect import bisect_left, insort
+from common import SingleHopError
+
+RESOURCES = ('ram', 'storage', 'vcpu')
+
+class Placement(object):
+    """
+    Placement plan returned by PlacementEngine.place
+
+    :keyword assignments: List of (vm, node id) tuples
+    :keyword unplaced: List of VMs that fit on no node
+
+    """
+    def __init__(self, assignments=None, unplaced=None):
+        self.assignments = assignments or []
+        self.unplaced = unplaced or []
+
+    def specs(self):
+        """
+        Returns cascade_create_vm keyword dicts with server_id set to the
+        chosen node
+
+        """
+        specs = []
+        for vm, node_id in self.assignments:
+            spec = dict((k, v) for k, v in vm.items() if k not in ('vm_id', 'parent_id'))
+            spec['server_id'] = node_id
+            specs.append(spec)
+        return specs
+
+    def moves(self):
+        """
+        Returns (vm_id, node id) pairs for cascade_move_vm
+
+        """
+        return [(vm['vm_id'], node_id) for vm, node_id in self.assignments]
+
+    def by_node(self):
+        """
+        Returns a dict of node id to the VMs placed on it
+
+        """
+        nodes = {}
+        for vm, node_id in self.assignments:
+            nodes.setdefault(node_id, []).append(vm)
+        return nodes
+
+    def __len__(self):
+        return len(self.assignments)
+
+class PlacementEngine(object):
+    """
+    Capacity model of Cascade host nodes
+
+    :keyword nodes: Dict of node id to a dict with freeram, freestorage
+        and freevcpu (as returned by cascade_get_node_properties)
+
+    """
+    def __init__(self, nodes):
+        self._ids = sorted(nodes)
+        self._free = dict((r, [_int(nodes[n].get('free' + r)) for n in self._ids])
+            for r in RESOURCES)
+
+    @classmethod
+    def load(cls, module, max_workers=None):
+        """
+        Builds the model from list_servers and cascade_get_node_properties
+
+        :keyword module: ServerModule
+        :keyword max_workers: Concurrent requests (defaults to the
+            connection pool size)
+
+        """
+        resp = module.list_servers()
+        servers = resp.get('servers') if isinstance(resp, dict) else None
+        if servers is None:
+            raise SingleHopError('Unable to list servers')
+        node_ids = [s['server_id'] for s in servers if s.get('type') == 'vmnode']
+        nodes = {}
+        for r in module.bulk('cascade_get_node_properties', node_ids, max_workers):
+            if r.error is not None:
+                raise SingleHopError('Unable to get properties of node %s: %s' % (r.item,
+                    getattr(r.error, 'value', r.error)))
+            if not isinstance(r.result, dict) or not isinstance(r.result.get('data'), dict):
+                raise SingleHopError('Unable to get properties of node %s' % r.item)
+            nodes[r.item] = r.result['data']
+        return cls(nodes)
+
+    @property
+    def node_ids(self):
+        return list(self._ids)
+
+    def free(self, node_id):
+        """
+        Returns the free ram, storage and vcpu of a node
+
+        """
+        i = self._ids.index(node_id)
+        return dict((r, self._free[r][i]) for r in RESOURCES)
+
+    def place(self, vms, commit=False):
+        """
+        Assigns VMs to nodes
+
+        Each VM costs a binary search on free RAM plus a linear scan of
+        the nodes with enough RAM, up to the whole fleet when storage or
+        vcpus are short.  A VM with a parent_id (its current node, when
+        planning moves) is never placed back on that node.  Capacity freed by moving a VM
+        away is not reused within the same plan.
+
+        :keyword vms: List of dicts with ram, storage and vcpu (plus any
+            other cascade_create_vm keywords, or vm_id and parent_id for
+            moves)
+        :keyword commit: Deduct the placed VMs from the model so later
+            plans account for them
+        :rtype: Placement
+
+        """
+        vms = list(vms)
+        ram, storage, vcpu = [list(self._free[r]) for r in RESOURCES]
+        index = dict((n, i) for i, n in enumerate(self._ids))
+        needs = []
+        for vm in vms:
+            try:
+                needs.append(tuple(int(vm[r]) for r in RESOURCES))
+            except (KeyError, TypeError, ValueError):
+                raise SingleHopError('VM needs integer ram, storage and vcpu: %r' % (vm,))
+        # nodes ordered by free RAM ; bisect to the first that fits, then
+        # scan for storage, vcpu and the parent exclusion
+        by_ram = sorted((ram[i], i) for i in range(len(self._ids)))
+        assignments = []
+        unplaced = []
+        for v in sorted(range(len(needs)), key=needs.__getitem__, reverse=True):
+            need_ram, need_storage, need_vcpu = needs[v]
+            skip = index.get(vms[v].get('parent_id'))
+            pos = bisect_left(by_ram, (need_ram, -1))
+            while pos < len(by_ram):
+                i = by_ram[pos][1]
+                if storage[i] >= need_storage and vcpu[i] >= need_vcpu and i != skip:
+                    break
+                pos += 1
+            else:
+                unplaced.append(v)
+                continue
+            del by_ram[pos]
+            ram[i] -= need_ram
+            storage[i] -= need_storage
+            vcpu[i] -= need_vcpu
+            insort(by_ram, (ram[i], i))
+            assignments.append((v, self._ids[i]))
+        if commit:
+            self._free = {'ram': ram, 'storage': storage, 'vcpu': vcpu}
+        # report in input order
+        assignments.sort()
+        unplaced.sort()
+        return Placement([(vms[v], n) for v, n in assignments], [vms[v] for v in unplaced])
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,71 @@
+"""
+Validation of Cascade VM specs for bulk provisioning
+
+A spec is a dict of cascade_create_vm keywords.  Specs are checked
+together before anything is submitted, so a bad entry halfway through a
+large rollout is reported up front instead of after half the VMs exist.
+
+"""
+from commands import SERVER_COMMANDS
+
+CREATE_VM = [c for c in SERVER_COMMANDS if c.command == 'cascadeCreateVm'][0]
+FIELDS = tuple(p.name for p in CREATE_VM.params)
+# integer fields -> (minimum, maximum or None)
+LIMITS = {
+    'ram': (1, None),
+    'storage': (1, None),
+    'cpu': (1, 100),
+    'vcpu': (0, 16),
+    'ips': (28, 30),
+}
+IMGSTORES = ('canopy', 'local')
+
+def check_vm_specs(specs, snapshots):
+    """
+    Returns a list of problems with VM specs (empty when all are valid)
+
+    :keyword specs: List of dicts of cascade_create_vm keywords
+    :keyword snapshots: Result of cascade_list_snapshots
+
+    """
+    os_ids = set(str(s['id']) for s in snapshots)
+    hostnames = {}
+    errors = []
+    for i, spec in enumerate(specs):
+        name = 'spec %d' % i
+        if not isinstance(spec, dict):
+            errors.append('%s: must be a dict' % name)
+            continue
+        if spec.get('hostname'):
+            name = '%s (%s)' % (name, spec['hostname'])
+        # same test as the generated cascade_create_vm, so 0 counts as missing
+        missing = [p.name for p in CREATE_VM.required if not spec.get(p.name)]
+        if missing:
+            errors.append('%s: missing %s' % (name, ', '.join(missing)))
+        unknown = sorted(set(spec) - set(FIELDS))
+        if unknown:
+            errors.append('%s: unknown %s' % (name, ', '.join(unknown)))
+        if spec.get('os') not in (None, '') and str(spec['os']) not in os_ids:
+            errors.append('%s: os %s is not in cascade_list_snapshots' % (name, spec['os']))
+        for field, (low, high) in sorted(LIMITS.items()):
+            if spec.get(field) in (None, ''):
+                continue
+            try:
+                value = int(spec[field])
+            except (TypeError, ValueError):
+                errors.append('%s: %s must be an integer' % (name, field))
+                continue
+            if high is None and value < low:
+                errors.append('%s: %s must be at least %d' % (name, field, low))
+            elif high is not None and not low <= value <= high:
+                errors.append('%s: %s must be between %d and %d' % (name, field, low, high))
+        if spec.get('imgstore') not in (None, '') and spec['imgstore'] not in IMGSTORES:
+            errors.append('%s: imgstore must be one of %s' % (name, ', '.join(IMGSTORES)))
+        hostname = spec.get('hostname')
+        if hostname:
+            if hostname in hostnames:
+                errors.append('%s: hostname is also used by spec %d' % (name,
+                    hostnames[hostname]))
+            else:
+                hostnames[hostname] = i
+    return errors
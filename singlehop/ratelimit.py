@@ -0,0 +1,159 @@
+"""
+Client-side token bucket rate limiting
+
+Budgets are configured per module and per command as ``(rate, burst)``
+pairs, with ``rate`` in requests per second:
+
+    >>> limiter = RateLimiter({
+    ...     '*': (20, 20),                  # all LEAP requests
+    ...     'server': (10, 10),             # server module
+    ...     'server.getServerBandwidth': (5, 5),
+    ... }, store=FileStore('/tmp/singlehop.ratelimit'))
+    >>> sm = ServerModule(rate_limiter=limiter)
+
+A FileStore lets every process on a host draw from the same buckets.
+
+"""
+from common import SingleHopError
+import os
+import threading
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class MemoryStore(object):
+    """
+    Bucket state shared between threads of one process
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def update(self, func):
+        """
+        Calls func with the bucket state dict under a lock
+
+        :rtype: Result of func
+
+        """
+        with self._lock:
+            return func(self._state)
+
+class FileStore(object):
+    """
+    Bucket state shared between processes through a locked file
+
+    :keyword path: Path of the state file (created if missing)
+
+    """
+    def __init__(self, path):
+        if fcntl is None:
+            raise SingleHopError('FileStore requires fcntl file locking')
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property # getter for _path
+    def path(self):
+        return self._path
+
+    def update(self, func):
+        with self._lock:
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            f = os.fdopen(fd, 'r+')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                content = f.read()
+                state = json.loads(content) if content else {}
+                result = func(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                # closing the file releases the lock
+                f.close()
+            return result
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter consulted by do_request
+
+    :keyword rates: Dict of bucket key ('*', '<module>' or
+        '<module>.<command>') to (rate, burst)
+    :keyword store: (optional) MemoryStore (default) or FileStore
+
+    """
+    def __init__(self, rates=None, store=None):
+        self._rates = dict(rates or {})
+        self._store = store or MemoryStore()
+        for key, (rate, burst) in self._rates.items():
+            if rate <= 0 or burst < 1:
+                raise SingleHopError('Invalid rate for %s: %r' % (key, (rate, burst)))
+
+    @property # getter for _rates
+    def rates(self):
+        return self._rates
+    @property # getter for _store
+    def store(self):
+        return self._store
+
+    def buckets(self, module, command):
+        """
+        Returns the bucket keys that apply to a request
+
+        """
+        keys = ('*', module, '%s.%s' % (module, command))
+        return [key for key in keys if key in self._rates]
+
+    def try_acquire(self, module, command):
+        """
+        Takes a token from every applicable bucket if all have one
+
+        :rtype: 0 on success, otherwise seconds until a token is available
+
+        """
+        keys = self.buckets(module, command)
+        if not keys:
+            return 0
+        def take(state):
+            now = time.time()
+            levels = {}
+            wait = 0
+            for key in keys:
+                rate, burst = self._rates[key]
+                tokens, stamp = state.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                levels[key] = tokens
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / float(rate))
+            for key in keys:
+                state[key] = (levels[key] - (0 if wait else 1), now)
+            return wait
+        return self._store.update(take)
+
+    def acquire(self, module, command, timeout=None):
+        """
+        Blocks until a request may be sent
+
+        :keyword timeout: (optional) Maximum seconds to wait
+        :rtype: True if acquired, False on timeout
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self.try_acquire(module, command)
+            if not wait:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
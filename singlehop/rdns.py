@@ -0,0 +1,150 @@
+"""
+Reverse DNS reconciliation
+
+    >>> reconciler = RdnsReconciler(ServerModule())
+    >>> report = reconciler.reconcile({
+    ...     '123456': {'10.0.0.1': 'mail.domain.com', '10.0.0.2': 'www.domain.com'},
+    ...     '123457': {'10.0.1.1': 'db.domain.com'},
+    ... })
+    >>> report.changes, report.errors
+
+"""
+from common import SingleHopError
+
+class RdnsReport(object):
+    """
+    Outcome of RdnsReconciler.reconcile
+
+    :keyword changes: Dict of IP to (current, desired) hostname for the
+        entries that differed
+    :keyword unknown: Dict of IP to server id for desired IPs the server
+        does not have
+    :keyword errors: List of (server id or list of IPs, message) for reads
+        and updates that failed
+    :keyword reads: Number of get_rdns_list calls made
+    :keyword writes: Number of update_rdns calls made
+
+    """
+    def __init__(self):
+        self.changes = {}
+        self.unknown = {}
+        self.errors = []
+        self.reads = 0
+        self.writes = 0
+
+    @property
+    def converged(self):
+        return not self.changes and not self.unknown and not self.errors
+
+class RdnsReconciler(object):
+    """
+    Brings reverse DNS entries of many servers to a desired state
+
+    Current entries are read concurrently with get_rdns_list ; only
+    entries that differ are sent, batch_size IPs per update_rdns call, so
+    a fleet that is already converged costs only the reads.
+
+    :keyword module: ServerModule
+    :keyword batch_size: Maximum IPs per update_rdns call (with the 'get'
+        transport each call is a single URL, so very large batches may
+        exceed URL limits ; the 'post' transport has no such limit)
+    :keyword max_workers: Concurrent requests (defaults to the connection
+        pool size)
+
+    """
+    def __init__(self, module, batch_size=100, max_workers=None):
+        if batch_size < 1:
+            raise SingleHopError('batch_size must be at least 1')
+        self._module = module
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+
+    @property # getter for _batch_size
+    def batch_size(self):
+        return self._batch_size
+
+    def current(self, server_ids, report=None):
+        """
+        Reads the reverse DNS entries of servers
+
+        :rtype: Dict of server id to dict of IP to hostname
+
+        """
+        if report is None:
+            report = RdnsReport()
+        entries = {}
+        for r in self._module.bulk('get_rdns_list', list(server_ids), self._max_workers):
+            report.reads += 1
+            data = None
+            if r.error is None and isinstance(r.result, dict) and r.result.get('success', True):
+                data = _entries(r.result.get('data'))
+            if data is None:
+                report.errors.append((r.item, _message(r.error, r.result)))
+            else:
+                entries[r.item] = data
+        return entries
+
+    def diff(self, desired, current, report=None):
+        """
+        Returns the IP to hostname entries that need updating
+
+        """
+        if report is None:
+            report = RdnsReport()
+        updates = {}
+        for server_id, wanted in desired.items():
+            have = current.get(server_id)
+            if have is None:
+                continue
+            for ip, host in wanted.items():
+                if ip not in have:
+                    report.unknown[ip] = server_id
+                elif (have[ip] or '') != (host or ''):
+                    report.changes[ip] = (have[ip], host)
+                    updates[ip] = host
+        return updates
+
+    def reconcile(self, desired, dry_run=False):
+        """
+        Updates the entries that differ from the desired state
+
+        :keyword desired: Dict of server id to dict of IP to hostname
+        :keyword dry_run: Only compute the changes
+        :rtype: RdnsReport
+
+        """
+        report = RdnsReport()
+        desired = dict((str(k), v) for k, v in desired.items())
+        current = self.current(sorted(desired), report)
+        updates = self.diff(desired, current, report)
+        if dry_run or not updates:
+            return report
+        ips = sorted(updates)
+        batches = [dict((ip, updates[ip]) for ip in ips[i:i + self._batch_size])
+            for i in range(0, len(ips), self._batch_size)]
+        for r in self._module.bulk('update_rdns', batches, self._max_workers):
+            report.writes += 1
+            if r.error is not None or not isinstance(r.result, dict) or \
+                not r.result.get('success', True):
+                report.errors.append((sorted(r.item), _message(r.error, r.result)))
+        return report
+
+def _entries(data):
+    # get_rdns_list data as a dict of IP to hostname
+    if isinstance(data, dict):
+        return data
+    if isinstance(data, list):
+        entries = {}
+        for item in data:
+            if not isinstance(item, dict) or 'ip' not in item:
+                return None
+            entries[item['ip']] = item.get('rdns', item.get('host'))
+        return entries
+    return None
+
+def _message(error, result):
+    if error is not None:
+        return str(getattr(error, 'value', error))
+    if isinstance(result, dict) and result.get('error'):
+        return result['error']
+    return 'Unexpected response'
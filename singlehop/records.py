@@ -0,0 +1,236 @@
+"""
+Compact typed records for LEAP results
+
+Modules created with ``records=True`` return these instead of plain dicts
+for the commands listed in RESULTS.  Records use ``__slots__``, convert
+numeric fields once when parsed and keep dict-style access (``r['ram']``,
+``r.get()``, ``r.keys()``) so existing code keeps working.
+
+Server and VM ids stay strings (interned) since they are zero padded and
+are passed back to the API as-is.
+
+"""
+import socket
+import struct
+import sys
+
+try:
+    intern = intern
+except NameError:
+    intern = sys.intern
+
+def _int(value):
+    # empty values are kept as given
+    if value in (None, ''):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+def _bool(value):
+    if value in (None, ''):
+        return value
+    return str(value) not in ('0', 'false', 'False')
+
+def _str(value):
+    # short repeated strings (ids, types) share one object
+    if value is None:
+        return None
+    try:
+        return intern(str(value))
+    except UnicodeError:
+        return value
+
+def _text(value):
+    return value
+
+def _ip(value):
+    try:
+        return struct.unpack('!I', socket.inet_aton(value))[0]
+    except (socket.error, TypeError):
+        return value
+
+def _ip_format(value):
+    if isinstance(value, int) or (sys.version_info[0] < 3 and isinstance(value, long)):
+        return socket.inet_ntoa(struct.pack('!I', value))
+    return value
+
+class Record(object):
+    """
+    Base class for slotted records
+
+    Subclasses list their fields in ``_fields`` as (name, parse) pairs and
+    may map field names to output formatters in ``_formats``.  Fields not
+    declared are kept in ``_extra``; declared fields missing from the data
+    are listed in ``_absent`` (their attribute is None) so a field that is
+    present but None or '' still shows in keys().
+
+    """
+    __slots__ = ('_extra', '_absent')
+    _fields = ()
+    _formats = {}
+
+    def __init__(self, **kwargs):
+        self._extra = None
+        absent = ()
+        for name, parse in self._fields:
+            if name in kwargs:
+                setattr(self, name, parse(kwargs.pop(name)))
+            else:
+                setattr(self, name, None)
+                absent += (name,)
+        self._absent = absent
+        if kwargs:
+            self._extra = kwargs
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**dict((str(k), v) for k, v in data.items()))
+
+    def keys(self):
+        keys = [name for name, parse in self._fields if name not in self._absent]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __getitem__(self, key):
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        if key in self._slot_names() and key not in self._absent:
+            value = getattr(self, key)
+            fmt = self._formats.get(key)
+            return fmt(value) if fmt and value is not None else value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+            ', '.join('%s=%r' % item for item in self.items()))
+
+    @classmethod
+    def _slot_names(cls):
+        names = cls.__dict__.get('_names')
+        if names is None:
+            names = frozenset(name for name, parse in cls._fields)
+            cls._names = names
+        return names
+
+class Server(Record):
+    """
+    Dedicated server or Cascade host node from list_servers
+
+    """
+    __slots__ = ('server_id', 'type', 'server')
+    _fields = (('server_id', _str), ('type', _str), ('server', _text))
+
+class Vm(Record):
+    """
+    Cascade VM from list_servers
+
+    """
+    __slots__ = ('server_id', 'type', 'server', 'parent_id')
+    _fields = (('server_id', _str), ('type', _str), ('server', _text), ('parent_id', _str))
+
+class IpAllocation(Record):
+    """
+    IP allocated to a server (addresses are stored as integers)
+
+    """
+    __slots__ = ('ip', 'netmask', 'gateway')
+    _fields = (('ip', _ip), ('netmask', _ip), ('gateway', _ip))
+    _formats = {'ip': _ip_format, 'netmask': _ip_format, 'gateway': _ip_format}
+
+class Snapshot(Record):
+    """
+    Cascade OS snapshot from cascade_list_snapshots
+
+    """
+    __slots__ = ('id', 'name', 'arch', 'os', 'price', 'cpanel')
+    _fields = (('id', _int), ('name', _text), ('arch', _str), ('os', _str),
+        ('price', _int), ('cpanel', _bool))
+
+class AvailableServer(Record):
+    """
+    Server configuration from list_available_servers
+
+    """
+    __slots__ = ('orders_server_id', 'hdid', 'name', 'realname', 'price', 'maxdrives',
+        'ram', 'harddrive', 'bandwidth', 'processor')
+    _fields = (('orders_server_id', _int), ('hdid', _int), ('name', _text),
+        ('realname', _text), ('price', _int), ('maxdrives', _int), ('ram', _str),
+        ('harddrive', _str), ('bandwidth', _str), ('processor', _str))
+
+def server_record(data):
+    """
+    Builds a Vm or Server record from a list_servers entry
+
+    """
+    if data.get('type') == 'vm' or 'parent_id' in data:
+        return Vm.from_dict(data)
+    return Server.from_dict(data)
+
+# LEAP command -> (member holding the list or None for a top-level list,
+# record factory)
+RESULTS = {
+    'listServers': ('servers', server_record),
+    'getServerIps': ('data', IpAllocation.from_dict),
+    'cascadeListSnapshots': (None, Snapshot.from_dict),
+    'listAvailableServers': (None, AvailableServer.from_dict),
+}
+
+def convert(command, result):
+    """
+    Replaces the dicts in a parsed result with records
+
+    Results with an unexpected shape (i.e. errors) are returned unchanged.
+
+    """
+    spec = RESULTS.get(command)
+    if spec is None:
+        return result
+    key, factory = spec
+    if key is None:
+        items = result
+    elif isinstance(result, dict):
+        items = result.get(key)
+    else:
+        return result
+    if not isinstance(items, list):
+        return result
+    records = [factory(item) if isinstance(item, dict) else item for item in items]
+    if key is None:
+        return records
+    result[key] = records
+    return result
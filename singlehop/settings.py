@@ -2,6 +2,19 @@ API_KEY = ''
 CLIENT_ID = ''
 PASSWORD = ''
 ENDPOINT_URL = 'https://leap.singlehop.com/api.php?request='
+POOL_SIZE = 10
+POOL_IDLE_TIMEOUT = 60.0
+# 'get' (request in the URL) or 'post' (request in the body)
+TRANSPORT = 'get'
+CACHE_SIZE = 1024
+# seconds to cache read-only commands when a ResponseCache is used
+CACHE_TTLS = {
+    'listServers': 60,
+    'getServerDetails': 60,
+    'getOsList': 3600,
+    'listAvailableServers': 3600,
+    'cascadeListSnapshots': 3600,
+}
 
 try:
     from local_settings import *
@@ -0,0 +1,586 @@
+"""
+Local stand-in for the SingleHop LEAP API
+
+Speaks the same ``?request=<json>`` protocol as leap.singlehop.com (as a
+GET query string or a form-encoded POST body) and
+implements every AccountModule and ServerModule command against a
+generated in-memory fleet, so the client can be tested and benchmarked
+without credentials:
+
+    >>> from singlehop.standin import StandInServer
+    >>> with StandInServer(fleet_size=100, latency=0.01) as srv:
+    ...     sm = ServerModule(api_key='key', client_id='1', password='pw',
+    ...         endpoint_url=srv.endpoint_url)
+    ...     sm.list_servers()
+
+"""
+from random import Random
+import threading
+import time
+import zlib
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote
+
+GB = 1024 * 1024 * 1024
+# responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 256
+
+# required data fields per command
+REQUIRED = {
+    'tandemAddUser': ('name', 'email', 'password'),
+    'tandemDeleteUser': ('userid',),
+    'tandemAddUserPermission': ('userid', 'serverid'),
+    'tandemDeleteUserPermission': ('userid', 'serverid'),
+    'getServerDetails': ('serverid',),
+    'getServerIps': ('serverid',),
+    'getServerBandwidth': ('serverid',),
+    'getRdnsList': ('serverid',),
+    'rebootServer': ('serverid',),
+    'getOsList': ('serverid',),
+    'reinstallServer': ('serverid', 'osid'),
+    'cancellationRequest': ('servers', 'happy', 'reason'),
+    'cascadeGetCpuUsage': ('serverid',),
+    'cascadeGetNodeProperties': ('serverid',),
+    'cascadeEditVm': ('vmid',),
+    'cascadeMoveVm': ('vmid', 'serverid'),
+    'cascadeCreateVm': ('serverid', 'hostname', 'os', 'ram', 'storage', 'cpu',
+        'vcpu', 'ips', 'imgstore'),
+    'cascadeSnapshotVm': ('vmid',),
+    'cascadeDeleteVm': ('vmid',),
+    'cascadeRebootVm': ('vmid',),
+    'cascadeShutdownVm': ('vmid',),
+    'cascadeStartVm': ('vmid',),
+}
+
+SNAPSHOTS = [
+    {'name': 'CentOS 5.6 32Bit', 'arch': 'i386', 'price': 0, 'cpanel': '0', 'os': 'centos', 'id': '68'},
+    {'name': 'CentOS 5.6 64Bit', 'arch': 'amd64', 'price': 0, 'cpanel': '0', 'os': 'centos', 'id': '69'},
+    {'name': 'Standard Debian 64Bit', 'arch': 'amd64', 'price': 0, 'cpanel': '0', 'os': 'debian', 'id': '4'},
+    {'name': 'Ubuntu 10.04 64Bit', 'arch': 'amd64', 'price': 0, 'cpanel': '0', 'os': 'ubuntu', 'id': '12'},
+]
+
+AVAILABLE_SERVERS = [
+    {'name': 'Supercharged S-L5410 Single Processor ', 'maxdrives': '2', 'orders_server_id': '22',
+     'price': '249', 'ram': '6GB (Included)', 'harddrive': '250GB Enterprise Hard Drive',
+     'bandwidth': '5,000GB', 'hdid': '19',
+     'processor': 'Intel Xeon Quad-Core Harpertown LV 5410 2.33GHz 12MB Cache',
+     'realname': 'Supercharged S-L5410 Single Processor Dedicated Server'},
+]
+
+OS_LIST = [
+    {'id': '1', 'name': 'CentOS 5 64Bit'},
+    {'id': '2', 'name': 'Debian 6 64Bit'},
+    {'id': '3', 'name': 'Windows Server 2008'},
+]
+
+class LeapStandIn(object):
+    """
+    In-memory LEAP API state and command handlers
+
+    :keyword fleet_size: Number of servers (host nodes and VMs) to generate
+    :keyword vms_per_node: Number of VMs per Cascade host node
+    :keyword error_rate: Fraction of requests answered with an error
+    :keyword seed: Seed for generated data and injected errors
+    :keyword transition_time: Seconds reboots, reinstalls, starts and
+        shutdowns take before the new status is reported
+    :keyword list_status: Include each server's status in listServers
+
+    """
+    def __init__(self, fleet_size=10, vms_per_node=9, error_rate=0.0, seed=None,
+        transition_time=0.0, list_status=False):
+        self.error_rate = error_rate
+        self.transition_time = transition_time
+        self.list_status = list_status
+        self._random = Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.servers = {}
+        self.users = {}
+        self.requests = 0
+        self.commands = {}
+        self._generate(fleet_size, vms_per_node)
+
+    def _new_id(self):
+        server_id = '%06d' % self._next_id
+        self._next_id += 1
+        return server_id
+
+    def _generate(self, fleet_size, vms_per_node):
+        node = None
+        for i in range(fleet_size):
+            if node is None or len(node['children']) >= vms_per_node:
+                node = self._add_node()
+            else:
+                self._add_vm(node['server_id'], 'vm%d.example.com' % i,
+                    ram=2 * GB, storage=20 * GB, vcpu=2)
+
+    def _add_node(self):
+        server_id = self._new_id()
+        node = {
+            'server_id': server_id,
+            'type': 'vmnode',
+            'server': 'host%s.example.com' % server_id,
+            'status': 'running',
+            'ram': 64 * GB,
+            'storage': 2048 * GB,
+            'vcpu': 32,
+            'children': [],
+            'ips': self._ips(server_id, 1),
+        }
+        self.servers[server_id] = node
+        return node
+
+    def _add_vm(self, parent_id, hostname, ram, storage, vcpu, os='4', ips=30):
+        server_id = self._new_id()
+        vm = {
+            'server_id': server_id,
+            'parent_id': parent_id,
+            'type': 'vm',
+            'server': hostname,
+            'status': 'running',
+            'os': os,
+            'ram': int(ram),
+            'storage': int(storage),
+            'vcpu': int(vcpu),
+            'ips': self._ips(server_id, 2 ** (32 - int(ips)) - 2),
+        }
+        self.servers[server_id] = vm
+        self.servers[parent_id]['children'].append(server_id)
+        return vm
+
+    def _ips(self, server_id, count):
+        n = int(server_id)
+        base = '10.%d.%d.' % ((n >> 8) & 255, n & 255)
+        return dict((base + str(i + 1), '') for i in range(count))
+
+    def _free(self, node):
+        children = [self.servers[c] for c in node['children']]
+        return {
+            'freeram': node['ram'] - sum(c['ram'] for c in children),
+            'freestorage': node['storage'] - sum(c['storage'] for c in children),
+            'freevcpu': node['vcpu'] - sum(c['vcpu'] for c in children),
+        }
+
+    def _record(self, server):
+        record = {
+            'server_id': server['server_id'],
+            'type': server['type'],
+            'server': server['server'],
+        }
+        if 'parent_id' in server:
+            record['parent_id'] = server['parent_id']
+        if self.list_status:
+            record['status'] = self._status(server)
+        return record
+
+    def _transition(self, server, during, after):
+        # the server reports `during` until transition_time has passed
+        if self.transition_time > 0:
+            server['status'] = during
+            server['settles'] = (time.time() + self.transition_time, after)
+        else:
+            server['status'] = after
+            server.pop('settles', None)
+
+    def _status(self, server):
+        settles = server.get('settles')
+        if settles and settles[0] <= time.time():
+            server['status'] = settles[1]
+            del server['settles']
+        return server['status']
+
+    def _server(self, server_id, server_type=None):
+        server = self.servers.get(str(server_id))
+        if server is None or (server_type and server['type'] != server_type):
+            raise StandInError('Invalid server')
+        return server
+
+    def handle(self, request):
+        """
+        Handles a decoded LEAP request dict
+
+        :rtype: Response object (dict or list) to serialize as JSON
+
+        """
+        auth = request.get('auth') or {}
+        module = request.get('module') or {}
+        command = module.get('command')
+        data = request.get('data') or {}
+        with self._lock:
+            self.requests += 1
+            self.commands[command] = self.commands.get(command, 0) + 1
+            if not auth.get('key') or not auth.get('user') or not auth.get('password'):
+                return {'success': False, 'error': 'Authentication failed'}
+            handler = getattr(self, 'cmd_' + str(command), None)
+            if handler is None:
+                return {'success': False, 'error': 'No Such Command'}
+            if self.error_rate and self._random.random() < self.error_rate:
+                return {'success': False, 'error': 'Simulated error'}
+            for field in REQUIRED.get(command, ()):
+                if data.get(field) in (None, ''):
+                    return {'success': False, 'error': 'Missing parameter: %s' % field}
+            try:
+                return handler(data)
+            except StandInError as e:
+                return {'success': False, 'error': str(e)}
+
+    # account module
+
+    def cmd_getAccountDetails(self, data):
+        return {'success': True, 'data': {'clientid': 123456, 'first': 'Test',
+            'last': 'User', 'company': 'Acme', 'email': 'user@example.com',
+            'address': '123 Anywhere', 'city': 'Anytown', 'state': 'IN',
+            'zip': '12345', 'country': 'US', 'phone': '123-456-7890',
+            'fax': '123-456-7890'}}
+
+    def cmd_getAuthorizedContacts(self, data):
+        return {'success': True, 'data': [{'name': 'Test User',
+            'email': 'user@example.com', 'phone': '123-456-7890'}]}
+
+    def cmd_tandemList(self, data):
+        users = []
+        for user_id in sorted(self.users, key=int):
+            user = self.users[user_id]
+            users.append({'userid': user_id, 'name': user['name'],
+                'email': user['email'], 'servers': sorted(user['servers'])})
+        return {'success': True, 'data': users}
+
+    def cmd_tandemAddUser(self, data):
+        user_id = str(len(self.users) + 1)
+        while user_id in self.users:
+            user_id = str(int(user_id) + 1)
+        self.users[user_id] = {'name': data['name'], 'email': data['email'],
+            'servers': set()}
+        return {'success': True, 'userid': user_id}
+
+    def _user(self, user_id):
+        user = self.users.get(str(user_id))
+        if user is None:
+            raise StandInError('Invalid user')
+        return user
+
+    def cmd_tandemDeleteUser(self, data):
+        self._user(data['userid'])
+        del self.users[str(data['userid'])]
+        return {'success': True}
+
+    def cmd_tandemAddUserPermission(self, data):
+        self._server(data['serverid'])
+        self._user(data['userid'])['servers'].add(str(data['serverid']))
+        return {'success': True}
+
+    def cmd_tandemDeleteUserPermission(self, data):
+        self._user(data['userid'])['servers'].discard(str(data['serverid']))
+        return {'success': True}
+
+    # server module
+
+    def cmd_listServers(self, data):
+        servers = [self._record(self.servers[k]) for k in sorted(self.servers)]
+        return {'success': True, 'servers': servers}
+
+    def cmd_getServerDetails(self, data):
+        server = self._server(data['serverid'])
+        details = self._record(server)
+        self._status(server)
+        for field in ('status', 'ram', 'storage', 'vcpu', 'os'):
+            if field in server:
+                details[field] = server[field]
+        details['ips'] = sorted(server['ips'])
+        return {'success': True, 'data': details}
+
+    def cmd_getServerIps(self, data):
+        server = self._server(data['serverid'])
+        ips = [{'ip': ip, 'netmask': '255.255.255.0', 'gateway': ip.rsplit('.', 1)[0] + '.254'}
+            for ip in sorted(server['ips'])]
+        return {'success': True, 'data': ips}
+
+    def cmd_getServerBandwidth(self, data):
+        server = self._server(data['serverid'])
+        rnd = Random(server['server_id'])
+        bw_in = rnd.randint(0, 500000)
+        bw_out = rnd.randint(0, 2000000)
+        return {'success': True, 'data': {'in': bw_in, 'out': bw_out,
+            'total': bw_in + bw_out, 'limit': 5000000}}
+
+    def cmd_getRdnsList(self, data):
+        server = self._server(data['serverid'])
+        return {'success': True, 'data': dict(server['ips'])}
+
+    def cmd_updateRdns(self, data):
+        owners = {}
+        for server in self.servers.values():
+            for ip in server['ips']:
+                owners[ip] = server
+        for ip in data:
+            if ip not in owners:
+                raise StandInError('Invalid IP: %s' % ip)
+        for ip, host in data.items():
+            owners[ip]['ips'][ip] = host
+        return {'success': True, 'updated': len(data)}
+
+    def cmd_rebootServer(self, data):
+        self._transition(self._server(data['serverid']), 'rebooting', 'running')
+        return {'success': True, 'message': 'Server rebooted'}
+
+    def cmd_getOsList(self, data):
+        self._server(data['serverid'])
+        return {'success': True, 'data': OS_LIST}
+
+    def cmd_reinstallServer(self, data):
+        server = self._server(data['serverid'])
+        server['os'] = str(data['osid'])
+        self._transition(server, 'reinstalling', 'running')
+        return {'success': True, 'message': 'Server reinstall started'}
+
+    def cmd_listAvailableServers(self, data):
+        return AVAILABLE_SERVERS
+
+    def cmd_cancellationRequest(self, data):
+        for server_id in data['servers']:
+            self._server(server_id)
+        return {'success': True, 'message': 'Cancellation request submitted'}
+
+    def cmd_cascadeGetCpuUsage(self, data):
+        self._server(data['serverid'], 'vm')
+        return {'success': True, 'data': {'usage': round(self._random.random() * 100, 2)}}
+
+    def cmd_cascadeGetNodeProperties(self, data):
+        node = self._server(data['serverid'], 'vmnode')
+        props = {'ram': node['ram'], 'storage': node['storage'], 'vcpu': node['vcpu'],
+            'vms': len(node['children'])}
+        props.update(self._free(node))
+        return {'success': True, 'data': props}
+
+    def cmd_cascadeListSnapshots(self, data):
+        return SNAPSHOTS
+
+    def cmd_cascadeEditVm(self, data):
+        vm = self._server(data['vmid'], 'vm')
+        if data.get('hostname'):
+            vm['server'] = data['hostname']
+        for field in ('ram', 'storage', 'vcpu'):
+            if data.get(field):
+                vm[field] = int(data[field])
+        return {'success': True, 'message': 'VM updated'}
+
+    def cmd_cascadeMoveVm(self, data):
+        vm = self._server(data['vmid'], 'vm')
+        node = self._server(data['serverid'], 'vmnode')
+        if self._free(node)['freeram'] < vm['ram']:
+            raise StandInError('Target node does not have enough free RAM')
+        self.servers[vm['parent_id']]['children'].remove(vm['server_id'])
+        node['children'].append(vm['server_id'])
+        vm['parent_id'] = node['server_id']
+        return {'success': True, 'message': 'VM moved'}
+
+    def cmd_cascadeCreateVm(self, data):
+        node = self._server(data['serverid'], 'vmnode')
+        if str(data['os']) not in [s['id'] for s in SNAPSHOTS]:
+            raise StandInError('Invalid os')
+        for server in self.servers.values():
+            if server['server'] == data['hostname']:
+                raise StandInError('Hostname already in use')
+        free = self._free(node)
+        if free['freeram'] < int(data['ram']) or free['freestorage'] < int(data['storage']) \
+            or free['freevcpu'] < int(data['vcpu']):
+            raise StandInError('Host node does not have enough free resources')
+        vm = self._add_vm(node['server_id'], data['hostname'], data['ram'],
+            data['storage'], data['vcpu'], str(data['os']), data['ips'])
+        return {'success': True, 'vmid': vm['server_id'], 'message': 'VM created'}
+
+    def cmd_cascadeSnapshotVm(self, data):
+        self._server(data['vmid'], 'vm')
+        return {'success': True, 'message': 'Snapshot started'}
+
+    def cmd_cascadeDeleteVm(self, data):
+        vm = self._server(data['vmid'], 'vm')
+        self.servers[vm['parent_id']]['children'].remove(vm['server_id'])
+        del self.servers[vm['server_id']]
+        return {'success': True, 'message': 'VM deleted'}
+
+    def cmd_cascadeRebootVm(self, data):
+        self._transition(self._server(data['vmid'], 'vm'), 'rebooting', 'running')
+        return {'message': 'VM rebooted', 'result': 'ok', 'success': True}
+
+    def cmd_cascadeShutdownVm(self, data):
+        self._transition(self._server(data['vmid'], 'vm'), 'stopping', 'stopped')
+        return {'message': 'VM shut down', 'result': 'ok', 'success': True}
+
+    def cmd_cascadeStartVm(self, data):
+        self._transition(self._server(data['vmid'], 'vm'), 'starting', 'running')
+        return {'message': 'VM started', 'result': 'ok', 'success': True}
+
+class StandInError(Exception):
+    pass
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # write each response in one segment so keep-alive connections are not
+    # stalled by Nagle / delayed ACK interaction
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.count_in(len(self.requestline) + len(str(self.headers)))
+        if '?request=' not in self.path:
+            return self._reply_raw(404, 'text/html', b'<html><b>Not found</b></html>')
+        self._handle(unquote(self.path.split('?request=', 1)[1]))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.count_in(len(self.requestline) + len(str(self.headers)) + len(body))
+        payload = parse_qs(body.decode('utf-8')).get('request')
+        if not payload:
+            return self._reply_raw(404, 'text/html', b'<html><b>Not found</b></html>')
+        self._handle(payload[0])
+
+    def _handle(self, payload):
+        try:
+            request = json.loads(payload)
+        except ValueError:
+            return self._reply(200, {'success': False, 'error': 'JSON Decoding error'})
+        standin = self.server.standin
+        latency = self.server.latency
+        if self.server.jitter:
+            latency += standin._random.random() * self.server.jitter
+        if latency:
+            time.sleep(latency)
+        self._reply(200, standin.handle(request))
+
+    def _reply(self, status, obj):
+        self._reply_raw(status, 'application/json', json.dumps(obj).encode('utf-8'))
+
+    def _reply_raw(self, status, content_type, body):
+        encoding = None
+        if self.server.compress and len(body) >= COMPRESS_MIN_SIZE:
+            accepted = [e.split(';')[0].strip()
+                for e in (self.headers.get('Accept-Encoding') or '').split(',')]
+            encoding = 'gzip' if 'gzip' in accepted else \
+                'deflate' if 'deflate' in accepted else None
+        if encoding is not None:
+            # gzip framing is wbits 16 + MAX_WBITS, deflate (zlib) the default
+            wbits = zlib.MAX_WBITS + (16 if encoding == 'gzip' else 0)
+            compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_out(len(body))
+
+    def log_message(self, *args):
+        pass
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # many clients may open connections at once (i.e. one pool per account)
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.bytes_lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def count_in(self, size):
+        with self.bytes_lock:
+            self.bytes_in += size
+
+    def count_out(self, size):
+        with self.bytes_lock:
+            self.bytes_out += size
+
+class StandInServer(object):
+    """
+    Threaded HTTP server serving a LeapStandIn
+
+    :keyword host: Address to bind
+    :keyword port: Port to bind (0 picks a free port)
+    :keyword latency: Seconds to delay every response
+    :keyword jitter: Additional random delay of up to this many seconds
+    :keyword compress: Compress responses of COMPRESS_MIN_SIZE bytes or more
+        with the gzip or deflate encoding the client accepts
+    :keyword standin: (optional) LeapStandIn to serve ; other keywords
+        (fleet_size, vms_per_node, error_rate, seed) build one
+
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+        compress=False, standin=None, **kwargs):
+        if standin is None:
+            standin = LeapStandIn(**kwargs)
+        self.standin = standin
+        self._httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.standin = standin
+        self._httpd.latency = latency
+        self._httpd.jitter = jitter
+        self._httpd.compress = compress
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    @property
+    def endpoint_url(self):
+        return 'http://%s:%d/api.php?request=' % self.address
+
+    @property
+    def bytes_in(self):
+        # request line, headers and body of every request received
+        return self._httpd.bytes_in
+
+    @property
+    def bytes_out(self):
+        # response bodies as sent (after compression)
+        return self._httpd.bytes_out
+
+    def reset_counters(self):
+        with self._httpd.bytes_lock:
+            self._httpd.bytes_in = 0
+            self._httpd.bytes_out = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+            kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    srv = StandInServer(port=port, fleet_size=100)
+    print('Serving LEAP stand-in on %s' % srv.endpoint_url)
+    try:
+        srv._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+"""
+Incremental parsing of large JSON responses
+
+"""
+import codecs
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+_WHITESPACE = ' \t\n\r'
+
+class StreamError(ValueError):
+    pass
+
+class _Buffer(object):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Reads the next chunk ; returns False at the end of the stream
+
+        """
+        if self.eof:
+            return False
+        # drop consumed text so memory stays bounded by the chunk size
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.text += self._decoder.decode(chunk)
+                return True
+        self.text += self._decoder.decode(b'', True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character (or None at the end)
+
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise StreamError('Expected %r at offset %d' % (char, self.pos))
+        self.pos += 1
+
+    def value(self, decoder):
+        """
+        Decodes the next complete JSON value
+
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                obj, end = None, None
+            # a value running up to the end of the buffer may be truncated
+            # (i.e. a number), so only accept it once more text follows
+            if end is not None and (end < len(self.text) or self.eof):
+                self.pos = end
+                return obj
+            if not self.fill():
+                if end is not None:
+                    self.pos = end
+                    return obj
+                raise StreamError('Truncated or invalid JSON at offset %d' % self.pos)
+
+def iter_array(chunks, key, extra=None):
+    """
+    Yields the elements of a top-level object's array member one at a time
+
+    Only one element is held in memory at a time, and elements are
+    yielded as soon as their bytes arrive.
+
+    :keyword chunks: Iterable of response body byte chunks
+    :keyword key: Name of the array member (i.e. servers)
+    :keyword extra: (optional) Dict receiving the object's other members
+
+    """
+    if extra is None:
+        extra = {}
+    decoder = json.JSONDecoder()
+    buf = _Buffer(chunks)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        name = buf.value(decoder)
+        buf.expect(':')
+        if name == key and buf.peek() == '[':
+            buf.pos += 1
+            if buf.peek() == ']':
+                buf.pos += 1
+            else:
+                while True:
+                    yield buf.value(decoder)
+                    char = buf.peek()
+                    buf.pos += 1
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise StreamError('Expected , or ] at offset %d' % (buf.pos - 1))
+        else:
+            extra[name] = buf.value(decoder)
+        char = buf.peek()
+        buf.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise StreamError('Expected , or } at offset %d' % (buf.pos - 1))
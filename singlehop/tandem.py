@@ -0,0 +1,140 @@
+"""
+Tandem permission synchronization
+
+    >>> sync = TandemSync(AccountModule())
+    >>> report = sync.sync({
+    ...     'ops@domain.com': ['123456', '123457'],
+    ...     '42': ['123456'],
+    ...     'former@domain.com': [],
+    ... })
+    >>> report.grants, report.revokes, report.errors
+
+"""
+from common import SingleHopError
+
+class TandemReport(object):
+    """
+    Outcome of TandemSync.sync
+
+    :keyword grants: Set of (user id, server id) permissions added
+    :keyword revokes: Set of (user id, server id) permissions removed
+    :keyword unknown: Set of desired users not found in tandem_list
+    :keyword errors: List of ((action, user id, server id), message) for
+        changes that failed
+    :keyword calls: Number of API calls made
+
+    """
+    def __init__(self):
+        self.grants = set()
+        self.revokes = set()
+        self.unknown = set()
+        self.errors = []
+        self.calls = 0
+
+    @property
+    def converged(self):
+        return not self.grants and not self.revokes and not self.unknown and \
+            not self.errors
+
+class TandemSync(object):
+    """
+    Brings Tandem user permissions to a desired users x servers matrix
+
+    The current matrix is read with one tandem_list call ; only the
+    difference is applied, as tandem_add_user_permission and
+    tandem_delete_user_permission calls run concurrently.  Users left out
+    of the desired matrix are not touched ; a user mapped to no servers
+    loses all permissions.
+
+    :keyword module: AccountModule (or AsyncAccountModule)
+    :keyword max_workers: Concurrent requests (defaults to the connection
+        pool size)
+
+    """
+    def __init__(self, module, max_workers=None):
+        self._module = module
+        self._max_workers = max_workers
+
+    def current(self):
+        """
+        Reads the permission matrix
+
+        :rtype: Tuple of (dict of user id to set of server ids, dict of
+            email to user id)
+
+        """
+        resp = self._module._command('tandem_list')()
+        users = resp.get('data') if isinstance(resp, dict) else None
+        if not isinstance(users, list):
+            raise SingleHopError('Unable to list Tandem users')
+        matrix = {}
+        emails = {}
+        for user in users:
+            user_id = str(user['userid'])
+            matrix[user_id] = set(str(s) for s in user.get('servers') or ())
+            if user.get('email'):
+                emails[user['email'].lower()] = user_id
+        return matrix, emails
+
+    def diff(self, desired, current, emails=None, report=None):
+        """
+        Returns the (grants, revokes) needed to reach the desired matrix
+
+        :keyword desired: Dict of user id (or email) to server ids
+        :keyword current: Dict of user id to set of server ids
+        :keyword emails: (optional) Dict of lowercase email to user id
+
+        """
+        if report is None:
+            report = TandemReport()
+        emails = emails or {}
+        grants = set()
+        revokes = set()
+        for user, servers in desired.items():
+            user = str(user)
+            user_id = user if user in current else emails.get(user.lower())
+            if user_id is None:
+                report.unknown.add(user)
+                continue
+            wanted = set(str(s) for s in servers)
+            have = current[user_id]
+            grants.update((user_id, s) for s in wanted - have)
+            revokes.update((user_id, s) for s in have - wanted)
+        return grants, revokes
+
+    def sync(self, desired, dry_run=False):
+        """
+        Applies the difference between the current and desired matrix
+
+        :keyword desired: Dict of user id (or email) to server ids
+        :keyword dry_run: Only compute the changes
+        :rtype: TandemReport
+
+        """
+        report = TandemReport()
+        current, emails = self.current()
+        report.calls += 1
+        grants, revokes = self.diff(desired, current, emails, report)
+        report.grants = grants
+        report.revokes = revokes
+        if dry_run:
+            return report
+        changes = [('grant',) + g for g in sorted(grants)] + \
+            [('revoke',) + r for r in sorted(revokes)]
+        if not changes:
+            return report
+        for r in self._module.bulk(self._apply, changes, self._max_workers):
+            report.calls += 1
+            if r.error is not None:
+                report.errors.append((r.item, str(getattr(r.error, 'value', r.error))))
+            elif not isinstance(r.result, dict) or r.result.get('success') is False:
+                error = r.result.get('error') if isinstance(r.result, dict) else None
+                report.errors.append((r.item, error or 'Unexpected response'))
+        return report
+
+    def _apply(self, change):
+        # the blocking commands, also on the Async modules
+        action, user_id, server_id = change
+        if action == 'grant':
+            return self._module._command('tandem_add_user_permission')(user_id, server_id)
+        return self._module._command('tandem_delete_user_permission')(user_id, server_id)
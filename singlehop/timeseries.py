@@ -0,0 +1,337 @@
+"""
+Fixed-size time series of fleet samples
+
+Samples are kept in ring buffers of ``array('d')`` (16 bytes per sample),
+one per server and metric, so memory stays bounded however long the
+collector runs.  Timestamps within a buffer only increase, so window
+queries are binary searches rather than scans.  Query results are
+arrays too, so ``numpy.frombuffer(values)`` views them without copying.
+
+"""
+from array import array
+from common import SingleHopError
+import threading
+import time
+
+# metric -> (module method, field of the result data, server type or None
+# for every server)
+METRICS = {
+    'cpu': ('cascade_get_cpu_usage', 'usage', 'vm'),
+    'bandwidth': ('get_server_bandwidth', 'total', None),
+}
+
+def _mean(values):
+    return sum(values) / len(values)
+
+AGGREGATES = {
+    'mean': _mean,
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'last': lambda values: values[-1],
+}
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer of (timestamp, value) samples
+
+    Once full, each new sample overwrites the oldest one.
+
+    :keyword size: Number of samples kept
+
+    """
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self._size = size
+        self._times = array('d', [0.0]) * size
+        self._values = array('d', [0.0]) * size
+        self._start = 0
+        self._count = 0
+
+    @property # getter for _size
+    def size(self):
+        return self._size
+
+    def append(self, timestamp, value):
+        """
+        Adds a sample ; samples older than the newest one are ignored
+
+        """
+        if self._count and timestamp < self._times[self._index(self._count - 1)]:
+            return False
+        if self._count < self._size:
+            i = self._index(self._count)
+            self._count += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self._size
+        self._times[i] = timestamp
+        self._values[i] = value
+        return True
+
+    def _index(self, n):
+        return (self._start + n) % self._size
+
+    def _bisect(self, timestamp):
+        # first logical position with a time >= timestamp
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._times[self._index(mid)] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _slice(self, data, first, last):
+        a = self._index(first)
+        b = a + (last - first)
+        if b <= self._size:
+            return data[a:b]
+        return data[a:] + data[:b - self._size]
+
+    def window(self, start=None, end=None):
+        """
+        Returns the samples with start <= time < end
+
+        :keyword start: (optional) First timestamp (defaults to the oldest)
+        :keyword end: (optional) Timestamp to stop before (defaults to
+            after the newest)
+        :rtype: Tuple of (times, values) arrays
+
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self._count if end is None else self._bisect(end)
+        last = max(first, last)
+        return self._slice(self._times, first, last), self._slice(self._values, first, last)
+
+    def downsample(self, step, start=None, end=None, how='mean'):
+        """
+        Aggregates the samples in a window into buckets of step seconds
+
+        Buckets are aligned to multiples of step since the epoch (i.e. whole
+        hours for 3600) ; buckets without samples are left out.
+
+        :keyword step: Bucket width in seconds
+        :keyword how: Aggregate per bucket (mean, min, max, sum or last)
+        :rtype: List of (bucket start, value) tuples
+
+        """
+        aggregate = AGGREGATES.get(how)
+        if aggregate is None:
+            raise ValueError('Unknown aggregate: %s' % how)
+        times, values = self.window(start, end)
+        if not times:
+            return []
+        buckets = []
+        bucket = None
+        for t, v in zip(times, values):
+            n = t // step
+            if n != bucket:
+                if bucket is not None:
+                    buckets.append((bucket * step, aggregate(group)))
+                bucket = n
+                group = []
+            group.append(v)
+        buckets.append((bucket * step, aggregate(group)))
+        return buckets
+
+    def last(self):
+        """
+        Returns the newest (timestamp, value) sample or None
+
+        """
+        if not self._count:
+            return None
+        i = self._index(self._count - 1)
+        return self._times[i], self._values[i]
+
+    def __len__(self):
+        return self._count
+
+class Collector(object):
+    """
+    Samples CPU usage and bandwidth across the fleet into ring buffers
+
+    Each sweep lists the servers (or uses the given ids) and runs the
+    metric commands concurrently with SingleHopModule.bulk.  CPU usage is
+    sampled for Cascade VMs only.
+
+        >>> collector = Collector(ServerModule(), interval=300, size=2016)
+        >>> collector.start()
+        >>> collector.downsample('123456', 'cpu', 86400, 3600, how='max')
+
+    :keyword module: ServerModule to sample with
+    :keyword metrics: Names of metrics to collect (see METRICS)
+    :keyword size: Samples kept per server and metric
+    :keyword interval: Seconds between sweeps when started
+    :keyword server_ids: (optional) Servers to sample instead of the
+        whole fleet
+    :keyword max_workers: Concurrent requests per sweep (defaults to the
+        connection pool size)
+
+    """
+    def __init__(self, module, metrics=None, size=2016, interval=300.0, \
+        server_ids=None, max_workers=None):
+        self._module = module
+        self._metrics = tuple(metrics or sorted(METRICS))
+        for metric in self._metrics:
+            if metric not in METRICS:
+                raise SingleHopError('Unknown metric: %s' % metric)
+        self._size = size
+        self._interval = interval
+        self._server_ids = server_ids
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._series = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.sweeps = 0
+        self.errors = 0
+
+    @property # getter for _metrics
+    def metrics(self):
+        return self._metrics
+    @property # getter for _size
+    def size(self):
+        return self._size
+    @property # getter for _interval
+    def interval(self):
+        return self._interval
+
+    def _targets(self):
+        # metric -> list of server ids to sample
+        if self._server_ids is not None:
+            servers = [{'server_id': str(i), 'type': None} for i in self._server_ids]
+        else:
+            resp = self._module.list_servers()
+            servers = resp.get('servers') if isinstance(resp, dict) else None
+            if servers is None:
+                raise SingleHopError('Unable to list servers')
+        targets = {}
+        for metric in self._metrics:
+            server_type = METRICS[metric][2]
+            targets[metric] = [s['server_id'] for s in servers
+                if not server_type or s.get('type') in (server_type, None)]
+        return targets
+
+    def sample(self, timestamp=None):
+        """
+        Runs one sweep
+
+        :keyword timestamp: (optional) Time to record the samples at
+        :rtype: Number of samples stored
+
+        """
+        stored = 0
+        for metric, server_ids in sorted(self._targets().items()):
+            method, field = METRICS[metric][:2]
+            for r in self._module.bulk(method, server_ids, self._max_workers):
+                value = None
+                if r.error is None and isinstance(r.result, dict) and \
+                    isinstance(r.result.get('data'), dict):
+                    value = r.result['data'].get(field)
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    self.errors += 1
+                    continue
+                self.add(r.item, metric, value, timestamp)
+                stored += 1
+        self.sweeps += 1
+        return stored
+
+    def add(self, server_id, metric, value, timestamp=None):
+        """
+        Stores a sample
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        key = (str(server_id), metric)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RingBuffer(self._size)
+            series.append(timestamp, value)
+
+    def series(self, server_id, metric):
+        """
+        Returns the RingBuffer for a server and metric (or None)
+
+        """
+        return self._series.get((str(server_id), metric))
+
+    def window(self, server_id, metric, seconds, now=None):
+        """
+        Returns the samples of the last seconds (i.e. 3600 for the last hour)
+
+        :rtype: Tuple of (times, values) arrays
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            series = self.series(server_id, metric)
+            if series is None:
+                return array('d'), array('d')
+            return series.window(now - seconds, None)
+
+    def downsample(self, server_id, metric, seconds, step, how='mean', now=None):
+        """
+        Aggregates the samples of the last seconds into buckets of step
+        seconds (i.e. hourly maxima over the last day)
+
+        :rtype: List of (bucket start, value) tuples
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            series = self.series(server_id, metric)
+            if series is None:
+                return []
+            return series.downsample(step, now - seconds, None, how)
+
+    def server_ids(self, metric=None):
+        """
+        Returns the ids of servers with samples
+
+        """
+        with self._lock:
+            return sorted(set(k[0] for k in self._series if metric in (None, k[1])))
+
+    def start(self):
+        """
+        Starts sweeping every interval seconds in a background thread
+
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='singlehop-collector')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.sample(started)
+            except Exception:
+                # a failed sweep is retried on the next interval
+                self.errors += 1
+            self._stop.wait(max(0, self._interval - (time.time() - started)))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
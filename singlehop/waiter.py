@@ -0,0 +1,255 @@
+from aio import LeapFuture
+from common import SingleHopError
+import threading
+import time
+
+class Waiter(object):
+    """
+    Waits for many servers and VMs to reach a status from one thread
+
+    Each target is polled with its own backoff: the delay starts at
+    interval and grows by backoff after every poll that did not match, up
+    to max_interval.  Targets that come due together are polled in one
+    round, and several waits on the same server share its poll.  When
+    list_servers reports status, a single listing answers for every
+    pending target ; otherwise get_server_details is called per server.
+
+        >>> waiter = Waiter(sm)
+        >>> for vm_id in vm_ids:
+        ...     sm.cascade_reboot_vm(vm_id)
+        >>> futures = [waiter.wait(vm_id, 'running') for vm_id in vm_ids]
+        >>> [f.result() for f in futures]
+
+    :keyword module: ServerModule to poll with
+    :keyword interval: Seconds before a target is first polled
+    :keyword max_interval: Maximum seconds between polls of a target
+    :keyword backoff: Factor the delay grows by after each poll
+    :keyword timeout: Default seconds to wait before failing
+    :keyword max_workers: Concurrent get_server_details calls per round
+        (defaults to the connection pool size)
+
+    """
+    def __init__(self, module, interval=1.0, max_interval=30.0, backoff=1.5, \
+        timeout=600.0, max_workers=None):
+        self._module = module
+        self._interval = interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._timeout = timeout
+        self._max_workers = max_workers
+        self._cond = threading.Condition()
+        self._targets = {}
+        self._thread = None
+        self._closed = False
+        # cleared once a listing shows it does not carry status
+        self._listing = True
+        self.polls = 0
+
+    @property # getter for _interval
+    def interval(self):
+        return self._interval
+    @property # getter for _max_interval
+    def max_interval(self):
+        return self._max_interval
+    @property # getter for _timeout
+    def timeout(self):
+        return self._timeout
+
+    def wait(self, server_id=None, status='running', timeout=None, callback=None):
+        """
+        Waits in the background for a server or VM to reach a status
+
+        :keyword server_id: ID of server or VM
+        :keyword status: Status, or tuple of statuses, to wait for
+        :keyword timeout: (optional) Seconds before the future fails with
+            SingleHopError
+        :keyword callback: (optional) Called with the future once it is done
+        :rtype: LeapFuture resolving to the status reached
+
+        """
+        if not server_id:
+            raise SingleHopError('You must specify a server_id')
+        if not isinstance(status, (tuple, list, set, frozenset)):
+            status = (status,)
+        future = LeapFuture()
+        if callback is not None:
+            future.add_done_callback(callback)
+        now = time.time()
+        target = _Target(str(server_id), frozenset(status), future,
+            now + (timeout or self._timeout), self._interval)
+        with self._cond:
+            if self._closed:
+                raise SingleHopError('Waiter is closed')
+            self._targets.setdefault(target.server_id, []).append(target)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='singlehop-waiter')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """
+        Stops the scheduler and cancels pending waits
+
+        """
+        with self._cond:
+            self._closed = True
+            targets = [t for ts in self._targets.values() for t in ts]
+            self._targets.clear()
+            self._cond.notify()
+        for target in targets:
+            target.future.cancel()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(ts) for ts in self._targets.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due, expired = self._due()
+                if not due and not expired:
+                    if self._closed:
+                        return
+                    self._cond.wait(self._sleep())
+                    continue
+            self._resolve(expired)
+            if not due:
+                continue
+            try:
+                statuses = self._poll(due)
+            except Exception:
+                # keep waiting ; targets time out if polling keeps failing
+                statuses = {}
+            self._update(due, statuses)
+
+    def _due(self):
+        # drop cancelled waits, time out expired ones and collect servers to
+        # poll, including those coming due shortly so they share the round
+        if self._closed:
+            return [], []
+        now = time.time()
+        horizon = now + self._interval / 2.0
+        due = []
+        expired = []
+        for server_id, targets in list(self._targets.items()):
+            for target in list(targets):
+                if target.future.done():
+                    targets.remove(target)
+                elif now >= target.deadline:
+                    targets.remove(target)
+                    expired.append((target, None, target.timeout_error()))
+            if not targets:
+                del self._targets[server_id]
+            elif any(t.next_poll <= horizon and t.next_poll < t.deadline for t in targets):
+                # a poll capped at the deadline is the timeout itself
+                due.append(server_id)
+        return due, expired
+
+    def _sleep(self):
+        if not self._targets:
+            return None
+        now = time.time()
+        return max(min(t.deadline - now if t.next_poll >= t.deadline else
+            t.next_poll - now - self._interval / 2.0
+            for ts in self._targets.values() for t in ts), 0.001)
+
+    def _poll(self, server_ids):
+        """
+        Returns a dict of server id to status
+
+        """
+        # a listing also answers for targets that are not due yet
+        if self._listing and len(self._targets) > 1:
+            statuses = self._poll_listing()
+            if statuses is not None:
+                return statuses
+        return self._poll_details(server_ids)
+
+    def _poll_listing(self):
+        cache = self._module.cache
+        if cache is not None:
+            cache.invalidate(self._module.module, 'listServers',
+                account=self._module.client_id)
+        self.polls += 1
+        resp = self._module.list_servers()
+        servers = resp.get('servers') if isinstance(resp, dict) else None
+        if not servers:
+            return None
+        statuses = dict((s['server_id'], s.get('status')) for s in servers
+            if s.get('status') is not None)
+        if not statuses:
+            self._listing = False
+            return None
+        return statuses
+
+    def _poll_details(self, server_ids):
+        cache = self._module.cache
+        if cache is not None:
+            for server_id in server_ids:
+                cache.invalidate(self._module.module, 'getServerDetails', 'serverid',
+                    server_id, self._module.client_id)
+        statuses = {}
+        for r in self._module.bulk('get_server_details', server_ids, self._max_workers):
+            self.polls += 1
+            if r.error is None and isinstance(r.result, dict) and \
+                isinstance(r.result.get('data'), dict):
+                statuses[r.item] = r.result['data'].get('status')
+        return statuses
+
+    def _update(self, due, statuses):
+        now = time.time()
+        due = set(due)
+        done = []
+        with self._cond:
+            for server_id, targets in self._targets.items():
+                status = statuses.get(server_id)
+                for target in list(targets):
+                    if server_id in statuses:
+                        target.status = status
+                    if status in target.statuses:
+                        done.append((target, status, None))
+                    elif now >= target.deadline:
+                        done.append((target, None, target.timeout_error()))
+                    elif server_id not in due:
+                        # answered by a listing before its turn ; keep its schedule
+                        continue
+                    else:
+                        target.interval = min(target.interval * self._backoff,
+                            self._max_interval)
+                        target.next_poll = min(now + target.interval, target.deadline)
+                        continue
+                    targets.remove(target)
+        self._resolve(done)
+
+    def _resolve(self, done):
+        # called outside the lock as callbacks run in this thread
+        for target, status, error in done:
+            if target.future.set_running_or_notify_cancel():
+                if error is None:
+                    target.future.set_result(status)
+                else:
+                    target.future.set_exception(error)
+
+class _Target(object):
+    def __init__(self, server_id, statuses, future, deadline, interval):
+        self.server_id = server_id
+        self.statuses = statuses
+        self.future = future
+        self.deadline = deadline
+        self.interval = interval
+        self.next_poll = min(time.time() + interval, deadline)
+        self.status = None
+
+    def timeout_error(self):
+        return SingleHopError('Timed out waiting for %s to be %s (last status: %s)' % (
+            self.server_id, ' or '.join(sorted(self.statuses)), self.status))
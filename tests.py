@@ -1,12 +1,161 @@
 import unittest
 from random import Random
 import string
-from singlehop.common import SingleHopError, SingleHopModule
+from singlehop.common import SingleHopError, SingleHopModule, ConnectionPool, \
+    SingleFlight
 from singlehop import settings
 from singlehop.leap import AccountModule, ServerModule
+from singlehop.cache import ResponseCache, SqliteCache
+from singlehop.standin import StandInServer
+from singlehop.metrics import Metrics, StatsdSink
+from singlehop.hedge import HedgePolicy
+from singlehop.ratelimit import RateLimiter, FileStore
+import os
+import tempfile
+from singlehop.commands import ACCOUNT_COMMANDS, SERVER_COMMANDS, \
+    READ_ONLY_COMMANDS
+from singlehop.stream import iter_array, StreamError
+from singlehop.records import Server, Vm, Snapshot, IpAllocation, AvailableServer
+from singlehop.inventory import FleetInventory
+from singlehop.cli import main as cli_main
+from singlehop.waiter import Waiter
+from singlehop.timeseries import RingBuffer, Collector
+from singlehop import analytics
+from singlehop.placement import PlacementEngine
+from singlehop.rdns import RdnsReconciler
+from singlehop.tandem import TandemSync
+from singlehop.feed import ChangeFeed
+from singlehop.accounts import AccountPool
+from singlehop.aio import AsyncAccountModule, AsyncServerModule, LeapFuture
+import threading
+import socket
+import requests
+import time
+import json
+import subprocess
+import sys
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 class TestSingleHopModule(unittest.TestCase):
-    pass
+    def test_default_pool(self):
+        mod = SingleHopModule(module='account')
+        self.assertTrue(isinstance(mod.pool, ConnectionPool))
+        self.assertEqual(mod.pool.pool_size, settings.POOL_SIZE)
+        mod.close()
+
+    def test_shared_pool(self):
+        with ConnectionPool(pool_size=4, idle_timeout=5.0) as pool:
+            am = AccountModule(pool=pool)
+            sm = ServerModule(pool=pool)
+            self.assertTrue(am.pool is sm.pool)
+            self.assertEqual(am.pool.pool_size, 4)
+            # closing a module must not close a pool it does not own
+            pool._acquire()
+            pool._release()
+            am.close()
+            self.assertNotEqual(pool._session, None)
+        self.assertEqual(pool._session, None)
+
+    def test_bulk(self):
+        sm = ServerModule()
+        results = list(sm.bulk('get_server_ips', [None, ''], max_workers=2))
+        self.assertEqual([r.item for r in results], [None, ''])
+        for r in results:
+            self.assertEqual(r.result, None)
+            self.assertTrue(isinstance(r.error, SingleHopError))
+        unordered = list(sm.bulk('get_server_ips', [None, ''], ordered=False))
+        self.assertEqual(len(unordered), 2)
+        self.assertRaises(SingleHopError, sm.bulk, 'no_such_command', [1])
+        self.assertRaises(SingleHopError, sm.bulk, '_bulk', [1])
+
+class TestSingleFlight(unittest.TestCase):
+    def test_coalesce(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'resp'
+        leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+            for i in range(5)]
+        for t in followers:
+            t.start()
+        # give the followers time to block on the in-flight call
+        time.sleep(0.2)
+        release.set()
+        for t in [leader] + followers:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['resp'] * 6)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_error(self):
+        flight = SingleFlight()
+        def fail():
+            raise SingleHopError('boom')
+        self.assertRaises(SingleHopError, flight.do, 'k', fail)
+        self.assertEqual(flight.do('k', lambda: 1), 1)
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(ttls={'listServers': 60, 'getServerDetails': 60},
+            max_size=2)
+
+    def test_hit_miss(self):
+        self.assertEqual(self.cache.get('server', 'listServers'), None)
+        self.cache.set('server', 'listServers', None, 'resp')
+        self.assertEqual(self.cache.get('server', 'listServers'), 'resp')
+        self.assertEqual(self.cache.get('account', 'listServers'), None)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_not_cacheable(self):
+        self.cache.set('server', 'rebootServer', {'serverid': 1}, 'resp')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_ttl(self):
+        cache = ResponseCache(ttls={'listServers': -1})
+        cache.set('server', 'listServers', None, 'resp')
+        self.assertEqual(cache.get('server', 'listServers'), None)
+
+    def test_lru(self):
+        self.cache.set('server', 'getServerDetails', {'serverid': 1}, 'a')
+        self.cache.set('server', 'getServerDetails', {'serverid': 2}, 'b')
+        self.cache.get('server', 'getServerDetails', {'serverid': 1})
+        self.cache.set('server', 'listServers', None, 'c')
+        self.assertEqual(self.cache.get('server', 'getServerDetails', {'serverid': 2}), None)
+        self.assertEqual(self.cache.get('server', 'getServerDetails', {'serverid': 1}), 'a')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidation(self):
+        self.cache.set('server', 'listServers', None, 'a')
+        self.cache.invalidate_for('server', 'cascadeCreateVm', {'serverid': 1})
+        self.assertEqual(self.cache.get('server', 'listServers'), None)
+        self.cache.set('server', 'getServerDetails', {'serverid': 1}, 'a')
+        self.cache.set('server', 'getServerDetails', {'serverid': 2}, 'b')
+        self.cache.invalidate_for('server', 'reinstallServer', {'serverid': 1, 'osid': 3})
+        self.assertEqual(self.cache.get('server', 'getServerDetails', {'serverid': 1}), None)
+        self.assertEqual(self.cache.get('server', 'getServerDetails', {'serverid': 2}), 'b')
+
+    def test_accounts(self):
+        self.cache.set('server', 'listServers', None, 'a', '1001')
+        self.assertEqual(self.cache.get('server', 'listServers', None, '1001'), 'a')
+        self.assertEqual(self.cache.get('server', 'listServers', None, '1002'), None)
+        self.cache.set('server', 'listServers', None, 'b', '1002')
+        self.cache.invalidate_for('server', 'cascadeEditVm', {'vmid': 1}, '1002')
+        self.assertEqual(self.cache.get('server', 'listServers', None, '1001'), 'a')
+        self.assertEqual(self.cache.get('server', 'listServers', None, '1002'), None)
 
 class TestAccountModule(unittest.TestCase):
     def setUp(self):
@@ -209,5 +358,904 @@ class TestServerModule(unittest.TestCase):
         self.assertNotEqual(resp, None)
         self.assertTrue(isinstance(resp, list))
 
+class TestAsyncModules(unittest.TestCase):
+    def setUp(self):
+        self.srvm = AsyncServerModule(max_workers=1)
+
+    def tearDown(self):
+        self.srvm.close()
+
+    def test_init(self):
+        self.assertEqual(self.srvm.module, 'server')
+        self.assertEqual(AsyncAccountModule().module, 'account')
+
+    def test_returns_future(self):
+        fut = self.srvm.get_server_ips()
+        self.assertTrue(isinstance(fut, LeapFuture))
+        self.assertRaises(SingleHopError, fut.result)
+
+    def test_cancel_pending(self):
+        event = threading.Event()
+        blocker = self.srvm.submit(event.wait)
+        pending = self.srvm.get_server_ips('123456')
+        self.assertTrue(pending.cancel())
+        event.set()
+        blocker.result()
+        self.assertTrue(pending.cancelled())
+
+    def test_bulk(self):
+        results = list(self.srvm.bulk('get_server_ips', [None]))
+        self.assertTrue(isinstance(results[0].error, SingleHopError))
+
+class StandInTestCase(unittest.TestCase):
+    """
+    Runs modules against a local LEAP stand-in instead of the live API
+
+    """
+    fleet_size = 20
+
+    def setUp(self):
+        self.server = StandInServer(fleet_size=self.fleet_size, seed=1).start()
+        self.standin = self.server.standin
+
+    def tearDown(self):
+        self.server.stop()
+
+    def module(self, cls, **kwargs):
+        kwargs.setdefault('endpoint_url', self.server.endpoint_url)
+        return cls(api_key='key', client_id='1', password='pw', **kwargs)
+
+class TestStandIn(StandInTestCase):
+    def test_server_commands(self):
+        sm = self.module(ServerModule)
+        srvs = sm.list_servers()['servers']
+        self.assertEqual(len(srvs), self.fleet_size)
+        vm = [s for s in srvs if s['type'] == 'vm'][0]
+        node = [s for s in srvs if s['type'] == 'vmnode'][0]
+        self.assertTrue(sm.get_server_ips(vm['server_id'])['success'])
+        self.assertTrue(sm.get_server_bandwidth(vm['server_id'])['success'])
+        self.assertTrue(sm.cascade_get_cpu_usage(vm['server_id'])['success'])
+        props = sm.cascade_get_node_properties(node['server_id'])['data']
+        self.assertTrue(props['freeram'] < props['ram'])
+        self.assertTrue(isinstance(sm.cascade_list_snapshots(), list))
+        self.assertTrue(isinstance(sm.list_available_servers(), list))
+        resp = sm.cascade_create_vm(node['server_id'], 'new.example.com', '4',
+            1024, 1024, 10, 1, 30, 'local')
+        self.assertTrue(resp['success'])
+        self.assertEqual(len(sm.list_servers()['servers']), self.fleet_size + 1)
+        self.assertTrue(sm.cascade_delete_vm(resp['vmid'])['success'])
+
+    def test_account_commands(self):
+        am = self.module(AccountModule)
+        self.assertTrue(am.get_account_details()['success'])
+        resp = am.tandem_add_user('Test User', 'user@example.com', 'pw')
+        self.assertTrue(am.tandem_add_user_permission(resp['userid'], '000001')['success'])
+        users = am.tandem_list()['data']
+        self.assertEqual(users[0]['servers'], ['000001'])
+
+    def test_errors(self):
+        self.standin.error_rate = 1.0
+        resp = self.module(ServerModule).list_servers()
+        self.assertFalse(resp['success'])
+        self.assertEqual(self.standin.commands['listServers'], 1)
+
+class TestCommands(StandInTestCase):
+    def test_generated(self):
+        for cls, commands in ((AccountModule, ACCOUNT_COMMANDS), (ServerModule, SERVER_COMMANDS)):
+            for command in commands:
+                method = getattr(cls, command.name)
+                self.assertTrue(method.command is command)
+                self.assertTrue(command.doc.strip().split('\n')[0] in method.__doc__)
+        self.assertTrue('listServers' in READ_ONLY_COMMANDS)
+        self.assertFalse('cascadeCreateVm' in READ_ONLY_COMMANDS)
+
+    def test_validation(self):
+        sm = self.module(ServerModule)
+        self.assertRaises(SingleHopError, sm.reinstall_server, '000001')
+        self.assertRaises(SingleHopError, sm.cancellation_request, ['000001'], None, 'x')
+        resp = sm.cancellation_request(['000001'], False, 'Client Cancelled')
+        self.assertTrue(resp['success'])
+
+    def test_messages(self):
+        # messages raised by the hand-written methods the registry replaced
+        # (update_rdns named a server_id it never took)
+        user = 'You must specify a user_id'
+        server = 'You must specify a server_id'
+        vm = 'You must specify a vm_id'
+        baseline = {
+            'tandem_add_user': 'You must specify a name, email, and password',
+            'tandem_delete_user': user,
+            'tandem_add_user_permission': user + ' and server_id',
+            'tandem_delete_user_permission': user + ' and server_id',
+            'get_server_details': server, 'get_server_ips': server,
+            'get_server_bandwidth': server, 'get_rdns_list': server,
+            'update_rdns': 'You must specify entries',
+            'reboot_server': server, 'get_os_list': server,
+            'reinstall_server': server + ' and os_id',
+            'cancellation_request': server + ', happy, and reason',
+            'cascade_get_cpu_usage': server, 'cascade_get_node_properties': server,
+            'cascade_edit_vm': vm, 'cascade_move_vm': vm + ' and server_id',
+            'cascade_create_vm': server + ', hostname, os, ram, storage, cpu, '
+                'vcpu, ips, and imgstore',
+            'cascade_snapshot_vm': vm, 'cascade_delete_vm': vm,
+            'cascade_reboot_vm': vm, 'cascade_shutdown_vm': vm,
+            'cascade_start_vm': vm,
+        }
+        for command in ACCOUNT_COMMANDS + SERVER_COMMANDS:
+            self.assertEqual(command.error, baseline.get(command.name))
+        sm = self.module(ServerModule)
+        try:
+            sm.update_rdns()
+            self.fail('expected SingleHopError')
+        except SingleHopError as e:
+            self.assertEqual(str(e.value), 'You must specify entries')
+
+    def test_update_rdns(self):
+        sm = self.module(ServerModule)
+        ip = sorted(sm.get_rdns_list('000002')['data'])[0]
+        self.assertTrue(sm.update_rdns({ip: 'mail.example.com'})['success'])
+        self.assertEqual(sm.get_rdns_list('000002')['data'][ip], 'mail.example.com')
+
+    def test_non_json(self):
+        metrics = Metrics()
+        sm = self.module(ServerModule, metrics=metrics,
+            endpoint_url=self.server.endpoint_url.replace('?request=', '?missing='))
+        resp = sm.list_servers()
+        self.assertTrue('data' in resp)
+        self.assertEqual(metrics.snapshot()[('server', 'listServers')]['decode_errors'], 1)
+
+class TestStream(StandInTestCase):
+    def test_iter_array(self):
+        body = b'{"success": true, "count": 12, "servers": [{"server_id": "1"}, ' \
+            b'{"server_id": "2", "server": "h\\u00e9"}], "tail": [1, 2]}'
+        for size in (1, 3, 1000):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            extra = {}
+            items = list(iter_array(chunks, 'servers', extra))
+            self.assertEqual([i['server_id'] for i in items], ['1', '2'])
+            self.assertEqual(extra, {'success': True, 'count': 12, 'tail': [1, 2]})
+        self.assertEqual(list(iter_array([b'{"servers": []}'], 'servers')), [])
+        self.assertRaises(StreamError, list, iter_array([b'{"servers": [{"a"'], 'servers'))
+        self.assertRaises(StreamError, list, iter_array([b'<html>'], 'servers'))
+
+    def test_iter_servers(self):
+        sm = self.module(ServerModule)
+        servers = list(sm.iter_servers(chunk_size=7))
+        self.assertEqual(servers, sm.list_servers()['servers'])
+        self.standin.error_rate = 1.0
+        self.assertRaises(SingleHopError, list, sm.iter_servers())
+
+class TestRecords(StandInTestCase):
+    def test_snapshot(self):
+        snap = Snapshot.from_dict({'name': 'CentOS 5.6 32Bit', 'arch': 'i386', 'price': 0,
+            'cpanel': '0', 'os': 'centos', 'id': '68', 'extra': 'x'})
+        self.assertEqual(snap.id, 68)
+        self.assertEqual(snap['cpanel'], False)
+        self.assertEqual(snap['extra'], 'x')
+        self.assertEqual(snap.get('missing', 1), 1)
+        self.assertTrue('name' in snap)
+        self.assertFalse(hasattr(snap, '__dict__'))
+
+    def test_available_server(self):
+        srv = AvailableServer.from_dict({'price': '249', 'maxdrives': '2', 'ram': '6GB'})
+        self.assertEqual(srv['price'], 249)
+        self.assertEqual(srv.to_dict(), {'price': 249, 'maxdrives': 2, 'ram': '6GB'})
+
+    def test_empty_fields(self):
+        data = {'name': 'Custom', 'price': '', 'cpanel': '', 'os': None, 'id': '7'}
+        snap = Snapshot.from_dict(data)
+        self.assertEqual((snap['price'], snap['cpanel'], snap['os']), ('', '', None))
+        self.assertEqual(sorted(snap.keys()), sorted(data))
+        self.assertEqual(snap, dict(data, id=7))
+        self.assertRaises(KeyError, lambda: snap['arch'])
+
+    def test_ip_allocation(self):
+        ip = IpAllocation.from_dict({'ip': '10.0.0.1', 'netmask': '255.255.255.0'})
+        self.assertEqual(ip.ip, 167772161)
+        self.assertEqual(ip['ip'], '10.0.0.1')
+        self.assertEqual(ip['netmask'], '255.255.255.0')
+
+    def test_module(self):
+        plain = self.module(ServerModule).list_servers()['servers']
+        sm = self.module(ServerModule, records=True)
+        servers = sm.list_servers()['servers']
+        self.assertEqual(servers, plain)
+        self.assertTrue(isinstance(servers[0], Server))
+        self.assertTrue(isinstance(servers[1], Vm))
+        self.assertEqual(servers[1]['parent_id'], servers[0]['server_id'])
+        self.assertTrue(isinstance(list(sm.iter_servers())[1], Vm))
+        ips = sm.get_server_ips(servers[1].server_id)['data']
+        self.assertTrue(isinstance(ips[0], IpAllocation))
+        self.assertTrue(isinstance(sm.cascade_list_snapshots()[0], Snapshot))
+        self.assertFalse(sm.get_server_ips('999999')['success'])
+
+class TestFleetInventory(StandInTestCase):
+    def test_refresh(self):
+        sm = self.module(ServerModule)
+        self.assertRaises(SingleHopError, FleetInventory().refresh)
+        inv = FleetInventory(sm)
+        added, removed, changed = inv.refresh()
+        self.assertEqual(len(added), self.fleet_size)
+        self.assertEqual(len(inv), self.fleet_size)
+        node = inv.of_type('vmnode')[0]
+        vms = inv.children(node['server_id'])
+        self.assertEqual(len(vms), 9)
+        self.assertEqual(inv.parent(vms[0]['server_id']), node)
+        self.assertEqual(inv.by_hostname(vms[0]['server'])['server_id'], vms[0]['server_id'])
+        # an unchanged fleet touches nothing
+        self.assertEqual(inv.refresh(), (set(), set(), set()))
+        sm.cascade_edit_vm(vms[0]['server_id'], hostname='renamed.example.com')
+        sm.cascade_delete_vm(vms[1]['server_id'])
+        added, removed, changed = inv.refresh()
+        self.assertEqual(removed, set([vms[1]['server_id']]))
+        self.assertEqual(changed, set([vms[0]['server_id']]))
+        self.assertEqual(inv.by_hostname(vms[0]['server']), None)
+        self.assertEqual(inv.by_hostname('renamed.example.com')['server_id'],
+            vms[0]['server_id'])
+        self.assertEqual(len(inv.children(node['server_id'])), 8)
+
+    def test_records(self):
+        inv = FleetInventory(self.module(ServerModule, records=True))
+        inv.refresh()
+        self.assertEqual(inv.refresh(), (set(), set(), set()))
+        self.assertTrue(isinstance(inv.get('000002'), Vm))
+
+class TestMetrics(StandInTestCase):
+    def test_record(self):
+        lines = []
+        metrics = Metrics(buckets=(0.5, 1.0), sinks=[StatsdSink(lines.append)])
+        sm = self.module(ServerModule, metrics=metrics)
+        sm.list_servers()
+        sm.list_servers()
+        stats = metrics.snapshot()[('server', 'listServers')]
+        self.assertEqual(stats['calls'], 2)
+        self.assertTrue(stats['response_bytes'] > 0)
+        self.assertEqual(stats['decode_errors'], 0)
+        self.assertEqual(sum(c for b, c in stats['latency_buckets']), 2)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('singlehop.server.listServers.calls:1|c'))
+
+    def test_decode_error_and_prometheus(self):
+        metrics = Metrics()
+        metrics.record('server', 'getServerDetails', 0.2, 10)
+        metrics.decode_error('server', 'getServerDetails')
+        metrics.record('server', 'getServerDetails', 120.0, timeout=True)
+        stats = metrics.snapshot()[('server', 'getServerDetails')]
+        self.assertEqual(stats['decode_errors'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        text = metrics.prometheus()
+        self.assertTrue('singlehop_request_duration_seconds_bucket{module="server",'
+            'command="getServerDetails",le="+Inf"} 2' in text)
+        self.assertTrue('singlehop_timeouts_total{module="server",'
+            'command="getServerDetails"} 1' in text)
+
+    def test_failed_requests(self):
+        metrics = Metrics()
+        url = self.server.endpoint_url
+        sm = self.module(ServerModule, metrics=metrics,
+            endpoint_url=url[:url.index('?')] + 'missing/')
+        self.assertTrue('Not found' in sm.list_servers()['data'])
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        sm = self.module(ServerModule, metrics=metrics,
+            endpoint_url='http://127.0.0.1:%d/?request=' % port)
+        self.assertRaises(requests.exceptions.ConnectionError, sm.list_servers)
+        stats = metrics.snapshot()[('server', 'listServers')]
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual(stats['timeouts'], 0)
+
+class TestHedgePolicy(StandInTestCase):
+    def test_straggler(self):
+        hedge = HedgePolicy(initial_delay=0.05)
+        calls = []
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return 'slow'
+            return 'fast'
+        self.assertEqual(hedge.call('listServers', func), 'fast')
+        self.assertEqual(hedge.hedged, 1)
+        self.assertEqual(hedge.hedge_wins, 1)
+        hedge.shutdown()
+
+    def test_delay(self):
+        hedge = HedgePolicy(percentile=50, initial_delay=1.0, min_delay=0.0)
+        self.assertEqual(hedge.delay('listServers'), 1.0)
+        for i in range(hedge.min_samples):
+            hedge.observe('listServers', 0.1 if i % 2 else 0.3)
+        self.assertTrue(0.1 <= hedge.delay('listServers') <= 0.3)
+        hedge.shutdown()
+
+    def test_only_read_only(self):
+        self.server._httpd.latency = 0.1
+        hedge = HedgePolicy(initial_delay=0.02)
+        sm = self.module(ServerModule, hedge=hedge)
+        vm = [s for s in sm.list_servers()['servers'] if s['type'] == 'vm'][0]
+        self.assertEqual(hedge.hedged, 1)
+        sm.cascade_reboot_vm(vm['server_id'])
+        self.assertEqual(hedge.hedged, 1)
+        hedge.shutdown()
+
+    def test_no_free_connection(self):
+        self.server._httpd.latency = 0.1
+        hedge = HedgePolicy(initial_delay=0.02)
+        sm = self.module(ServerModule, hedge=hedge, pool=ConnectionPool(pool_size=1))
+        sm.list_servers()
+        self.assertEqual((hedge.hedged, hedge.skipped), (0, 1))
+        self.assertEqual(self.standin.commands['listServers'], 1)
+        # closing the module releases the threads ; the policy stays usable
+        sm.close()
+        sm = self.module(ServerModule, hedge=hedge)
+        sm.get_server_details('000001')
+        self.assertEqual(hedge.hedged, 1)
+        sm.close()
+
+    def test_shared_policy(self):
+        self.server._httpd.latency = 0.1
+        hedge = HedgePolicy(initial_delay=0.02)
+        first = self.module(ServerModule, hedge=hedge)
+        second = self.module(ServerModule, hedge=hedge)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(first.list_servers()))
+        thread.start()
+        second.close()
+        thread.join()
+        self.assertEqual(len(result[0]['servers']), self.fleet_size)
+        self.assertEqual(hedge.hedged, 1)
+        first.close()
+        # a call racing the shutdown falls back to the unhedged request
+        executor = hedge._get_executor()
+        executor.shutdown()
+        hedge._get_executor = lambda: executor
+        self.assertEqual(hedge.call('listServers', lambda: 'ok'), 'ok')
+
+class TestRateLimiter(StandInTestCase):
+    def test_buckets(self):
+        limiter = RateLimiter({'*': (100, 5), 'server.listServers': (1, 2)})
+        self.assertEqual(limiter.buckets('server', 'listServers'),
+            ['*', 'server.listServers'])
+        self.assertEqual(limiter.buckets('account', 'tandemList'), ['*'])
+        self.assertEqual(limiter.try_acquire('server', 'listServers'), 0)
+        self.assertEqual(limiter.try_acquire('server', 'listServers'), 0)
+        self.assertTrue(limiter.try_acquire('server', 'listServers') > 0)
+        self.assertFalse(limiter.acquire('server', 'listServers', timeout=0.01))
+        self.assertEqual(limiter.try_acquire('server', 'getServerIps'), 0)
+        self.assertRaises(SingleHopError, RateLimiter, {'server': (0, 1)})
+
+    def test_file_store(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            rates = {'server': (1, 3)}
+            first = RateLimiter(rates, store=FileStore(path))
+            second = RateLimiter(rates, store=FileStore(path))
+            for i in range(3):
+                self.assertEqual(first.try_acquire('server', 'listServers'), 0)
+            # budget is shared through the file
+            self.assertTrue(second.try_acquire('server', 'listServers') > 0)
+        finally:
+            os.remove(path)
+
+    def test_file_store_unsupported(self):
+        from singlehop import ratelimit
+        fcntl, ratelimit.fcntl = ratelimit.fcntl, None
+        try:
+            self.assertRaises(SingleHopError, FileStore, '/tmp/unused')
+        finally:
+            ratelimit.fcntl = fcntl
+
+    def test_do_request(self):
+        limiter = RateLimiter({'server': (20, 1)})
+        sm = self.module(ServerModule, rate_limiter=limiter, single_flight=False)
+        start = time.time()
+        for i in range(3):
+            sm.list_servers()
+        self.assertTrue(time.time() - start >= 0.09)
+
+class TestCachedModule(StandInTestCase):
+    def test_accounts(self):
+        cache = ResponseCache()
+        first = self.module(ServerModule, cache=cache)
+        second = ServerModule(api_key='other', client_id='2', password='pw',
+            endpoint_url=self.server.endpoint_url, cache=cache)
+        first.list_servers()
+        second.list_servers()
+        first.list_servers()
+        self.assertEqual(self.standin.commands['listServers'], 2)
+
+    def test_errors_not_cached(self):
+        sm = self.module(ServerModule, cache=ResponseCache())
+        self.standin.error_rate = 1.0
+        sm.cascade_list_snapshots()
+        self.standin.error_rate = 0.0
+        snapshots = sm.cascade_list_snapshots()
+        self.assertTrue(isinstance(snapshots, list))
+        self.assertEqual(sm.cascade_list_snapshots(), snapshots)
+        self.assertEqual(self.standin.commands['cascadeListSnapshots'], 2)
+
+class TestSqliteCache(StandInTestCase):
+    def setUp(self):
+        super(TestSqliteCache, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        super(TestSqliteCache, self).tearDown()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_shared(self):
+        first = self.module(ServerModule, cache=SqliteCache(self.path))
+        servers = first.list_servers()
+        # a second process opening the same database starts warm
+        cache = SqliteCache(self.path)
+        second = self.module(ServerModule, cache=cache)
+        self.assertEqual(second.list_servers(), servers)
+        self.assertEqual(self.standin.commands['listServers'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(len(cache), 1)
+        other = SqliteCache(self.path, namespace='other')
+        self.assertEqual(other.get('server', 'listServers'), None)
+        # another account using the same database does not see the entries
+        third = ServerModule(api_key='other', client_id='2', password='pw',
+            endpoint_url=self.server.endpoint_url, cache=SqliteCache(self.path))
+        third.list_servers()
+        self.assertEqual(self.standin.commands['listServers'], 2)
+        # recent hits do not write
+        changes = cache._db().total_changes
+        second.list_servers()
+        self.assertEqual(cache._db().total_changes, changes)
+
+    def test_invalidation(self):
+        cache = SqliteCache(self.path)
+        sm = self.module(ServerModule, cache=cache)
+        sm.get_server_details('000002')
+        sm.get_server_details('000003')
+        sm.reinstall_server('000002', '1')
+        self.assertEqual(cache.get('server', 'getServerDetails', {'serverid': '000002'},
+            '1'), None)
+        self.assertNotEqual(cache.get('server', 'getServerDetails', {'serverid': '000003'},
+            '1'), None)
+
+    def test_prune(self):
+        cache = SqliteCache(self.path, ttls={'listServers': 60, 'getServerIps': -1},
+            max_size=1)
+        sm = self.module(ServerModule, cache=cache)
+        sm.get_server_ips('000002')
+        sm.list_servers()
+        cache.prune()
+        self.assertEqual(len(cache), 1)
+
+    def test_fork(self):
+        if not hasattr(os, 'fork'):
+            return
+        cache = SqliteCache(self.path)
+        sm = self.module(ServerModule, cache=cache)
+        sm.list_servers()
+        parent = cache._db()
+        pid = os.fork()
+        if pid == 0:
+            # the child opens its own connection to the same database
+            code = 1
+            try:
+                if cache._db() is not parent and \
+                    cache.get('server', 'listServers', account='1') is not None:
+                    cache.invalidate('server', 'listServers', account='1')
+                    code = 0
+            finally:
+                os._exit(code)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(cache._db() is parent)
+        self.assertEqual(len(cache), 0)
+
+class TestCli(StandInTestCase):
+    def run_cli(self, *argv, **kwargs):
+        out = StringIO()
+        argv = ['--api-key', 'key', '--client-id', '1', '--password', 'pw',
+            '--endpoint-url', self.server.endpoint_url] + list(argv)
+        code = cli_main(argv, stdin=StringIO(kwargs.get('stdin', '')), stdout=out)
+        return code, out.getvalue()
+
+    def test_single(self):
+        code, out = self.run_cli('server', 'get-server-ips', '000002')
+        self.assertEqual(code, 0)
+        self.assertTrue(json.loads(out)['success'])
+        code, out = self.run_cli('--format', 'ndjson', 'server', 'list-servers')
+        self.assertEqual(code, 0)
+        self.assertEqual(len(out.splitlines()), self.fleet_size)
+        code, out = self.run_cli('server', 'get-server-ips')
+        self.assertEqual(code, 1)
+
+    def test_batch(self):
+        code, out = self.run_cli('--format', 'ndjson', 'server', 'get-server-bandwidth',
+            '-', stdin='000002\n000003\n\n000004\n')
+        rows = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(code, 0)
+        self.assertEqual([r['item'] for r in rows], ['000002', '000003', '000004'])
+        self.assertEqual(self.standin.commands['getServerBandwidth'], 3)
+        code, out = self.run_cli('server', 'reinstall-server', '000002', '000003',
+            '--os-id', '1')
+        self.assertEqual(code, 0)
+        self.assertEqual(len(json.loads(out)), 2)
+
+    def test_cached(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            first = self.run_cli('--cache', path, 'server', 'get-server-details', '000002')
+            self.assertEqual(first, self.run_cli('--cache', path, 'server',
+                'get-server-details', '000002'))
+            self.assertEqual(self.standin.commands['getServerDetails'], 1)
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_lazy_imports(self):
+        script = ('import sys\n'
+            'from singlehop.cli import main\n'
+            'try:\n'
+            '    main(["--help"])\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'sys.stderr.write(str("requests" in sys.modules))\n')
+        proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        out, err = proc.communicate()
+        self.assertEqual(err.strip(), b'False')
+
+class TestProvision(StandInTestCase):
+    def specs(self, count, **kwargs):
+        specs = []
+        for i in range(count):
+            spec = dict(server_id='000001', hostname='new%d.example.com' % i, os=4,
+                ram=1024, storage=1024, cpu=10, vcpu=1, ips=30, imgstore='local')
+            spec.update(kwargs)
+            specs.append(spec)
+        return specs
+
+    def test_create(self):
+        sm = self.module(ServerModule)
+        results = list(sm.cascade_create_vms(self.specs(12), max_workers=4))
+        self.assertEqual(len(results), 12)
+        self.assertTrue(all(r.error is None and r.result['success'] for r in results))
+        self.assertEqual(len(sm.list_servers()['servers']), self.fleet_size + 12)
+
+    def test_create_async(self):
+        sm = self.module(AsyncServerModule)
+        try:
+            results = list(sm.cascade_create_vms(self.specs(4), max_workers=2))
+        finally:
+            sm.close()
+        self.assertTrue(all(r.error is None and r.result['success'] for r in results))
+        self.assertEqual(self.standin.commands['cascadeCreateVm'], 4)
+
+    def test_validation(self):
+        sm = self.module(ServerModule)
+        specs = self.specs(3)
+        specs[0]['os'] = 99
+        specs[1]['vcpu'] = 32
+        specs[2]['hostname'] = specs[0]['hostname']
+        del specs[2]['imgstore']
+        try:
+            sm.cascade_create_vms(specs)
+            self.fail('expected SingleHopError')
+        except SingleHopError as e:
+            for text in ('os 99', 'vcpu must be', 'missing imgstore', 'also used by spec 0'):
+                self.assertTrue(text in e.value, text)
+        self.assertFalse('cascadeCreateVm' in self.standin.commands)
+
+class TestWaiter(StandInTestCase):
+    def vm_ids(self, sm):
+        return [s['server_id'] for s in sm.list_servers()['servers'] if s['type'] == 'vm']
+
+    def test_details(self):
+        self.standin.transition_time = 0.2
+        sm = self.module(ServerModule)
+        ids = self.vm_ids(sm)[:5]
+        done = []
+        with Waiter(sm, interval=0.05, max_interval=0.1) as waiter:
+            for vm_id in ids:
+                sm.cascade_shutdown_vm(vm_id)
+            futures = [waiter.wait(vm_id, 'stopped', callback=done.append) for vm_id in ids]
+            self.assertEqual([f.result(5) for f in futures], ['stopped'] * 5)
+            self.assertEqual(len(waiter), 0)
+        self.assertEqual(len(done), 5)
+        self.assertEqual(sm.get_server_details(ids[0])['data']['status'], 'stopped')
+
+    def test_listing(self):
+        self.standin.transition_time = 0.2
+        self.standin.list_status = True
+        sm = self.module(ServerModule)
+        ids = self.vm_ids(sm)
+        with Waiter(sm, interval=0.05, max_interval=0.1) as waiter:
+            for vm_id in ids:
+                sm.cascade_reboot_vm(vm_id)
+            futures = [waiter.wait(vm_id) for vm_id in ids]
+            self.assertEqual(set(f.result(5) for f in futures), set(['running']))
+            # one listing per round answers for every VM
+            self.assertTrue(waiter.polls < len(ids))
+        self.assertFalse('getServerDetails' in self.standin.commands)
+
+    def test_timeout(self):
+        sm = self.module(ServerModule)
+        with Waiter(sm, interval=0.05) as waiter:
+            future = waiter.wait(self.vm_ids(sm)[0], 'stopped', timeout=0.2)
+            self.assertRaises(SingleHopError, future.result, 5)
+            pending = waiter.wait(self.vm_ids(sm)[0], 'stopped')
+        self.assertTrue(pending.cancelled())
+
+    def test_timeout_between_polls(self):
+        sm = self.module(ServerModule)
+        vm_ids = self.vm_ids(sm)
+        with Waiter(sm, interval=5.0) as waiter:
+            start = time.time()
+            futures = [waiter.wait(vm_id, 'stopped', timeout=0.3) for vm_id in vm_ids[:2]]
+            for future in futures:
+                self.assertRaises(SingleHopError, future.result, 2)
+            self.assertTrue(time.time() - start < 1.0)
+
+class TestTimeSeries(StandInTestCase):
+    def test_ring_buffer(self):
+        buf = RingBuffer(5)
+        for t in range(8):
+            buf.append(float(t), t * 10.0)
+        self.assertEqual(len(buf), 5)
+        times, values = buf.window()
+        self.assertEqual(list(times), [3.0, 4.0, 5.0, 6.0, 7.0])
+        self.assertEqual(list(buf.window(4.5, 7)[1]), [50.0, 60.0])
+        self.assertFalse(buf.append(1.0, 0))
+        self.assertEqual(buf.downsample(2, how='max'), [(2.0, 30.0), (4.0, 50.0), (6.0, 70.0)])
+        self.assertEqual(buf.downsample(10), [(0.0, 50.0)])
+        self.assertEqual(buf.last(), (7.0, 70.0))
+
+    def test_collector(self):
+        sm = self.module(ServerModule)
+        collector = Collector(sm, size=3)
+        now = 3600.0 * 400000 + 1800
+        for i in range(4):
+            collector.sample(now - 300 * (3 - i))
+        vms = collector.server_ids('cpu')
+        self.assertEqual(len(collector.server_ids('bandwidth')), self.fleet_size)
+        self.assertTrue(0 < len(vms) < self.fleet_size)
+        self.assertEqual(len(collector.series(vms[0], 'cpu')), 3)
+        self.assertEqual(len(collector.window(vms[0], 'bandwidth', 400, now)[0]), 2)
+        self.assertEqual(len(collector.downsample(vms[0], 'cpu', 3600, 3600, now=now)), 1)
+        self.assertEqual(collector.errors, 0)
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class TestAnalytics(StandInTestCase):
+    def test_stats(self):
+        sm = self.module(ServerModule)
+        stats = analytics.FleetStats.load(sm)
+        servers = sm.list_servers()['servers']
+        bandwidth = dict((s['server_id'], sm.get_server_bandwidth(s['server_id'])['data']['total'])
+            for s in servers)
+        self.assertEqual(len(stats), self.fleet_size)
+        self.assertEqual(stats.percentile('bandwidth', 100), max(bandwidth.values()))
+        self.assertEqual(len(stats.percentile('bandwidth', [50, 95])), 2)
+        top = stats.top('bandwidth', 3)
+        self.assertEqual([v for i, v in top], sorted(bandwidth.values(), reverse=True)[:3])
+        vms = [s for s in servers if s['type'] == 'vm']
+        self.assertEqual(len(stats.top('cpu', 100)), len(vms))
+        nodes = stats.by_node('bandwidth')
+        node = vms[0]['parent_id']
+        self.assertEqual(nodes[node], sum(bandwidth[s['server_id']] for s in vms
+            if s['parent_id'] == node))
+        self.assertTrue(stats.by_node('cpu', 'max')[node] <= 100)
+        over = stats.overage(0.25)
+        self.assertTrue(all(p > l for i, p, l in over))
+        self.assertEqual(len(over), len([v for v in bandwidth.values() if v / 0.25 > 5000000]))
+
+class TestPlacement(StandInTestCase):
+    def test_create(self):
+        sm = self.module(ServerModule)
+        engine = PlacementEngine.load(sm)
+        gb = 1024 * 1024 * 1024
+        vms = [dict(hostname='new%d.example.com' % i, os=4, ram=gb, storage=10 * gb, cpu=10,
+            vcpu=2, ips=30, imgstore='local') for i in range(40)]
+        plan = engine.place(vms, commit=True)
+        # each generated node has 14 vcpus free
+        self.assertEqual(len(plan), 14)
+        self.assertEqual(len(plan.unplaced), 26)
+        self.assertEqual(sorted(len(v) for v in plan.by_node().values()), [7, 7])
+        results = list(sm.cascade_create_vms(plan.specs()))
+        self.assertTrue(all(r.result['success'] for r in results))
+        self.assertEqual([engine.free(n)['vcpu'] for n in engine.node_ids], [0, 0])
+        self.assertEqual(len(engine.place(vms[:1]).unplaced), 1)
+
+    def test_moves(self):
+        sm = self.module(ServerModule)
+        engine = PlacementEngine.load(sm)
+        vm = [s for s in sm.list_servers()['servers'] if s['type'] == 'vm'][0]
+        details = sm.get_server_details(vm['server_id'])['data']
+        plan = engine.place([dict(vm_id=vm['server_id'], parent_id=vm['parent_id'],
+            ram=details['ram'], storage=details['storage'], vcpu=details['vcpu'])])
+        (vm_id, node_id), = plan.moves()
+        self.assertNotEqual(node_id, vm['parent_id'])
+        self.assertTrue(sm.cascade_move_vm(vm_id, node_id)['success'])
+
+class TestRdns(StandInTestCase):
+    def test_reconcile(self):
+        sm = self.module(ServerModule)
+        vms = [s['server_id'] for s in sm.list_servers()['servers'] if s['type'] == 'vm'][:4]
+        desired = {}
+        for vm_id in vms:
+            ips = sorted(sm.get_rdns_list(vm_id)['data'])
+            desired[vm_id] = dict((ip, 'host%s.example.com' % ip.replace('.', '-'))
+                for ip in ips)
+        total = sum(len(v) for v in desired.values())
+        reconciler = RdnsReconciler(sm, batch_size=5)
+        report = reconciler.reconcile(desired)
+        self.assertEqual(len(report.changes), total)
+        self.assertEqual(report.writes, (total + 4) // 5)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(sm.get_rdns_list(vms[0])['data'], desired[vms[0]])
+        # converged: only reads
+        before = self.standin.commands['updateRdns']
+        report = reconciler.reconcile(desired)
+        self.assertTrue(report.converged)
+        self.assertEqual((report.reads, report.writes), (4, 0))
+        self.assertEqual(self.standin.commands['updateRdns'], before)
+        report = reconciler.reconcile({vms[0]: {'192.0.2.1': 'x.example.com'}}, dry_run=True)
+        self.assertEqual(report.unknown, {'192.0.2.1': vms[0]})
+
+class TestTandemSync(StandInTestCase):
+    def test_sync(self):
+        am = self.module(AccountModule)
+        alice = am.tandem_add_user('Alice', 'alice@example.com', 'pw')['userid']
+        bob = am.tandem_add_user('Bob', 'bob@example.com', 'pw')['userid']
+        am.tandem_add_user_permission(alice, '000001')
+        am.tandem_add_user_permission(bob, '000002')
+        sync = TandemSync(am, max_workers=4)
+        desired = {alice: ['000002', '000003'], 'BOB@example.com': [], 'nobody': ['000001']}
+        report = sync.sync(desired)
+        self.assertEqual(report.grants, set([(alice, '000002'), (alice, '000003')]))
+        self.assertEqual(report.revokes, set([(alice, '000001'), (bob, '000002')]))
+        self.assertEqual(report.unknown, set(['nobody']))
+        self.assertEqual((report.calls, report.errors), (5, []))
+        users = dict((u['userid'], u['servers']) for u in am.tandem_list()['data'])
+        self.assertEqual(users, {alice: ['000002', '000003'], bob: []})
+        del desired['nobody']
+        report = sync.sync(desired)
+        self.assertTrue(report.converged)
+        self.assertEqual(report.calls, 1)
+
+    def test_sync_async(self):
+        am = self.module(AsyncAccountModule)
+        try:
+            alice = am.tandem_add_user('Alice', 'alice@example.com', 'pw').result()['userid']
+            am.tandem_add_user_permission(alice, '000001').result()
+            report = TandemSync(am, max_workers=2).sync({alice: ['000002']})
+            users = am.tandem_list().result()['data']
+        finally:
+            am.close()
+        self.assertEqual((report.calls, report.errors), (3, []))
+        self.assertEqual(report.grants, set([(alice, '000002')]))
+        self.assertEqual(report.revokes, set([(alice, '000001')]))
+        self.assertEqual(users[0]['servers'], ['000002'])
+
+class TestChangeFeed(StandInTestCase):
+    def test_poll(self):
+        sm = self.module(ServerModule)
+        seen = []
+        feed = ChangeFeed(sm, callback=seen.append)
+        self.assertEqual(len(feed.poll()), self.fleet_size)
+        self.assertEqual(feed.poll(), [])
+        vms = [s for s in sm.list_servers()['servers'] if s['type'] == 'vm']
+        sm.cascade_edit_vm(vms[0]['server_id'], hostname='renamed.example.com')
+        sm.cascade_delete_vm(vms[1]['server_id'])
+        new = sm.cascade_create_vm(vms[0]['parent_id'], 'new.example.com', 4, 1024, 1024,
+            10, 1, 30, 'local')['vmid']
+        events = dict((e.server_id, e) for e in feed.poll())
+        self.assertEqual(sorted((e.kind, i) for i, e in events.items()), sorted([
+            ('modified', vms[0]['server_id']), ('removed', vms[1]['server_id']),
+            ('added', new)]))
+        self.assertEqual(events[vms[0]['server_id']].server['server'], 'renamed.example.com')
+        self.assertEqual(len(seen), self.fleet_size + 3)
+        # a new feed resuming from saved state reports nothing
+        state = json.loads(json.dumps(feed.state))
+        self.assertEqual(ChangeFeed(sm, state=state).poll(), [])
+        self.assertEqual(ChangeFeed(sm, initial=False).poll(), [])
+
+    def test_callback_error(self):
+        sm = self.module(ServerModule)
+        seen = []
+        def callback(event):
+            if len(seen) == 3 and not failed:
+                failed.append(event.server_id)
+                raise ValueError('boom')
+            seen.append(event.server_id)
+        failed = []
+        feed = ChangeFeed(sm, callback=callback)
+        self.assertRaises(ValueError, feed.poll)
+        self.assertEqual(len(seen), self.fleet_size - 1)
+        # the failed delivery is retried ; the others are not repeated
+        events = feed.poll()
+        self.assertEqual([(e.kind, e.server_id) for e in events], [('added', failed[0])])
+        self.assertEqual(sorted(seen), sorted(feed.state))
+
+class TestTransport(StandInTestCase):
+    def test_post(self):
+        self.assertRaises(SingleHopError, self.module, ServerModule, transport='put')
+        sm = self.module(ServerModule, transport='post')
+        self.assertEqual(sm.transport, 'post')
+        servers = sm.list_servers()['servers']
+        self.assertEqual(len(servers), self.fleet_size)
+        vm = [s for s in servers if s['type'] == 'vm'][0]['server_id']
+        ips = sm.get_rdns_list(vm)['data']
+        # long enough for the stand-in to reject the GET request line
+        entries = dict((ip, 'h' * (70000 // len(ips)) + '.example.com') for ip in ips)
+        self.assertFalse('success' in self.module(ServerModule).update_rdns(entries))
+        self.assertTrue(sm.update_rdns(entries)['success'])
+        self.assertEqual(sm.get_rdns_list(vm)['data'], entries)
+
+    def test_compressed_responses(self):
+        sm = self.module(ServerModule, transport='post')
+        expected = sm.list_servers()
+        sent = self.server.bytes_out
+        with StandInServer(fleet_size=self.fleet_size, seed=1, compress=True) as srv:
+            sm = self.module(ServerModule, endpoint_url=srv.endpoint_url, transport='post')
+            self.assertEqual(sm.list_servers(), expected)
+            self.assertTrue(srv.bytes_out < sent / 2)
+            self.assertEqual(list(sm.iter_servers()), expected['servers'])
+
+class TestAccountPool(StandInTestCase):
+    def pool(self, **kwargs):
+        accounts = dict(('acct%d' % i, dict(api_key='key', client_id=str(1000 + i),
+            password='pw')) for i in range(4))
+        return AccountPool(accounts, endpoint_url=self.server.endpoint_url, **kwargs)
+
+    def test_modules(self):
+        self.assertRaises(SingleHopError, AccountPool, {'a': dict(api_key='key')})
+        self.assertRaises(SingleHopError, AccountPool, cache=ResponseCache())
+        with self.pool(rates={'*': (1000, 10)}) as pool:
+            self.assertEqual(pool.names, ['acct0', 'acct1', 'acct2', 'acct3'])
+            sm = pool.server('acct0')
+            self.assertTrue(pool.server('acct0') is sm)
+            self.assertEqual(sm.client_id, '1000')
+            self.assertTrue(pool.account('acct0').pool is sm.pool)
+            self.assertFalse(pool.server('acct1').pool is sm.pool)
+            self.assertFalse(pool.server('acct1').rate_limiter is sm.rate_limiter)
+            self.assertEqual(len(sm.list_servers()['servers']), self.fleet_size)
+            self.assertRaises(SingleHopError, pool.server, 'nobody')
+            pool.remove('acct3')
+            self.assertRaises(SingleHopError, pool.server, 'acct3')
+
+    def test_fair_bulk(self):
+        ids = [s['server_id'] for s in self.module(ServerModule).list_servers()['servers']]
+        lock = threading.Lock()
+        active = dict(('acct%d' % i, 0) for i in range(4))
+        peak = dict(active)
+        def call(sm, server_id):
+            name = 'acct%d' % (int(sm.client_id) - 1000)
+            with lock:
+                active[name] += 1
+                peak[name] = max(peak[name], active[name])
+            time.sleep(0.005)
+            with lock:
+                active[name] -= 1
+            return sm.get_server_bandwidth(server_id)
+        items = {'acct0': ids * 5, 'acct1': ids[:4], 'acct2': ids[:4], 'acct3': ['bogus']}
+        with self.pool(max_workers=8) as pool:
+            results = list(pool.bulk(call, items))
+        self.assertEqual(len(results), len(ids) * 5 + 9)
+        errors = [r for r in results if r.error is not None or not r.result.get('success')]
+        self.assertEqual([(r.account, r.item) for r in errors], [('acct3', 'bogus')])
+        # the small accounts are not queued behind the large one
+        small = [i for i, r in enumerate(results) if r.account != 'acct0']
+        self.assertTrue(max(small) < len(results) // 4)
+        self.assertEqual(peak['acct3'], 1)
+        self.assertTrue(peak['acct0'] <= 8)
+        with self.pool() as pool:
+            results = list(pool.bulk('get_server_ips', [('acct1', ids[0]), ('acct2', ids[1])]))
+            self.assertEqual(sorted(r.account for r in results), ['acct1', 'acct2'])
+            self.assertRaises(SingleHopError, pool.bulk, 'nothing', {'acct1': ids})
+
 if __name__=='__main__':
     unittest.main()